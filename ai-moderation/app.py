@@ -5,11 +5,12 @@ Multi-layer AI analysis for context-aware content moderation
 """
 
 import os
-import json
 import time
+import atexit
 import logging
 from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import cv2
@@ -18,7 +19,7 @@ from PIL import Image, ExifTags
 import torch
 import tempfile
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 
 # AI Libraries
@@ -27,8 +28,15 @@ import mediapipe as mp
 from transformers import BlipProcessor, BlipForConditionalGeneration
 
 # Database
-import mysql.connector
-from mysql.connector import Error
+from moderation_result import CONTENT_MODERATION_INSERT, ModerationResult, moderation_row
+from result_writer import ConnectionManager, ResultWriter
+
+# Per-stage timings and /metrics (stage_metrics.py from the repository root; the
+# image built from this directory alone runs without them)
+try:
+    from stage_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, StageTimer, metrics
+except ImportError:
+    StageTimer = metrics = None
 
 # Configuration
 from dotenv import load_dotenv
@@ -38,30 +46,14 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
-class ModerationResult:
-    """Data class for moderation results"""
-    image_path: str
-    context_type: str
-    model_id: int
-    
-    # NudeNet Results
-    nudity_score: float
-    detected_parts: Dict[str, float]
-    
-    # Pose Analysis
-    pose_classification: str
-    explicit_pose_score: float
-    pose_keypoints: Optional[Dict]
-    
-    # Content Understanding
-    generated_caption: str
-    policy_violations: List[str]
-    
-    # Final Decision
-    moderation_status: str  # 'approved', 'flagged', 'rejected'
-    human_review_required: bool
-    confidence_score: float
+
+def stage_timer(timer, name: str):
+    """timer.stage(name), or a no-op when timings are unavailable"""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def model_load_timer(model: str):
+    return metrics.time_model_load(model) if metrics is not None else nullcontext()
 
 class ContentModerator:
     """AI-powered content moderation system"""
@@ -76,6 +68,10 @@ class ContentModerator:
         self.blip_processor = None
         self.blip_model = None
         
+        # Nudity, pose and caption stages only depend on the image, so they run
+        # concurrently (onnxruntime, MediaPipe and torch release the GIL)
+        self.stage_executor = ThreadPoolExecutor(thread_name_prefix='moderation-stage')
+        
         # Database connection
         self.db_config = {
             'host': os.getenv('DB_HOST', 'localhost'),
@@ -85,6 +81,22 @@ class ContentModerator:
             'port': int(os.getenv('DB_PORT', 3306))
         }
         
+        # Results are written behind the request path: pooled connections,
+        # multi-row INSERT batches and a local journal while MySQL is unavailable
+        self.db_pool = ConnectionManager(self.db_config, pool_size=int(os.getenv('DB_POOL_SIZE', 4)))
+        self.result_writer = ResultWriter(
+            self.db_pool,
+            CONTENT_MODERATION_INSERT,
+            batch_size=int(os.getenv('RESULT_BATCH_SIZE', 50)),
+            flush_interval=float(os.getenv('RESULT_FLUSH_INTERVAL', 1.0)),
+            journal_path=os.getenv('RESULT_JOURNAL', 'moderation_journal.jsonl'),
+            dead_letter_path=os.getenv('RESULT_DEAD_LETTER') or None
+        )
+        atexit.register(self.result_writer.flush)
+        if metrics is not None:
+            metrics.gauge('queue_depth', 'Items waiting in each internal queue',
+                          lambda: {'result_writer': self.result_writer.stats()['pending']}, label='queue')
+        
         # Moderation rules
         self.moderation_rules = {
             'profile_pic': {
@@ -119,25 +131,28 @@ class ContentModerator:
             # Initialize NudeNet
             if self.nude_detector is None:
                 logger.info("Loading NudeNet detector...")
-                self.nude_detector = NudeDetector()
+                with model_load_timer('nudenet'):
+                    self.nude_detector = NudeDetector()
                 logger.info("NudeNet loaded successfully")
             
             # Initialize MediaPipe Pose
             if self.pose_detector is None:
                 logger.info("Loading MediaPipe Pose detector...")
-                self.pose_detector = mp.solutions.pose.Pose(
-                    static_image_mode=True,
-                    model_complexity=2,
-                    enable_segmentation=False,
-                    min_detection_confidence=0.5
-                )
+                with model_load_timer('mediapipe_pose'):
+                    self.pose_detector = mp.solutions.pose.Pose(
+                        static_image_mode=True,
+                        model_complexity=2,
+                        enable_segmentation=False,
+                        min_detection_confidence=0.5
+                    )
                 logger.info("MediaPipe Pose loaded successfully")
             
             # Initialize BLIP for image captioning
             if self.blip_processor is None or self.blip_model is None:
                 logger.info("Loading BLIP model...")
-                self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-                self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+                with model_load_timer('blip'):
+                    self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
+                    self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
                 logger.info("BLIP loaded successfully")
                 
             logger.info("All AI models initialized successfully")
@@ -192,15 +207,17 @@ class ContentModerator:
             logger.error(f"Image landscape conversion failed: {e}")
             return image_path
 
-    def analyze_nudity(self, image_path: str) -> Tuple[float, Dict[str, float]]:
+    def analyze_nudity(self, image_path: str, timer=None) -> Tuple[float, Dict[str, float]]:
         """Analyze nudity using NudeNet with EXIF-normalized image"""
         normalized_path = None
         try:
             # Normalize image orientation first
-            normalized_path = self.normalize_image_orientation(image_path)
+            with stage_timer(timer, 'exif_normalization'):
+                normalized_path = self.normalize_image_orientation(image_path)
             
             # Detect nudity on normalized image
-            results = self.nude_detector.detect(normalized_path)
+            with stage_timer(timer, 'nudenet'):
+                results = self.nude_detector.detect(normalized_path)
             
             # Parse results
             detected_parts = {}
@@ -238,19 +255,21 @@ class ContentModerator:
                 except Exception as e:
                     logger.warning(f"Failed to cleanup temp file {normalized_path}: {e}")
     
-    def analyze_pose(self, image_path: str) -> Tuple[str, float, Optional[Dict]]:
+    def analyze_pose(self, image_path: str, timer=None) -> Tuple[str, float, Optional[Dict]]:
         """Analyze pose using MediaPipe with EXIF-normalized image"""
         normalized_path = None
         try:
             # Normalize image orientation first
-            normalized_path = self.normalize_image_orientation(image_path)
+            with stage_timer(timer, 'exif_normalization'):
+                normalized_path = self.normalize_image_orientation(image_path)
             
             # Load normalized image
             image = cv2.imread(normalized_path)
             image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             
             # Process with MediaPipe
-            results = self.pose_detector.process(image_rgb)
+            with stage_timer(timer, 'mediapipe_pose'):
+                results = self.pose_detector.process(image_rgb)
             
             if not results.pose_landmarks:
                 return "no_pose_detected", 0.0, None
@@ -315,7 +334,7 @@ class ContentModerator:
                 except Exception as e:
                     logger.warning(f"Failed to cleanup temp file {normalized_path}: {e}")
     
-    def generate_caption(self, image_path: str) -> str:
+    def generate_caption(self, image_path: str, timer=None) -> str:
         """Generate image caption using BLIP"""
         try:
             # Load and process image
@@ -323,7 +342,7 @@ class ContentModerator:
             inputs = self.blip_processor(image, return_tensors="pt")
             
             # Generate caption
-            with torch.no_grad():
+            with stage_timer(timer, 'blip'), torch.no_grad():
                 out = self.blip_model.generate(**inputs, max_length=50)
                 caption = self.blip_processor.decode(out[0], skip_special_tokens=True)
             
@@ -333,6 +352,31 @@ class ContentModerator:
             logger.error(f"Error in caption generation: {e}")
             return "Unable to generate caption"
     
+    def generate_captions(self, image_paths: List[str]) -> List[str]:
+        """Caption several images with one batched BLIP generate call"""
+        captions = ["Unable to generate caption"] * len(image_paths)
+        images, positions = [], []
+        for position, image_path in enumerate(image_paths):
+            try:
+                images.append(Image.open(image_path).convert('RGB'))
+                positions.append(position)
+            except Exception as e:
+                logger.error(f"Error loading image for captioning {image_path}: {e}")
+        
+        if not images:
+            return captions
+        
+        try:
+            inputs = self.blip_processor(images=images, return_tensors="pt")
+            with torch.no_grad():
+                out = self.blip_model.generate(**inputs, max_length=50)
+            for position, caption in zip(positions, self.blip_processor.batch_decode(out, skip_special_tokens=True)):
+                captions[position] = caption
+        except Exception as e:
+            logger.error(f"Error in batched caption generation: {e}")
+        
+        return captions
+    
     def check_policy_violations(self, caption: str, context_type: str) -> List[str]:
         """Check for policy violations based on caption and context"""
         violations = []
@@ -385,50 +429,10 @@ class ContentModerator:
             return "approved", False, confidence * 0.9
     
     def save_moderation_result(self, result: ModerationResult) -> bool:
-        """Save moderation result to database"""
-        try:
-            connection = mysql.connector.connect(**self.db_config)
-            cursor = connection.cursor()
-            
-            query = """
-                INSERT INTO content_moderation (
-                    image_path, model_id, context_type, nudity_score, detected_parts,
-                    pose_classification, explicit_pose_score, pose_keypoints,
-                    generated_caption, policy_violations, moderation_status,
-                    human_review_required, created_at
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW()
-                )
-            """
-            
-            values = (
-                result.image_path,
-                result.model_id,
-                result.context_type,
-                result.nudity_score,
-                json.dumps(result.detected_parts),
-                result.pose_classification,
-                result.explicit_pose_score,
-                json.dumps(result.pose_keypoints) if result.pose_keypoints else None,
-                result.generated_caption,
-                json.dumps(result.policy_violations),
-                result.moderation_status,
-                result.human_review_required
-            )
-            
-            cursor.execute(query, values)
-            connection.commit()
-            
-            logger.info(f"Saved moderation result for {result.image_path}")
-            return True
-            
-        except Error as e:
-            logger.error(f"Error saving to database: {e}")
-            return False
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+        """Queue moderation result for the background database writer"""
+        queued = self.result_writer.submit(moderation_row(result))
+        logger.info(f"Queued moderation result for {result.image_path}")
+        return queued
     
     def setup_routes(self):
         """Setup Flask routes"""
@@ -442,9 +446,17 @@ class ContentModerator:
                     self.pose_detector is not None,
                     self.blip_processor is not None,
                     self.blip_model is not None
-                ])
+                ]),
+                'result_writer': self.result_writer.stats()
             })
         
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics_endpoint():
+            """Prometheus metrics: per-stage latency histograms, queue depth, in-flight requests, model load times"""
+            if metrics is None:
+                return jsonify({'error': 'stage_metrics module not installed'}), 404
+            return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+        
         @self.app.route('/analyze', methods=['POST'])
         def analyze_image():
             try:
@@ -461,7 +473,12 @@ class ContentModerator:
                     return jsonify({'error': 'Failed to initialize AI models'}), 500
                 
                 # Perform analysis
-                result = self.moderate_image(image_path, context_type, model_id)
+                timer = StageTimer() if StageTimer is not None else None
+                if metrics is not None:
+                    with metrics.track_in_flight():
+                        result = self.moderate_image(image_path, context_type, model_id, timer=timer)
+                else:
+                    result = self.moderate_image(image_path, context_type, model_id)
                 
                 if result:
                     return jsonify({
@@ -476,6 +493,9 @@ class ContentModerator:
                             'explicit_pose_score': result.explicit_pose_score,
                             'generated_caption': result.generated_caption,
                             'policy_violations': result.policy_violations
+                        },
+                        'metadata': {
+                            'timings': timer.as_metadata() if timer is not None else None
                         }
                     })
                 else:
@@ -485,55 +505,83 @@ class ContentModerator:
                 logger.error(f"Error in analyze endpoint: {e}")
                 return jsonify({'error': str(e)}), 500
     
-    def moderate_image(self, image_path: str, context_type: str, model_id: int) -> Optional[ModerationResult]:
-        """Main moderation function"""
+    def moderate_image(self, image_path: str, context_type: str, model_id: int,
+                       timer=None) -> Optional[ModerationResult]:
+        """Main moderation function (stage durations are recorded on timer when given)"""
         try:
             logger.info(f"Analyzing image: {image_path} for context: {context_type}")
             
-            # 1. Nudity Analysis
-            nudity_score, detected_parts = self.analyze_nudity(image_path)
-            
-            # 2. Pose Analysis
-            pose_class, explicit_pose_score, pose_keypoints = self.analyze_pose(image_path)
-            
-            # 3. Caption Generation
-            caption = self.generate_caption(image_path)
-            
-            # 4. Policy Violation Check
-            violations = self.check_policy_violations(caption, context_type)
-            
-            # 5. Apply Moderation Rules
-            moderation_status, human_review, confidence = self.apply_moderation_rules(
-                nudity_score, pose_class, explicit_pose_score, violations, context_type
-            )
-            
-            # 6. Create Result Object
-            result = ModerationResult(
-                image_path=image_path,
-                context_type=context_type,
-                model_id=model_id,
-                nudity_score=nudity_score,
-                detected_parts=detected_parts,
-                pose_classification=pose_class,
-                explicit_pose_score=explicit_pose_score,
-                pose_keypoints=pose_keypoints,
-                generated_caption=caption,
-                policy_violations=violations,
-                moderation_status=moderation_status,
-                human_review_required=human_review,
-                confidence_score=confidence
-            )
-            
-            # 7. Save to Database
-            self.save_moderation_result(result)
-            
-            logger.info(f"Analysis complete: {moderation_status} (confidence: {confidence:.2f})")
+            # 1-3. Nudity, Pose and Caption stages run in parallel
+            nudity_future = self.stage_executor.submit(self.analyze_nudity, image_path, timer)
+            pose_future = self.stage_executor.submit(self.analyze_pose, image_path, timer)
+            caption_future = self.stage_executor.submit(self.generate_caption, image_path, timer)
+            
+            # 4-6. Policy check, moderation rules and result object
+            result = self.build_result(image_path, context_type, model_id, nudity_future.result(),
+                                       pose_future.result(), caption_future.result())
+            
+            # 7. Save to Database (queued for the background writer)
+            with stage_timer(timer, 'db_write'):
+                self.save_moderation_result(result)
+            
+            logger.info(f"Analysis complete: {result.moderation_status} (confidence: {result.confidence_score:.2f})")
+            if timer is not None:
+                metrics.observe(timer, context_type, result.moderation_status)
             return result
             
         except Exception as e:
             logger.error(f"Error in moderate_image: {e}")
+            if timer is not None:
+                metrics.observe(timer, context_type, 'error')
             return None
     
+    def moderate_batch(self, items: List[Tuple[str, str, int]]) -> List[ModerationResult]:
+        """Moderate (image_path, context_type, model_id) items together without saving
+
+        Nudity and pose stages fan out across the stage executor while captions
+        for the whole batch come from a single BLIP generate call.
+        """
+        nudity_futures = [self.stage_executor.submit(self.analyze_nudity, path) for path, _, _ in items]
+        pose_futures = [self.stage_executor.submit(self.analyze_pose, path) for path, _, _ in items]
+        captions = self.generate_captions([path for path, _, _ in items])
+        
+        return [
+            self.build_result(path, context_type, model_id, nudity_future.result(), pose_future.result(), caption)
+            for (path, context_type, model_id), nudity_future, pose_future, caption
+            in zip(items, nudity_futures, pose_futures, captions)
+        ]
+    
+    def build_result(self, image_path: str, context_type: str, model_id: int,
+                     nudity: Tuple[float, Dict[str, float]], pose: Tuple[str, float, Optional[Dict]],
+                     caption: str) -> ModerationResult:
+        """Combine stage outputs into the final moderation decision"""
+        nudity_score, detected_parts = nudity
+        pose_class, explicit_pose_score, pose_keypoints = pose
+        
+        # Policy Violation Check
+        violations = self.check_policy_violations(caption, context_type)
+        
+        # Apply Moderation Rules
+        moderation_status, human_review, confidence = self.apply_moderation_rules(
+            nudity_score, pose_class, explicit_pose_score, violations, context_type
+        )
+        
+        return ModerationResult(
+            image_path=image_path,
+            context_type=context_type,
+            model_id=model_id,
+            nudity_score=nudity_score,
+            detected_parts=detected_parts,
+            pose_classification=pose_class,
+            explicit_pose_score=explicit_pose_score,
+            pose_keypoints=pose_keypoints,
+            generated_caption=caption,
+            policy_violations=violations,
+            moderation_status=moderation_status,
+            human_review_required=human_review,
+            confidence_score=confidence
+        )
+    
     def run(self, host='0.0.0.0', port=5001, debug=False):
         """Run the Flask application"""
         logger.info(f"Starting AI Content Moderation Service on {host}:{port}")
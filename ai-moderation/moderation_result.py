@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+phoenix4ge AI Content Moderation - result record
+The ModerationResult dataclass and its content_moderation row, kept free of the
+model dependencies so the queue worker and result writer can use them alone.
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# executemany() with this statement is sent as a single multi-row INSERT
+CONTENT_MODERATION_INSERT = """
+    INSERT INTO content_moderation (
+        image_path, model_id, context_type, nudity_score, detected_parts,
+        pose_classification, explicit_pose_score, pose_keypoints,
+        generated_caption, policy_violations, moderation_status,
+        human_review_required
+    ) VALUES (
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+    )
+"""
+
+
+@dataclass
+class ModerationResult:
+    """Data class for moderation results"""
+    image_path: str
+    context_type: str
+    model_id: int
+
+    # NudeNet Results
+    nudity_score: float
+    detected_parts: Dict[str, float]
+
+    # Pose Analysis
+    pose_classification: str
+    explicit_pose_score: float
+    pose_keypoints: Optional[Dict]
+
+    # Content Understanding
+    generated_caption: str
+    policy_violations: List[str]
+
+    # Final Decision
+    moderation_status: str  # 'approved', 'flagged', 'rejected'
+    human_review_required: bool
+    confidence_score: float
+
+
+def moderation_row(result: ModerationResult) -> Tuple:
+    """Column values for CONTENT_MODERATION_INSERT"""
+    return (
+        result.image_path,
+        result.model_id,
+        result.context_type,
+        result.nudity_score,
+        json.dumps(result.detected_parts),
+        result.pose_classification,
+        result.explicit_pose_score,
+        json.dumps(result.pose_keypoints) if result.pose_keypoints else None,
+        result.generated_caption,
+        json.dumps(result.policy_violations),
+        result.moderation_status,
+        result.human_review_required
+    )
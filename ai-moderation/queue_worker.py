@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+phoenix4ge AI Content Moderation - queue worker mode
+Pulls pending rows from moderation_requests in batches, moderates them together
+and writes the results back with multi-row statements. Claims use
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker processes can drain
+the same table without stepping on each other.
+
+Usage:
+    python queue_worker.py --batch-size 16
+    python queue_worker.py --sqlite /tmp/moderation.db --once   # local stand-in
+"""
+
+import os
+import time
+import socket
+import signal
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Callable, Dict, List, Tuple
+
+from moderation_result import CONTENT_MODERATION_INSERT, ModerationResult, moderation_row
+
+logger = logging.getLogger(__name__)
+
+# SQLite stand-in for local runs and tests (no SKIP LOCKED; writers serialize instead)
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS moderation_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_path TEXT NOT NULL,
+    model_id INTEGER NOT NULL,
+    context_type TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at TIMESTAMP,
+    moderation_status TEXT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_status_created ON moderation_requests (status, created_at);
+CREATE TABLE IF NOT EXISTS content_moderation (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_path TEXT NOT NULL,
+    model_id INTEGER NOT NULL,
+    context_type TEXT NOT NULL,
+    nudity_score REAL DEFAULT 0,
+    detected_parts TEXT,
+    pose_classification TEXT,
+    explicit_pose_score REAL DEFAULT 0,
+    pose_keypoints TEXT,
+    generated_caption TEXT,
+    policy_violations TEXT,
+    moderation_status TEXT NOT NULL,
+    human_review_required BOOLEAN DEFAULT 0,
+    confidence_score REAL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class ModerationQueue:
+    """Batch claim/complete operations on moderation_requests for MySQL or a SQLite stand-in"""
+
+    def __init__(self, connect: Callable, dialect: str = 'mysql', lease_seconds: int = 600,
+                 max_attempts: int = 3):
+        self.connect = connect
+        self.dialect = dialect
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = None
+
+    @classmethod
+    def mysql(cls, db_config: Dict, **kwargs) -> 'ModerationQueue':
+        # Imported here so the SQLite stand-in runs without mysql-connector installed
+        import mysql.connector
+        return cls(lambda: mysql.connector.connect(autocommit=False, **db_config), 'mysql', **kwargs)
+
+    @classmethod
+    def sqlite(cls, path: str, **kwargs) -> 'ModerationQueue':
+        def connect():
+            connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+            connection.executescript(SQLITE_SCHEMA)
+            return connection
+        return cls(connect, 'sqlite', **kwargs)
+
+    def _sql(self, query: str) -> str:
+        if self.dialect == 'sqlite':
+            return query.replace('%s', '?').replace('NOW()', 'CURRENT_TIMESTAMP')
+        return query
+
+    def _placeholders(self, count: int) -> str:
+        return ', '.join(['%s'] * count)
+
+    def _cursor(self):
+        if self.connection is None:
+            self.connection = self.connect()
+        return self.connection.cursor()
+
+    def _begin(self, cursor):
+        # MySQL opens the transaction implicitly (autocommit off); SQLite takes the write lock up front
+        if self.dialect == 'sqlite':
+            cursor.execute('BEGIN IMMEDIATE')
+
+    def _transaction(self, work: Callable):
+        cursor = self._cursor()
+        try:
+            self._begin(cursor)
+            outcome = work(cursor)
+            self.connection.commit()
+            return outcome
+        except Exception:
+            try:
+                self.connection.rollback()
+            finally:
+                # Drop the connection so the next call reconnects cleanly
+                self.close()
+            raise
+        finally:
+            cursor.close()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            finally:
+                self.connection = None
+
+    def enqueue(self, items: List[Tuple[str, int, str]]) -> int:
+        """Add (image_path, model_id, context_type) requests; mostly for tests and backfills"""
+        query = self._sql('INSERT INTO moderation_requests (image_path, model_id, context_type) VALUES (%s, %s, %s)')
+        self._transaction(lambda cursor: cursor.executemany(query, items))
+        return len(items)
+
+    def requeue_stale(self) -> int:
+        """Release rows whose worker died mid-batch (claimed longer than the lease ago)"""
+        if self.dialect == 'sqlite':
+            expired = f"claimed_at < datetime('now', '-{int(self.lease_seconds)} seconds')"
+        else:
+            expired = f"claimed_at < NOW() - INTERVAL {int(self.lease_seconds)} SECOND"
+        query = self._sql(
+            f"UPDATE moderation_requests SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END, "
+            f"claimed_by = NULL, error = 'worker lease expired' WHERE status = 'processing' AND {expired}")
+
+        def work(cursor):
+            cursor.execute(query, (self.max_attempts,))
+            return cursor.rowcount
+        released = self._transaction(work)
+        if released:
+            logger.warning(f"Released {released} stale moderation request(s)")
+        return released
+
+    def claim(self, batch_size: int, worker: str) -> List[Tuple[int, str, int, str]]:
+        """Lock and mark up to batch_size pending rows; returns (id, image_path, model_id, context_type)"""
+        select = ("SELECT id, image_path, model_id, context_type FROM moderation_requests "
+                  "WHERE status = 'pending' ORDER BY id LIMIT %s")
+        if self.dialect == 'mysql':
+            select += ' FOR UPDATE SKIP LOCKED'
+
+        def work(cursor):
+            cursor.execute(self._sql(select), (batch_size,))
+            rows = [tuple(row) for row in cursor.fetchall()]
+            if rows:
+                ids = [row[0] for row in rows]
+                cursor.execute(self._sql(
+                    f"UPDATE moderation_requests SET status = 'processing', claimed_by = %s, claimed_at = NOW(), "
+                    f"attempts = attempts + 1 WHERE id IN ({self._placeholders(len(ids))})"), [worker] + ids)
+            return rows
+        return self._transaction(work)
+
+    def complete(self, finished: List[Tuple[int, ModerationResult]], failed: List[Tuple[int, str]]):
+        """Write a batch back in one transaction: multi-row INSERT of results plus request status updates"""
+        def work(cursor):
+            if finished:
+                cursor.executemany(self._sql(CONTENT_MODERATION_INSERT),
+                                   [moderation_row(result) for _, result in finished])
+                cursor.executemany(self._sql(
+                    "UPDATE moderation_requests SET status = 'completed', moderation_status = %s, error = NULL "
+                    "WHERE id = %s"), [(result.moderation_status, request_id) for request_id, result in finished])
+            if failed:
+                cursor.executemany(self._sql(
+                    "UPDATE moderation_requests SET status = CASE WHEN attempts >= %s THEN 'failed' "
+                    "ELSE 'pending' END, claimed_by = NULL, error = %s WHERE id = %s"),
+                    [(self.max_attempts, error, request_id) for request_id, error in failed])
+        self._transaction(work)
+
+
+class QueueWorker:
+    """Claim, moderate and write back batches until stopped
+
+    moderator is an app.ContentModerator (anything with moderate_batch(items)).
+    """
+
+    def __init__(self, moderator, queue: ModerationQueue, batch_size: int = 16,
+                 poll_interval: float = 2.0):
+        self.moderator = moderator
+        self.queue = queue
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.stop_event = threading.Event()
+        self.processed = 0
+        self.failed = 0
+
+    def run_once(self) -> int:
+        """Process one batch; returns the number of requests claimed"""
+        rows = self.queue.claim(self.batch_size, self.worker_id)
+        if not rows:
+            return 0
+
+        started = time.time()
+        # A missing file would otherwise come back as a clean 0% nudity score
+        runnable = [row for row in rows if os.path.exists(row[1])]
+        failed = [(row[0], f'image not found: {row[1]}') for row in rows if not os.path.exists(row[1])]
+
+        finished = []
+        if runnable:
+            try:
+                results = self.moderator.moderate_batch(
+                    [(image_path, context_type, model_id) for _, image_path, model_id, context_type in runnable])
+                finished = [(row[0], result) for row, result in zip(runnable, results)]
+            except Exception as e:
+                logger.error(f"Batch moderation failed: {e}")
+                failed += [(row[0], str(e)) for row in runnable]
+
+        self.queue.complete(finished, failed)
+        self.processed += len(finished)
+        self.failed += len(failed)
+        logger.info(f"Moderated batch of {len(rows)} in {time.time() - started:.2f}s "
+                    f"({len(finished)} done, {len(failed)} failed)")
+        return len(rows)
+
+    def run(self, once: bool = False):
+        """Drain the queue; with once=True stop when it is empty"""
+        self.queue.requeue_stale()
+        last_requeue = time.time()
+        while not self.stop_event.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                logger.error(f"Queue worker error: {e}")
+                claimed = 0
+
+            if claimed:
+                continue
+            if once:
+                break
+            if time.time() - last_requeue > 60:
+                self.queue.requeue_stale()
+                last_requeue = time.time()
+            self.stop_event.wait(self.poll_interval)
+
+        logger.info(f"Queue worker {self.worker_id} stopped ({self.processed} processed, {self.failed} failed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pull-based moderation queue worker')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('QUEUE_BATCH_SIZE', 16)))
+    parser.add_argument('--poll-interval', type=float, default=float(os.getenv('QUEUE_POLL_INTERVAL', 2.0)))
+    parser.add_argument('--lease-seconds', type=int, default=int(os.getenv('QUEUE_LEASE_SECONDS', 600)),
+                        help='Claimed rows older than this are released back to pending')
+    parser.add_argument('--sqlite', help='Use a local SQLite file instead of MySQL (development/testing)')
+    parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+    args = parser.parse_args()
+
+    # The models (torch, MediaPipe, BLIP) are only needed to actually run
+    from app import ContentModerator
+    moderator = ContentModerator()
+    if not moderator.initialize_models():
+        raise SystemExit('Failed to initialize AI models')
+
+    if args.sqlite:
+        queue = ModerationQueue.sqlite(args.sqlite, lease_seconds=args.lease_seconds)
+    else:
+        queue = ModerationQueue.mysql(moderator.db_config, lease_seconds=args.lease_seconds)
+
+    worker = QueueWorker(moderator, queue, batch_size=args.batch_size, poll_interval=args.poll_interval)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop_event.set())
+
+    logger.info(f"Starting queue worker {worker.worker_id} (batch size {args.batch_size}, "
+                f"{'sqlite ' + args.sqlite if args.sqlite else 'mysql'})")
+    worker.run(once=args.once)
+    queue.close()
+
+
+if __name__ == '__main__':
+    main()
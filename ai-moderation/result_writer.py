@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+phoenix4ge AI Content Moderation - pooled, write-behind result storage
+Moderation results are queued in memory and a background thread writes them as
+multi-row INSERTs over pooled connections, flushing by batch size or interval.
+When MySQL is slow or down, batches are appended to a local JSONL journal and
+replayed once the database answers again, so the request path never waits on
+the database. A batch the database rejects (foreign key, bad enum value) is
+retried row by row; rows that fail for such data reasons go to a dead-letter
+file instead of the journal, so they cannot block replay of everything behind
+them. At shutdown flush() stops the writer thread and writes (or, if the
+database hangs, journals) the batch it was holding along with everything
+still queued.
+"""
+
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    from mysql.connector import errors as mysql_errors, pooling
+except ImportError:
+    mysql_errors = pooling = None
+
+logger = logging.getLogger(__name__)
+
+# Errors caused by the row itself (sqlite3 for local stand-ins and tests)
+PERMANENT_ERRORS = (sqlite3.IntegrityError, sqlite3.DataError)
+if mysql_errors is not None:
+    PERMANENT_ERRORS += (mysql_errors.IntegrityError, mysql_errors.DataError)
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """Errors caused by the row itself: retrying the same row can never succeed"""
+    return isinstance(error, PERMANENT_ERRORS)
+
+
+class ConnectionManager:
+    """Lazily created MySQL connection pool (re-created after a fork)"""
+
+    def __init__(self, db_config: Dict, pool_size: int = 4, pool_name: str = 'moderation'):
+        self.db_config = db_config
+        self.pool_size = pool_size
+        self.pool_name = pool_name
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        """Borrow a pooled connection; close() returns it to the pool"""
+        if pooling is None:
+            raise RuntimeError('mysql-connector-python is not installed')
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = pooling.MySQLConnectionPool(
+                    pool_name=f'{self.pool_name}_{os.getpid()}',
+                    pool_size=self.pool_size,
+                    pool_reset_session=True,
+                    **self.db_config
+                )
+                self._pid = os.getpid()
+        return self._pool.get_connection()
+
+
+class ResultWriter:
+    """Background writer that coalesces rows into executemany() batches with a JSONL spill journal"""
+
+    def __init__(self, connections: ConnectionManager, insert_query: str, batch_size: int = 50,
+                 flush_interval: float = 1.0, journal_path: str = 'moderation_journal.jsonl',
+                 replay_interval: float = 30.0, max_pending: int = 10000, dead_letter_path: Optional[str] = None):
+        self.connections = connections
+        self.insert_query = insert_query
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal_path = journal_path
+        self.dead_letter_path = dead_letter_path or f'{journal_path}.dead'
+        self.replay_interval = replay_interval
+        self.max_pending = max_pending
+
+        self._queue = None
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._in_flight = None
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._last_replay = 0.0
+
+        self.written = 0
+        self.batches = 0
+        self.journaled = 0
+        self.replayed = 0
+        self.dead_lettered = 0
+        self.last_error = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._stop = threading.Event()
+            self._in_flight = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, row: Sequence) -> bool:
+        """Queue one row for writing; never blocks on the database"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(tuple(row))
+        except queue.Full:
+            logger.warning("Result write queue full, journaling row")
+            self._journal([row])
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                # Visible to flush() in case this write is still hanging at shutdown
+                self._in_flight = batch
+                try:
+                    self._write(batch)
+                finally:
+                    self._in_flight = None
+            if not self._stop.is_set() and time.time() - self._last_replay > self.replay_interval:
+                self._last_replay = time.time()
+                self.replay()
+
+    def _collect(self) -> List[tuple]:
+        """Wait for a first row, then gather more until batch_size or flush_interval"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, rows: List[Sequence]):
+        connection = self.connections.get_connection()
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.executemany(self.insert_query, [tuple(row) for row in rows])
+                connection.commit()
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+
+    def _insert_isolating(self, rows: List[Sequence]) -> Tuple[int, List[Sequence]]:
+        """Insert rows, isolating rows the database rejects; returns (inserted, rows left by a transient error)"""
+        try:
+            self._insert(rows)
+            return len(rows), []
+        except Exception as e:
+            self.last_error = str(e)
+            if not is_permanent_error(e):
+                return 0, list(rows)
+            logger.warning(f"Batch of {len(rows)} result(s) rejected ({e}), retrying row by row")
+
+        inserted = 0
+        for index, row in enumerate(rows):
+            try:
+                self._insert([row])
+                inserted += 1
+            except Exception as e:
+                self.last_error = str(e)
+                if not is_permanent_error(e):
+                    return inserted, list(rows[index:])
+                self._dead_letter(row, e)
+        return inserted, []
+
+    def _write(self, rows: List[Sequence]) -> bool:
+        inserted, remaining = self._insert_isolating(rows)
+        if inserted:
+            self.written += inserted
+            self.batches += 1
+            logger.info(f"Saved {inserted} moderation result(s)")
+        if remaining:
+            logger.error(f"Error saving to database, journaling {len(remaining)} result(s): {self.last_error}")
+            self._journal(remaining)
+            return False
+        return True
+
+    def _dead_letter(self, row: Sequence, error: Exception):
+        logger.error(f"Moderation result rejected by the database, moved to {self.dead_letter_path}: {error}")
+        with self._journal_lock:
+            with open(self.dead_letter_path, 'a') as dead_letter:
+                dead_letter.write(json.dumps({'row': list(row), 'error': str(error), 'at': time.time()}) + '\n')
+                dead_letter.flush()
+                os.fsync(dead_letter.fileno())
+        self.dead_lettered += 1
+
+    def _journal(self, rows: List[Sequence]):
+        with self._journal_lock:
+            with open(self.journal_path, 'a') as journal:
+                for row in rows:
+                    journal.write(json.dumps(list(row)) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+        self.journaled += len(rows)
+
+    def replay(self) -> int:
+        """Insert journaled rows once the database is reachable again"""
+        replaying_path = f'{self.journal_path}.replaying'
+        with self._journal_lock:
+            has_journal = os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0
+            if not has_journal and not os.path.exists(replaying_path):
+                return 0
+            # A previous replay may have paused or died mid-way; its rows go first
+            if not os.path.exists(replaying_path):
+                os.replace(self.journal_path, replaying_path)
+            elif has_journal:
+                with open(replaying_path, 'a') as target, open(self.journal_path) as source:
+                    target.write(source.read())
+                os.unlink(self.journal_path)
+
+        with open(replaying_path) as journal:
+            rows = [json.loads(line) for line in journal if line.strip()]
+
+        replayed = 0
+        for start in range(0, len(rows), self.batch_size):
+            inserted, remaining = self._insert_isolating(rows[start:start + self.batch_size])
+            replayed += inserted
+            if remaining:
+                # Put back whatever did not make it and try again later
+                pending = remaining + rows[start + self.batch_size:]
+                with self._journal_lock:
+                    with open(replaying_path, 'w') as journal:
+                        journal.writelines(json.dumps(row) + '\n' for row in pending)
+                logger.warning(f"Journal replay paused, {len(pending)} result(s) pending: {self.last_error}")
+                self.replayed += replayed
+                return replayed
+
+        os.unlink(replaying_path)
+        self.replayed += replayed
+        logger.info(f"Replayed {replayed} journaled moderation result(s)")
+        return replayed
+
+    def flush(self, timeout: float = 30.0):
+        """Stop the writer thread, then write everything queued so far (used at shutdown)
+
+        If the thread is still stuck in a write after timeout seconds, its batch
+        and the queued rows are journaled instead, to be replayed on the next start
+        (at least once: if that write does go through after all, its rows are
+        stored twice rather than lost).
+        """
+        if self._queue is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        stuck = self._thread.is_alive()
+        in_flight = self._in_flight if stuck else None
+
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        # A later submit() starts a fresh writer thread
+        self._pid = None
+
+        if stuck:
+            rows = list(in_flight or []) + rows
+            logger.warning(f"Result writer did not stop within {timeout}s, journaling {len(rows)} result(s)")
+            if rows:
+                self._journal(rows)
+            return
+        for start in range(0, len(rows), self.batch_size):
+            self._write(rows[start:start + self.batch_size])
+
+    def stats(self) -> Dict:
+        return {
+            'pending': self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+            'written': self.written,
+            'batches': self.batches,
+            'journaled': self.journaled,
+            'replayed': self.replayed,
+            'dead_lettered': self.dead_lettered,
+            'journal_bytes': sum(os.path.getsize(path) for path in (self.journal_path, f'{self.journal_path}.replaying')
+                                 if os.path.exists(path)),
+            'last_error': self.last_error
+        }
@@ -74,4 +74,27 @@ CREATE TABLE IF NOT EXISTS moderation_rules (
     UNIQUE KEY unique_context_rule (context_type, rule_name),
     INDEX idx_context (context_type),
     INDEX idx_active (is_active)
-);
\ No newline at end of file
+);
+
+-- Pending moderation work, claimed in batches by queue_worker.py
+-- (SELECT ... FOR UPDATE SKIP LOCKED lets any number of workers drain it)
+CREATE TABLE IF NOT EXISTS moderation_requests (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    image_path VARCHAR(255) NOT NULL,
+    model_id INT NOT NULL,
+    context_type ENUM('profile_pic', 'public_gallery', 'premium_gallery', 'private_content') NOT NULL,
+    status ENUM('pending', 'processing', 'completed', 'failed') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    claimed_by VARCHAR(100) NULL,
+    claimed_at TIMESTAMP NULL,
+    moderation_status ENUM('approved', 'flagged', 'rejected') NULL,
+    error TEXT,
+    
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    
+    FOREIGN KEY (model_id) REFERENCES models(id) ON DELETE CASCADE,
+    
+    INDEX idx_status_created (status, created_at),
+    INDEX idx_claimed (status, claimed_at)
+);
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Asyncio HTTP front end for the v4 configurable pipeline
+/analyze requests are read on the event loop and handed to a bounded
+InferenceQueue feeding the model worker threads. When the queue is full the
+client gets 429 with Retry-After right away, so overload shows up as fast
+rejections instead of connections piling up until the caller times out.
+
+Requests are scheduled in priority lanes: a profile_pic change someone is
+waiting on goes ahead of gallery uploads and bulk private_content imports.
+The lane comes from the `priority` form field when given, else context_type.
+Within a lane, creators (model_id) get weighted fair shares of the workers.
+
+Like the Flask server, /analyze also takes a raw application/octet-stream
+body or a shared image_path, and --unix-socket serves same-host callers.
+
+Usage:
+    python async_frontend.py --port 5000 --workers 4 --max-depth 32 --aging-seconds 10
+    TENANT_WEIGHTS="12:2,40:0.5" python async_frontend.py --tenant-share 0.5
+    python async_frontend.py --unix-socket /run/phoenix4ge/moderation.sock
+"""
+
+import os
+import asyncio
+import logging
+import argparse
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+from inference_queue import InferenceQueue, QueueFullError
+from request_profiler import profiling_allowed
+from stage_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from upload_buffer import PARAM_HEADER_PREFIX, RAW_IMAGE_MIMETYPE, UNIX_SOCKET, read_shared_upload
+import enhanced_minimal_v4_configurable as pipeline
+
+logger = logging.getLogger(__name__)
+
+# Same limit as the Flask servers' MAX_CONTENT_LENGTH
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+
+# Lanes, highest priority first; context_type values follow ai-moderation/schema.sql
+LANES = ['interactive', 'standard', 'bulk']
+CONTEXT_LANES = {
+    'profile_pic': 'interactive',
+    'public_gallery': 'standard',
+    'premium_gallery': 'standard',
+    'private_content': 'bulk'
+}
+DEFAULT_LANE = 'standard'
+
+
+def build_lanes(max_depth: int) -> List[Tuple[str, int]]:
+    """Per-lane bounds: bulk imports may queue deeper since nobody is waiting on them"""
+    return [('interactive', max_depth), ('standard', max_depth), ('bulk', max_depth * 4)]
+
+
+def parse_tenant_weights(spec: str) -> Dict[str, float]:
+    """Parse "model_id:weight,model_id:weight" (e.g. TENANT_WEIGHTS="12:2,40:0.5")"""
+    weights = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        tenant, _, weight = entry.partition(':')
+        try:
+            weights[str(int(tenant))] = float(weight)
+        except ValueError:
+            logger.warning(f"⚠️ Ignoring invalid tenant weight '{entry}'")
+    return weights
+
+
+def select_lane(form: Dict) -> str:
+    """Explicit `priority` form field wins; otherwise map context_type"""
+    priority = (form.get('priority') or '').strip().lower()
+    if priority in LANES:
+        return priority
+    return CONTEXT_LANES.get(form.get('context_type', ''), DEFAULT_LANE)
+
+
+def run_analysis(payload: Tuple[bytes, Dict]) -> Tuple[Dict, int]:
+    """Queue handler: runs on an inference worker thread"""
+    image_bytes, form = payload
+    return pipeline.analyze_upload(image_bytes, form)
+
+
+def header_query_params(request: web.Request) -> Dict:
+    """Parameters from X-Moderation-* headers and the query string (query wins)"""
+    params = {}
+    for name, value in request.headers.items():
+        if name.lower().startswith(PARAM_HEADER_PREFIX.lower()):
+            params[name[len(PARAM_HEADER_PREFIX):].lower().replace('-', '_')] = value
+    params.update(request.query)
+    return params
+
+
+async def read_analyze_form(request: web.Request) -> Tuple[bytes, Dict]:
+    """Read the image and parameters: raw body, multipart 'image' part, or shared image_path"""
+    form = header_query_params(request)
+    if request.content_type == RAW_IMAGE_MIMETYPE:
+        image_bytes = await request.read()
+        if not image_bytes:
+            raise web.HTTPBadRequest(text='Empty request body')
+        return image_bytes, form
+
+    if not request.content_type.startswith('multipart/'):
+        if request.content_type == 'application/json':
+            try:
+                body = await request.json()
+            except ValueError:
+                raise web.HTTPBadRequest(text='Invalid JSON body')
+            if not isinstance(body, dict):
+                raise web.HTTPBadRequest(text='JSON body must be an object')
+            form.update({key: str(value) for key, value in body.items() if value is not None})
+        elif request.content_type == 'application/x-www-form-urlencoded':
+            form.update(await request.post())
+        return await read_shared_image(form), form
+
+    reader = await request.multipart()
+    image_bytes = None
+
+    while True:
+        part = await reader.next()
+        if part is None:
+            break
+        if part.name == 'image':
+            if not part.filename:
+                raise web.HTTPBadRequest(text='Empty filename')
+            image_bytes = bytes(await part.read(decode=False))
+            if len(image_bytes) > MAX_UPLOAD_BYTES:
+                raise web.HTTPRequestEntityTooLarge(max_size=MAX_UPLOAD_BYTES, actual_size=len(image_bytes))
+        elif part.name:
+            form[part.name] = await part.text()
+
+    if image_bytes is None:
+        image_bytes = await read_shared_image(form)
+    return image_bytes, form
+
+
+async def read_shared_image(form: Dict):
+    """Bytes of form['image_path'] under SHARED_UPLOAD_ROOT (None when not given)"""
+    if not form.get('image_path'):
+        return None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, read_shared_upload, form['image_path'])
+    except (PermissionError, FileNotFoundError) as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+
+async def analyze_endpoint(request: web.Request) -> web.Response:
+    """Main image analysis endpoint (same form fields as the Flask /analyze)"""
+    queue: InferenceQueue = request.app['inference_queue']
+    try:
+        image_bytes, form = await read_analyze_form(request)
+    except web.HTTPException as e:
+        return web.json_response({'success': False, 'error': e.text}, status=e.status)
+
+    if image_bytes is None:
+        return web.json_response({'success': False, 'error': 'No image file provided'}, status=400)
+    try:
+        # Normalized so '7', '07' and ' 7' are one tenant
+        tenant = str(pipeline.parse_model_id(form))
+    except ValueError as e:
+        return web.json_response({'success': False, 'error': str(e)}, status=400)
+
+    lane = select_lane(form)
+    try:
+        future = queue.submit((image_bytes, form), lane=lane, tenant=tenant)
+    except QueueFullError as e:
+        logger.warning(f"🚦 {e}")
+        return web.json_response({
+            'success': False,
+            'error': 'Inference queue full',
+            'queue_lane': e.lane,
+            'queue_tenant': e.tenant,
+            'queue_depth': e.depth,
+            'retry_after': e.retry_after
+        }, status=429, headers={'Retry-After': str(e.retry_after)})
+
+    try:
+        result, status = await asyncio.wrap_future(future)
+    except Exception as e:
+        logger.error(f"API endpoint error: {e}")
+        return web.json_response({
+            'success': False,
+            'error': str(e),
+            'analysis_version': '4.0_configurable_error'
+        }, status=500)
+
+    return web.json_response(result, status=status)
+
+
+async def health_endpoint(request: web.Request) -> web.Response:
+    """Pipeline health plus inference queue depth and wait times"""
+    health = pipeline.health_status()
+    health['frontend'] = 'asyncio'
+    health['inference_queue'] = request.app['inference_queue'].stats()
+    return web.json_response(health)
+
+
+async def debug_slow_endpoint(request: web.Request) -> web.Response:
+    """Flight recorder: the slowest and most recently failed analyses (?limit=N), admin only"""
+    if not profiling_allowed(request.headers.get('X-Admin-Token')):
+        return web.json_response({'success': False, 'error': 'Debug endpoints not allowed'}, status=403)
+    limit = request.query.get('limit')
+    return web.json_response(pipeline.flight_recorder.snapshot(int(limit) if limit and limit.isdigit() else None))
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Pipeline stage histograms plus inference queue gauges, in Prometheus text format"""
+    return web.Response(body=metrics.render(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+
+def create_app(workers: int, max_depth: int, aging_seconds: float = 10.0,
+               tenant_weights: Dict[str, float] = None, tenant_share: float = 1.0) -> web.Application:
+    app = web.Application(client_max_size=MAX_UPLOAD_BYTES + 1024 * 1024)
+    app['inference_queue'] = InferenceQueue(run_analysis, workers=workers, name='analyze',
+                                            lanes=build_lanes(max_depth), aging_seconds=aging_seconds,
+                                            tenant_weights=tenant_weights, tenant_share=tenant_share)
+    app.router.add_post('/analyze', analyze_endpoint)
+    app.router.add_get('/health', health_endpoint)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_get('/debug/slow', debug_slow_endpoint)
+
+    queue = app['inference_queue']
+    metrics.gauge('inference_queue_depth', 'Requests waiting for an inference worker, per lane',
+                  lambda: {name: lane.depth for name, lane in queue.lanes.items()}, label='lane')
+    metrics.gauge('inference_queue_in_flight', 'Requests being analysed by inference workers',
+                  lambda: queue.in_flight)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Asyncio front end with a bounded inference queue')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--unix-socket', default=UNIX_SOCKET,
+                        help='Listen on this Unix domain socket instead of host:port')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('INFERENCE_WORKERS', '4')),
+                        help='Inference worker threads pulling from the queue')
+    parser.add_argument('--max-depth', type=int, default=int(os.getenv('INFERENCE_QUEUE_DEPTH', '32')),
+                        help='Queued requests per lane beyond which /analyze answers 429 (bulk lane: 4x)')
+    parser.add_argument('--aging-seconds', type=float, default=float(os.getenv('INFERENCE_AGING_SECONDS', '10')),
+                        help='Waiting time after which a request is treated as one lane higher')
+    parser.add_argument('--tenant-weights', default=os.getenv('TENANT_WEIGHTS', ''),
+                        help='Fair-share weights per model_id, e.g. "12:2,40:0.5" (others weigh 1)')
+    parser.add_argument('--tenant-share', type=float, default=float(os.getenv('INFERENCE_TENANT_SHARE', '0.5')),
+                        help='Largest fraction of a lane one model_id may occupy before getting 429')
+    args = parser.parse_args()
+
+    address = f'unix:{args.unix_socket}' if args.unix_socket else f'{args.host}:{args.port}'
+    logger.info(f"🚀 Starting async front end on {address} "
+                f"({args.workers} workers, queue depth {args.max_depth}/lane, aging {args.aging_seconds}s)")
+    app = create_app(args.workers, args.max_depth, args.aging_seconds,
+                     parse_tenant_weights(args.tenant_weights), args.tenant_share)
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)
+        web.run_app(app, path=args.unix_socket)
+    else:
+        web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""
+In-process benchmarks for the moderation pipeline stages
+Stage functions of every server version are called directly (no HTTP) over a
+fixed image corpus; each stage reports latency percentiles, throughput, peak
+RSS and Python allocations as JSON, and a run can be compared against a stored
+baseline:
+
+    python -m benchmarks run --suite v3 --suite v4 --output bench.json
+    python -m benchmarks run --baseline benchmarks/baseline.json --threshold 15
+    python -m benchmarks compare bench.json benchmarks/baseline.json
+"""
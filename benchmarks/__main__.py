@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark command line
+    python -m benchmarks run [--suite v3 ...] [--stage _analyze_nudity ...] [--corpus DIR]
+                             [--iterations N] [--warmup N] [--no-allocations]
+                             [--output results.json] [--baseline baseline.json --threshold 10]
+    python -m benchmarks compare results.json baseline.json [--threshold 10]
+
+Run it from the repository root so the server modules import by name. Exits 1
+when a comparison finds regressions or stages missing from the run.
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from typing import Dict
+
+from benchmarks.compare import compare_results
+from benchmarks.harness import corpus_fingerprint, load_corpus, measure_stage, synthetic_corpus
+from benchmarks.suites import REPO_ROOT, SUITES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('benchmarks')
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args) -> Dict:
+    corpus_dir = args.corpus or os.getenv('BENCHMARK_CORPUS')
+    samples = load_corpus(corpus_dir) if corpus_dir else synthetic_corpus()
+    logger.info(f"🖼️ Corpus: {len(samples)} image(s) from {corpus_dir or 'synthetic set'}")
+
+    results = {
+        'created_at': datetime.now().isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'iterations': args.iterations,
+        'warmup': args.warmup,
+        'corpus': {
+            'source': corpus_dir or 'synthetic',
+            'images': [sample.name for sample in samples],
+            'fingerprint': corpus_fingerprint(samples)
+        },
+        'suites': {}
+    }
+
+    for suite_name in args.suite or list(SUITES):
+        logger.info(f"🚀 Loading suite {suite_name}...")
+        try:
+            stages = SUITES[suite_name]()
+        except Exception as e:
+            # A server whose models or dependencies are missing here does not stop the others
+            logger.error(f"❌ Suite {suite_name} unavailable: {e}")
+            results['suites'][suite_name] = {'error': str(e), 'stages': {}}
+            continue
+
+        suite_results = {}
+        for stage in stages:
+            if args.stage and stage.name not in args.stage:
+                continue
+            logger.info(f"⏱️ {suite_name}/{stage.name}")
+            summary = measure_stage(stage, samples, iterations=args.iterations, warmup=args.warmup,
+                                    allocations=not args.no_allocations)
+            suite_results[stage.name] = summary
+            if 'error' not in summary:
+                logger.info(f"   p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  "
+                            f"{summary['throughput_per_s']}/s  errors {summary['errors']}")
+        results['suites'][suite_name] = {'stages': suite_results}
+
+    return results
+
+
+def _describe(entry: Dict) -> str:
+    change = f"{entry['change_pct']:+.1f}%" if entry['change_pct'] is not None else 'from 0'
+    return (f"{entry['suite']}/{entry['stage']} {entry['metric']}: "
+            f"{entry['baseline']} → {entry['current']} ({change})")
+
+
+def _report(comparison: Dict):
+    if not comparison['corpus_matches']:
+        logger.warning("⚠️ Corpus differs from the baseline's; numbers are not directly comparable")
+    for entry in comparison['regressions']:
+        logger.error(f"❌ {_describe(entry)}")
+    for entry in comparison['improvements']:
+        logger.info(f"✅ {_describe(entry)}")
+    for name in comparison['missing']:
+        logger.error(f"❌ {name} is in the baseline but did not run")
+    logger.info("✅ No regressions" if comparison['passed'] else "❌ Benchmark regressions found")
+
+
+def _write(data: Dict, path: str):
+    if path:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+        logger.info(f"💾 Wrote {path}")
+    else:
+        print(json.dumps(data, indent=2))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='In-process moderation stage benchmarks')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subcommands.add_parser('run', help='Benchmark stage functions over an image corpus')
+    run_parser.add_argument('--suite', action='append', choices=sorted(SUITES), help='Repeatable; default all')
+    run_parser.add_argument('--stage', action='append', help='Only these stage names (repeatable)')
+    run_parser.add_argument('--corpus', help='Image directory (default BENCHMARK_CORPUS or a synthetic set)')
+    run_parser.add_argument('--iterations', type=int, default=10, help='Timed passes over the corpus')
+    run_parser.add_argument('--warmup', type=int, default=1, help='Untimed passes before timing')
+    run_parser.add_argument('--no-allocations', action='store_true', help='Skip the tracemalloc pass')
+    run_parser.add_argument('--output', help='Write results JSON here instead of stdout')
+    run_parser.add_argument('--baseline', help='Compare against this results JSON after the run')
+    run_parser.add_argument('--threshold', type=float, default=10.0, help='Allowed change in percent')
+    run_parser.add_argument('--min-delta-ms', type=float, default=1.0, help='Ignore smaller latency changes')
+
+    compare_parser = subcommands.add_parser('compare', help='Compare two results files')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--threshold', type=float, default=10.0)
+    compare_parser.add_argument('--min-delta-ms', type=float, default=1.0)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(args)
+        require_all = not (args.suite or args.stage)
+    else:
+        with open(args.current) as f:
+            results = json.load(f)
+        require_all = True
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare_results(results, baseline, args.threshold, args.min_delta_ms, require_all)
+        _report(comparison)
+
+    if args.command == 'run':
+        if comparison is not None:
+            results['comparison'] = comparison
+        _write(results, args.output)
+    else:
+        _write(comparison, None)
+
+    return 0 if comparison is None or comparison['passed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
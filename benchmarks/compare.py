@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Baseline comparison for benchmark results
+A stage regresses when a latency percentile or the allocation peak grows, or
+throughput drops, by more than the threshold. Latency changes smaller than
+min_delta_ms are ignored so sub-millisecond stages (the risk combiners) do not
+fail a run on timer noise. Any rise in the error rate is a regression: failed
+calls are left out of the latency numbers, so a stage that starts failing
+would otherwise look faster.
+"""
+
+from typing import Dict, List
+
+# metric -> True when higher is worse
+COMPARED_METRICS = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'p99_ms': True,
+    'throughput_per_s': False,
+    'alloc_peak_kb_max': True,
+}
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def _change(current: float, baseline: float) -> float:
+    return (current - baseline) / baseline * 100.0 if baseline else 0.0
+
+
+def _error_rate(stage: Dict) -> float:
+    return stage.get('errors', 0) / stage['calls'] if stage.get('calls') else 0.0
+
+
+def compare_results(current: Dict, baseline: Dict, threshold_pct: float = 10.0,
+                    min_delta_ms: float = 1.0, require_all: bool = True) -> Dict:
+    """Stage-by-stage comparison of two run() outputs
+
+    With require_all, baseline stages absent from the current run fail the
+    comparison; otherwise (a run filtered by --suite/--stage) they are skipped.
+    """
+    regressions: List[Dict] = []
+    improvements: List[Dict] = []
+    missing: List[str] = []
+
+    for suite_name, baseline_suite in baseline.get('suites', {}).items():
+        current_stages = current.get('suites', {}).get(suite_name, {}).get('stages', {})
+        for stage_name, baseline_stage in baseline_suite.get('stages', {}).items():
+            current_stage = current_stages.get(stage_name)
+            if current_stage is None and not require_all:
+                continue
+            if current_stage is None or 'error' in current_stage:
+                missing.append(f'{suite_name}/{stage_name}')
+                continue
+            before_rate, after_rate = _error_rate(baseline_stage), _error_rate(current_stage)
+            if after_rate > before_rate:
+                regressions.append({'suite': suite_name, 'stage': stage_name, 'metric': 'error_rate',
+                                    'baseline': round(before_rate, 4), 'current': round(after_rate, 4),
+                                    'change_pct': round(_change(after_rate, before_rate), 1) if before_rate else None})
+            for metric, higher_is_worse in COMPARED_METRICS.items():
+                if metric not in current_stage or metric not in baseline_stage:
+                    continue
+                before, after = baseline_stage[metric], current_stage[metric]
+                if metric in LATENCY_METRICS and abs(after - before) < min_delta_ms:
+                    continue
+                change = _change(after, before)
+                entry = {'suite': suite_name, 'stage': stage_name, 'metric': metric,
+                         'baseline': before, 'current': after, 'change_pct': round(change, 1)}
+                worse = change > threshold_pct if higher_is_worse else change < -threshold_pct
+                better = change < -threshold_pct if higher_is_worse else change > threshold_pct
+                if worse:
+                    regressions.append(entry)
+                elif better:
+                    improvements.append(entry)
+
+    return {
+        'threshold_pct': threshold_pct,
+        'min_delta_ms': min_delta_ms,
+        'corpus_matches': current.get('corpus', {}).get('fingerprint') == baseline.get('corpus', {}).get('fingerprint'),
+        'regressions': regressions,
+        'improvements': improvements,
+        'missing': missing,
+        'passed': not regressions and not missing
+    }
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Measurement core for the stage benchmarks
+A Stage wraps one stage function; prepare() builds its arguments for a corpus
+sample outside the timed region (decoded pixels, upstream stage results), so
+only the stage itself is timed. Latency comes from perf_counter around each
+call, RSS from /proc, and allocations from a separate tracemalloc pass so the
+tracing overhead never lands in the latency numbers. tracemalloc sees Python
+and numpy allocations; native arenas (onnxruntime, torch) only show in RSS.
+"""
+
+import os
+import io
+import gc
+import time
+import atexit
+import shutil
+import hashlib
+import logging
+import resource
+import tempfile
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from moderation_image import DecodedImage, decode_image
+from prefork_server import current_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+PERCENTILES = (50, 90, 95, 99)
+
+
+@dataclass
+class Sample:
+    """One corpus image: raw bytes, a path on disk and the decoded pixels (decoded once)"""
+    name: str
+    data: bytes
+    path: str
+    _decoded: Optional[DecodedImage] = field(default=None, repr=False)
+
+    @property
+    def decoded(self) -> DecodedImage:
+        if self._decoded is None:
+            self._decoded = decode_image(self.data)
+        return self._decoded
+
+    @property
+    def rgb(self) -> np.ndarray:
+        return self.decoded.rgb
+
+
+@dataclass
+class Stage:
+    """A benchmarked call: fn(*prepare(sample)), with optional cleanup(result, sample) after timing"""
+    name: str
+    fn: Callable
+    prepare: Callable[[Sample], Tuple] = lambda sample: (sample,)
+    cleanup: Optional[Callable[[Any, Sample], None]] = None
+
+
+def load_corpus(directory: str) -> List[Sample]:
+    """Every image file in directory, sorted by name so runs are comparable"""
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                samples.append(Sample(name=name, data=f.read(), path=path))
+    if not samples:
+        raise ValueError(f"No images found in {directory}")
+    return samples
+
+
+def _encode(img: Image.Image, image_format: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def synthetic_corpus(directory: Optional[str] = None) -> List[Sample]:
+    """Seeded stand-in corpus covering the shapes uploads come in
+
+    Landscape and portrait JPEGs, a phone-style JPEG with EXIF orientation 6,
+    an RGBA PNG, a 1080p JPEG and a thumbnail. Files are written to directory
+    (a temporary one by default) for the path-based ai-moderation stages.
+    """
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='moderation-bench-')
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    rng = np.random.default_rng(0)
+
+    def pixels(width, height, channels=3):
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        noise = rng.integers(0, 64, size=(height, width, channels)).astype(np.float32)
+        return np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+    rotated = Image.fromarray(pixels(640, 480))
+    exif = rotated.getexif()
+    exif[0x0112] = 6
+
+    images = [
+        ('landscape_640x480.jpg', _encode(Image.fromarray(pixels(640, 480)), 'JPEG', quality=90)),
+        ('portrait_480x640.jpg', _encode(Image.fromarray(pixels(480, 640)), 'JPEG', quality=90)),
+        ('exif_rotated_640x480.jpg', _encode(rotated, 'JPEG', quality=90, exif=exif.tobytes())),
+        ('rgba_512x512.png', _encode(Image.fromarray(pixels(512, 512, 4), 'RGBA'), 'PNG')),
+        ('large_1920x1080.jpg', _encode(Image.fromarray(pixels(1920, 1080)), 'JPEG', quality=85)),
+        ('thumbnail_128x128.jpg', _encode(Image.fromarray(pixels(128, 128)), 'JPEG', quality=80)),
+    ]
+
+    samples = []
+    for name, data in images:
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        samples.append(Sample(name=name, data=data, path=path))
+    return samples
+
+
+def corpus_fingerprint(samples: Sequence[Sample]) -> str:
+    """Hash over names and contents; baselines from a different corpus are not comparable"""
+    digest = hashlib.sha256()
+    for sample in samples:
+        digest.update(sample.name.encode())
+        digest.update(hashlib.sha256(sample.data).digest())
+    return digest.hexdigest()[:16]
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Linear interpolation between closest ranks (numpy's default method)"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def peak_rss_bytes() -> int:
+    """High-water RSS of the process (ru_maxrss is in KB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _call(stage: Stage, args: Tuple, sample: Sample) -> bool:
+    try:
+        result = stage.fn(*args)
+    except Exception as e:
+        logger.debug(f"{stage.name} failed on {sample.name}: {e}")
+        return False
+    if stage.cleanup is not None:
+        stage.cleanup(result, sample)
+    return True
+
+
+def _allocations(stage: Stage, prepared: List[Tuple[Sample, Tuple]]) -> Dict:
+    """One traced call per sample: peak Python-heap growth during the call and what it left behind"""
+    peaks, retained, blocks = [], [], []
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    try:
+        for sample, args in prepared:
+            gc.collect()
+            before = tracemalloc.take_snapshot()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = stage.fn(*args)
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            if stage.cleanup is not None:
+                stage.cleanup(result, sample)
+            del result
+            peaks.append(peak - baseline)
+            retained.append(current - baseline)
+            blocks.append(sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0))
+    except Exception as e:
+        logger.warning(f"⚠️ Allocation pass for {stage.name} failed: {e}")
+        return {}
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+    return {
+        'alloc_peak_kb_max': round(max(peaks) / 1024, 1),
+        'alloc_peak_kb_mean': round(sum(peaks) / len(peaks) / 1024, 1),
+        'alloc_retained_kb_mean': round(sum(retained) / len(retained) / 1024, 1),
+        'alloc_new_blocks_mean': round(sum(blocks) / len(blocks), 1)
+    }
+
+
+def measure_stage(stage: Stage, samples: Sequence[Sample], iterations: int = 10, warmup: int = 1,
+                  allocations: bool = True) -> Dict:
+    """Run stage over the corpus warmup + iterations times and summarise
+
+    Every timed round calls the stage once per sample. Latency percentiles and
+    throughput (per second of wall time over the timed rounds) count successful
+    calls only; failures are reported in errors.
+    """
+    try:
+        prepared = [(sample, stage.prepare(sample)) for sample in samples]
+    except Exception as e:
+        logger.error(f"❌ Could not prepare inputs for {stage.name}: {e}")
+        return {'stage': stage.name, 'error': f'prepare failed: {e}'}
+
+    for _ in range(warmup):
+        for sample, args in prepared:
+            _call(stage, args, sample)
+
+    gc.collect()
+    rss_before = current_rss_bytes()
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for sample, args in prepared:
+            call_started = time.perf_counter()
+            if _call(stage, args, sample):
+                latencies.append(time.perf_counter() - call_started)
+            else:
+                errors += 1
+    wall = time.perf_counter() - started
+    rss_after = current_rss_bytes()
+
+    latencies.sort()
+    summary = {
+        'stage': stage.name,
+        'calls': len(latencies) + errors,
+        'errors': errors,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'min_ms': round(latencies[0] * 1000, 3) if latencies else 0.0,
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+    for pct in PERCENTILES:
+        summary[f'p{pct}_ms'] = round(percentile(latencies, pct) * 1000, 3)
+    summary.update({
+        'throughput_per_s': round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        'rss_mb': round(rss_after / (1024 * 1024), 1),
+        'rss_growth_mb': round((rss_after - rss_before) / (1024 * 1024), 1),
+        'peak_rss_mb': round(peak_rss_bytes() / (1024 * 1024), 1)
+    })
+    if allocations:
+        summary.update(_allocations(stage, prepared))
+    return summary
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+HTTP load generator for the /analyze endpoints
+Closed loop (--concurrency N: N clients, each sending its next request when
+the previous one returns) or open loop (--rate R: R requests per second on a
+fixed schedule, --max-in-flight senders). Open-loop latency is measured from
+the scheduled send time, so a server that falls behind shows it in the
+percentiles instead of silently lowering the offered load.
+
+Images come from a corpus directory (or the synthetic benchmark set) and are
+sent the way each server takes them:
+
+    multipart  v3, v3_simplified, v4, configurable_ai_server (field 'image'),
+               nudenet-upload-api /upload (field 'file')
+    raw        octet-stream body with the fields in the query string (v3, v4, /upload)
+    path       JSON {"image_path": ...} for ai-moderation and nudenet-upload-api /analyze;
+               the server must see the corpus at --server-corpus-dir
+
+    python -m benchmarks.loadgen --target v4 --concurrency 8 --duration 60
+    python -m benchmarks.loadgen --target ai_moderation --rate 2 --server-corpus-dir /srv/corpus
+    python -m benchmarks.loadgen --url http://127.0.0.1:5000/analyze --field enable_image_description=false
+
+Throughput and mean concurrency (throughput x mean latency, Little's law) at
+the highest load that keeps p95 acceptable tell how many workers a host needs.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import socket
+import logging
+import argparse
+import threading
+import http.client
+import urllib.parse
+from collections import Counter
+from datetime import datetime
+from itertools import cycle
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.harness import Sample, corpus_fingerprint, load_corpus, percentile, synthetic_corpus
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('loadgen')
+
+# Default endpoint and upload style of each server
+TARGETS = {
+    'v3': {'url': 'http://127.0.0.1:5000/analyze', 'mode': 'multipart', 'field': 'image'},
+    'v3_simplified': {'url': 'http://127.0.0.1:5000/analyze', 'mode': 'multipart', 'field': 'image'},
+    'v4': {'url': 'http://127.0.0.1:5000/analyze', 'mode': 'multipart', 'field': 'image'},
+    'configurable': {'url': 'http://127.0.0.1:5000/analyze', 'mode': 'multipart', 'field': 'image'},
+    'upload_api': {'url': 'http://127.0.0.1:5001/upload', 'mode': 'multipart', 'field': 'file'},
+    'ai_moderation': {'url': 'http://127.0.0.1:5001/analyze', 'mode': 'path', 'field': 'image'},
+}
+MODES = ('multipart', 'raw', 'path')
+PERCENTILES = (50, 95, 99)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix socket (servers started with UNIX_SOCKET / --unix-socket)"""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RequestBuilder:
+    """Turns a corpus sample plus the form fields into (path, body, headers) for one upload style"""
+
+    def __init__(self, url: str, mode: str, field: str, fields: Dict[str, str],
+                 context_types: List[str], server_corpus_dir: Optional[str] = None):
+        parsed = urllib.parse.urlsplit(url)
+        self.path = parsed.path or '/analyze'
+        self.query = parsed.query
+        self.mode = mode
+        self.field = field
+        self.fields = fields
+        self.context_types = cycle(context_types)
+        self.server_corpus_dir = server_corpus_dir
+        self._lock = threading.Lock()
+
+    def _form(self) -> Dict[str, str]:
+        with self._lock:
+            context_type = next(self.context_types)
+        return {'context_type': context_type, **self.fields}
+
+    def build(self, sample: Sample) -> Tuple[str, bytes, Dict[str, str], str]:
+        form = self._form()
+        if self.mode == 'path':
+            image_path = os.path.join(self.server_corpus_dir, sample.name) if self.server_corpus_dir else sample.path
+            body = json.dumps({**form, 'image_path': image_path}).encode()
+            return self._url(), body, {'Content-Type': 'application/json'}, form['context_type']
+        if self.mode == 'raw':
+            query = urllib.parse.urlencode({**form, 'filename': sample.name})
+            return self._url(query), sample.data, {'Content-Type': 'application/octet-stream'}, form['context_type']
+
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in form.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{self.field}"; '
+                     f'filename="{sample.name}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+        parts.append(sample.data)
+        parts.append(f'\r\n--{boundary}--\r\n'.encode())
+        headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        return self._url(), b''.join(parts), headers, form['context_type']
+
+    def _url(self, extra_query: str = '') -> str:
+        query = '&'.join(part for part in (self.query, extra_query) if part)
+        return f'{self.path}?{query}' if query else self.path
+
+
+class Recorder:
+    """Thread-safe list of completed requests: (finished_at, latency, outcome, context_type)"""
+
+    def __init__(self):
+        self.records: List[Tuple[float, float, str, str]] = []
+        self._lock = threading.Lock()
+
+    def add(self, finished_at: float, latency: float, outcome: str, context_type: str):
+        with self._lock:
+            self.records.append((finished_at, latency, outcome, context_type))
+
+    def snapshot(self) -> List[Tuple[float, float, str, str]]:
+        with self._lock:
+            return list(self.records)
+
+
+class LoadGenerator:
+    def __init__(self, url: str, builder: RequestBuilder, samples: List[Sample], timeout: float = 300.0,
+                 unix_socket: Optional[str] = None):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme or 'http'
+        self.netloc = parsed.netloc
+        self.builder = builder
+        self.samples = samples
+        self.timeout = timeout
+        self.unix_socket = unix_socket
+        self.recorder = Recorder()
+        self._sample_index = 0
+        self._lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.unix_socket:
+            return UnixHTTPConnection(self.unix_socket, self.timeout)
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def _next_sample(self) -> Sample:
+        with self._lock:
+            sample = self.samples[self._sample_index % len(self.samples)]
+            self._sample_index += 1
+        return sample
+
+    def send(self, connection: Optional[http.client.HTTPConnection],
+             started: Optional[float] = None) -> Tuple[Optional[http.client.HTTPConnection], str]:
+        """One request over a kept-alive connection; returns the connection to reuse (None after errors)"""
+        path, body, headers, context_type = self.builder.build(self._next_sample())
+        started = started if started is not None else time.perf_counter()
+        try:
+            connection = connection or self._connection()
+            connection.request('POST', path, body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+            outcome = _outcome(response.status, payload)
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+                connection = None
+        except socket.timeout:
+            outcome, connection = 'timeout', _close(connection)
+        except (OSError, http.client.HTTPException) as e:
+            outcome, connection = f'connection_error:{type(e).__name__}', _close(connection)
+        self.recorder.add(time.perf_counter(), time.perf_counter() - started, outcome, context_type)
+        return connection, outcome
+
+    def run_closed(self, concurrency: int, duration: float, max_requests: Optional[int] = None):
+        """concurrency clients, each with one request outstanding at a time"""
+        deadline = time.perf_counter() + duration
+        remaining = [max_requests] if max_requests else None
+
+        def client():
+            connection = None
+            while time.perf_counter() < deadline:
+                if remaining is not None:
+                    with self._lock:
+                        if remaining[0] <= 0:
+                            break
+                        remaining[0] -= 1
+                connection, _ = self.send(connection)
+            _close(connection)
+
+        threads = [threading.Thread(target=client, name=f'loadgen-{index}', daemon=True) for index in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open(self, rate: float, duration: float, max_in_flight: int, poisson: bool = False,
+                 max_requests: Optional[int] = None):
+        """Requests scheduled at a fixed rate (or Poisson arrivals) regardless of how fast the server answers"""
+        schedule: queue.Queue = queue.Queue()
+
+        def sender():
+            connection = None
+            while True:
+                scheduled = schedule.get()
+                if scheduled is None:
+                    break
+                # Wait for the slot; a backlog makes later requests start late and that counts as latency
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                connection, _ = self.send(connection, started=scheduled)
+            _close(connection)
+
+        threads = [threading.Thread(target=sender, name=f'loadgen-{index}', daemon=True) for index in range(max_in_flight)]
+        for thread in threads:
+            thread.start()
+
+        started = time.perf_counter()
+        next_at, sent = started, 0
+        while next_at < started + duration and (not max_requests or sent < max_requests):
+            schedule.put(next_at)
+            sent += 1
+            next_at += random.expovariate(rate) if poisson else 1.0 / rate
+            # Keep the schedule at most a second ahead of the clock
+            ahead = next_at - time.perf_counter() - 1.0
+            if ahead > 0:
+                time.sleep(ahead)
+        for _ in threads:
+            schedule.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def _close(connection: Optional[http.client.HTTPConnection]) -> None:
+    if connection is not None:
+        connection.close()
+    return None
+
+
+def _outcome(status: int, payload: bytes) -> str:
+    """'ok', 'http_<status>' or 'analysis_failed' (HTTP 200 carrying success: false)"""
+    if status >= 400:
+        return f'http_{status}'
+    try:
+        body = json.loads(payload)
+    except ValueError:
+        return 'invalid_json'
+    if isinstance(body, dict) and body.get('success') is False:
+        return 'analysis_failed'
+    return 'ok'
+
+
+def _latency_summary(latencies: List[float]) -> Dict:
+    latencies = sorted(latencies)
+    summary = {f'p{pct}_ms': round(percentile(latencies, pct) * 1000, 1) for pct in PERCENTILES}
+    summary['mean_ms'] = round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0
+    summary['max_ms'] = round(latencies[-1] * 1000, 1) if latencies else 0.0
+    return summary
+
+
+def summarise(records: List[Tuple[float, float, str, str]], started: float, interval: float) -> Dict:
+    """Overall numbers, per-context_type numbers and a per-interval time series"""
+    if not records:
+        return {'requests': 0}
+    elapsed = max(record[0] for record in records) - started
+    ok = [record for record in records if record[2] == 'ok']
+    outcomes = Counter(record[2] for record in records)
+    throughput = len(ok) / elapsed if elapsed > 0 else 0.0
+    overall = {
+        'requests': len(records),
+        'ok': len(ok),
+        'error_rate': round(1 - len(ok) / len(records), 4),
+        'outcomes': dict(outcomes),
+        'duration_s': round(elapsed, 2),
+        'throughput_per_s': round(throughput, 3),
+        **_latency_summary([record[1] for record in ok])
+    }
+    # Little's law: average number of requests the server was working on
+    overall['mean_concurrency'] = round(throughput * overall['mean_ms'] / 1000, 2)
+
+    by_context = {}
+    for context_type in sorted({record[3] for record in records}):
+        subset = [record for record in records if record[3] == context_type]
+        subset_ok = [record[1] for record in subset if record[2] == 'ok']
+        by_context[context_type] = {'requests': len(subset), 'ok': len(subset_ok), **_latency_summary(subset_ok)}
+
+    timeline = []
+    buckets: Dict[int, List] = {}
+    for record in records:
+        buckets.setdefault(int((record[0] - started) // interval), []).append(record)
+    for index in sorted(buckets):
+        bucket = buckets[index]
+        bucket_ok = [record[1] for record in bucket if record[2] == 'ok']
+        timeline.append({
+            't_s': round((index + 1) * interval, 1),
+            'requests': len(bucket),
+            'errors': len(bucket) - len(bucket_ok),
+            'throughput_per_s': round(len(bucket_ok) / interval, 3),
+            **_latency_summary(bucket_ok)
+        })
+
+    return {'overall': overall, 'by_context_type': by_context, 'timeline': timeline}
+
+
+def _progress(recorder: Recorder, started: float, interval: float, stop: threading.Event):
+    """Log one line per interval while the run is going"""
+    reported = 0
+    while not stop.wait(interval):
+        records = recorder.snapshot()
+        window = records[reported:]
+        reported = len(records)
+        ok = sorted(record[1] for record in window if record[2] == 'ok')
+        logger.info(f"📈 t={time.perf_counter() - started:6.1f}s  {len(ok) / interval:6.2f} ok/s  "
+                    f"errors {len(window) - len(ok):3d}  p50 {percentile(ok, 50) * 1000:7.1f}ms  "
+                    f"p95 {percentile(ok, 95) * 1000:7.1f}ms  p99 {percentile(ok, 99) * 1000:7.1f}ms")
+
+
+def _parse_fields(values: List[str]) -> Dict[str, str]:
+    fields = {}
+    for value in values or []:
+        if '=' not in value:
+            raise argparse.ArgumentTypeError(f"--field expects name=value, got {value!r}")
+        name, field_value = value.split('=', 1)
+        fields[name] = field_value
+    return fields
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadgen', description='Load test /analyze')
+    parser.add_argument('--target', choices=sorted(TARGETS), default='v4', help='Server preset (URL and upload style)')
+    parser.add_argument('--url', help='Override the preset URL')
+    parser.add_argument('--unix-socket', default=os.getenv('UNIX_SOCKET'), help='Connect over this Unix socket')
+    parser.add_argument('--mode', choices=MODES, help='Override the preset upload style')
+    parser.add_argument('--file-field', help="Multipart file field (preset: 'image', or 'file' for upload_api)")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=int, help='Closed loop: clients with one request in flight each')
+    load.add_argument('--rate', type=float, help='Open loop: requests per second')
+    parser.add_argument('--poisson', action='store_true', help='Open loop with exponential inter-arrival times')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='Open loop sender threads')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load')
+    parser.add_argument('--requests', type=int, help='Stop after this many requests')
+    parser.add_argument('--warmup', type=int, default=0, help='Sequential requests sent first and not counted')
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--corpus', help='Image directory (default BENCHMARK_CORPUS or the synthetic set)')
+    parser.add_argument('--server-corpus-dir', help='Where the server sees the corpus (path mode)')
+    parser.add_argument('--context-type', action='append', help='Repeatable; requests rotate through them')
+    parser.add_argument('--model-id', default='1')
+    parser.add_argument('--field', action='append', help='Extra form field name=value, e.g. enable_image_description=false')
+    parser.add_argument('--report-interval', type=float, default=5.0, help='Seconds per timeline bucket')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    preset = TARGETS[args.target]
+    url = args.url or preset['url']
+    mode = args.mode or preset['mode']
+    fields = {'model_id': args.model_id, **_parse_fields(args.field)}
+    context_types = args.context_type or ['public_gallery']
+
+    corpus_dir = args.corpus or os.getenv('BENCHMARK_CORPUS')
+    samples = load_corpus(corpus_dir) if corpus_dir else synthetic_corpus()
+    if mode == 'path' and not (corpus_dir or args.server_corpus_dir):
+        logger.warning("⚠️ Path mode with the synthetic corpus only works against a server on this host")
+
+    builder = RequestBuilder(url, mode, args.file_field or preset['field'], fields, context_types,
+                             args.server_corpus_dir)
+    generator = LoadGenerator(url, builder, samples, timeout=args.timeout, unix_socket=args.unix_socket)
+
+    for _ in range(args.warmup):
+        _close(generator.send(None)[0])
+    generator.recorder = Recorder()
+
+    load_model = f'rate {args.rate}/s' if args.rate else f'concurrency {args.concurrency or 1}'
+    logger.info(f"🚀 {mode} POST {url}{' via ' + args.unix_socket if args.unix_socket else ''}: "
+                f"{load_model} for {args.duration}s over {len(samples)} image(s)")
+
+    started = time.perf_counter()
+    stop = threading.Event()
+    reporter = threading.Thread(target=_progress, args=(generator.recorder, started, args.report_interval, stop),
+                                daemon=True)
+    reporter.start()
+    try:
+        if args.rate:
+            generator.run_open(args.rate, args.duration, args.max_in_flight, args.poisson, args.requests)
+        else:
+            generator.run_closed(args.concurrency or 1, args.duration, args.requests)
+    except KeyboardInterrupt:
+        logger.warning("⚠️ Interrupted, reporting what completed")
+    stop.set()
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'url': url,
+        'unix_socket': args.unix_socket,
+        'mode': mode,
+        'load': {'model': 'open' if args.rate else 'closed', 'rate': args.rate, 'poisson': args.poisson,
+                 'concurrency': None if args.rate else (args.concurrency or 1), 'duration_s': args.duration},
+        'fields': fields,
+        'context_types': context_types,
+        'corpus': {'source': corpus_dir or 'synthetic', 'images': len(samples),
+                   'fingerprint': corpus_fingerprint(samples)},
+        **summarise(generator.recorder.snapshot(), started, args.report_interval)
+    }
+
+    overall = report.get('overall', {})
+    if overall:
+        status = '✅' if overall['error_rate'] == 0 else '⚠️'
+        logger.info(f"{status} {overall['requests']} requests, {overall['throughput_per_s']} ok/s, "
+                    f"error rate {overall['error_rate']:.2%}, p50 {overall['p50_ms']}ms "
+                    f"p95 {overall['p95_ms']}ms p99 {overall['p99_ms']}ms, mean concurrency {overall['mean_concurrency']}")
+    else:
+        logger.error("❌ No requests completed")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"💾 Wrote {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+    return 0 if overall.get('ok') else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
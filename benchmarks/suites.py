@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Stage lists for each server version
+Each suite imports its server module (which loads the models, as the server
+would at startup) and returns the stages to benchmark. Inputs of the risk
+combiners are produced by running the upstream stages once per sample while
+preparing, so only the combiner itself is timed.
+"""
+
+import os
+import sys
+import importlib
+from typing import Callable, Dict, List
+
+from benchmarks.harness import Sample, Stage
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTEXT_TYPE = 'public_gallery'
+
+
+def _rgb(sample: Sample):
+    return (sample.rgb,)
+
+
+def _path(sample: Sample):
+    return (sample.path,)
+
+
+def _v3_stages(module_name: str) -> List[Stage]:
+    api = importlib.import_module(module_name).api
+
+    def combiner_inputs(sample: Sample):
+        return (api._analyze_nudity(sample.rgb), api._analyze_faces(sample.rgb),
+                api._generate_image_description(sample.rgb), CONTEXT_TYPE)
+
+    return [
+        Stage('normalize_image_orientation', api.normalize_image_orientation, prepare=lambda sample: (sample.data,)),
+        Stage('_analyze_nudity', api._analyze_nudity, prepare=_rgb),
+        Stage('_analyze_faces', api._analyze_faces, prepare=_rgb),
+        Stage('_generate_image_description', api._generate_image_description, prepare=_rgb),
+        Stage('_combine_v3_assessments', api._combine_v3_assessments, prepare=combiner_inputs),
+    ]
+
+
+def v3_stages() -> List[Stage]:
+    return _v3_stages('enhanced_moderation_pipeline_v3')
+
+
+def v3_simplified_stages() -> List[Stage]:
+    return _v3_stages('enhanced_moderation_pipeline_v3_simplified')
+
+
+def v4_stages() -> List[Stage]:
+    # A lone caller would otherwise wait out the micro-batching window on every NudeNet call
+    os.environ.setdefault('NUDENET_MAX_WAIT_MS', '0')
+    from moderation_image import decode_image
+    from perceptual_index import phash
+    api = importlib.import_module('enhanced_minimal_v4_configurable').api
+    config = api.config_manager.default_config
+
+    def risk_inputs(sample: Sample):
+        description = api._run_description_stage(sample.rgb, config)
+        child_analysis = api._run_child_stage(description, api._run_face_stage(config), config)
+        return ({'nudity_detection': api._run_nudity_stage(sample.rgb, config),
+                 'child_analysis': child_analysis}, config)
+
+    return [
+        Stage('normalize_image_orientation', decode_image, prepare=lambda sample: (sample.data,)),
+        Stage('phash', phash, prepare=_rgb),
+        Stage('_analyze_nudity', api._run_nudity_stage, prepare=lambda sample: (sample.rgb, config)),
+        Stage('_analyze_faces', api._run_face_stage, prepare=lambda sample: (config,)),
+        Stage('_generate_image_description', api._run_description_stage, prepare=lambda sample: (sample.rgb, config)),
+        Stage('compute_enhanced_risk_assessment', api.compute_enhanced_risk_assessment, prepare=risk_inputs),
+    ]
+
+
+def pose_stages() -> List[Stage]:
+    from enhanced_pose_analysis import EnhancedPoseAnalyzer
+    analyzer = EnhancedPoseAnalyzer()
+    return [Stage('EnhancedPoseAnalyzer._analyze_pose', analyzer._analyze_pose, prepare=_rgb)]
+
+
+def ai_moderation_stages() -> List[Stage]:
+    # ai-moderation/ is its own build context and imports its siblings by name
+    sys.path.insert(0, os.path.join(REPO_ROOT, 'ai-moderation'))
+    from app import ContentModerator
+    moderator = ContentModerator()
+    if not moderator.initialize_models():
+        raise RuntimeError('ai-moderation models failed to load')
+
+    def remove_normalized(normalized_path: str, sample: Sample):
+        if normalized_path != sample.path:
+            os.unlink(normalized_path)
+
+    def rules_inputs(sample: Sample):
+        nudity_score, _ = moderator.analyze_nudity(sample.path)
+        pose_class, explicit_pose_score, _ = moderator.analyze_pose(sample.path)
+        violations = moderator.check_policy_violations(moderator.generate_caption(sample.path), CONTEXT_TYPE)
+        return nudity_score, pose_class, explicit_pose_score, violations, CONTEXT_TYPE
+
+    return [
+        Stage('normalize_image_orientation', moderator.normalize_image_orientation, prepare=_path,
+              cleanup=remove_normalized),
+        # analyze_nudity and analyze_pose each normalize the image themselves, as in the server
+        Stage('analyze_nudity', moderator.analyze_nudity, prepare=_path),
+        Stage('analyze_pose', moderator.analyze_pose, prepare=_path),
+        Stage('generate_caption', moderator.generate_caption, prepare=_path),
+        Stage('apply_moderation_rules', moderator.apply_moderation_rules, prepare=rules_inputs),
+    ]
+
+
+SUITES: Dict[str, Callable[[], List[Stage]]] = {
+    'v3': v3_stages,
+    'v3_simplified': v3_simplified_stages,
+    'v4': v4_stages,
+    'pose': pose_stages,
+    'ai_moderation': ai_moderation_stages,
+}
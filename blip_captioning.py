@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Batched BLIP captioning
+Coalesces images from concurrent requests into one blip_model.generate call
+"""
+
+import os
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from inference_batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+
+class CaptionService:
+    """Runs BLIP captioning through a MicroBatcher
+
+    The processor resizes every image to the same resolution, so pixel_values
+    stack without input padding. Finished captions in a batch are padded with
+    pad tokens until the longest one ends; skip_special_tokens strips them, so
+    each caption decodes exactly as it would from a batch of one.
+
+    max_wait_ms defaults to 0: a lone request runs immediately, and requests
+    that arrive while generate() is busy are picked up together as the next batch.
+    """
+
+    def __init__(self, processor, model, generate_kwargs: Optional[Dict] = None,
+                 max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        self.processor = processor
+        self.model = model
+        self.generate_kwargs = dict(generate_kwargs or {})
+        self.batcher = MicroBatcher(
+            self._caption_batch,
+            max_batch_size=max_batch_size if max_batch_size is not None else int(os.getenv('BLIP_MAX_BATCH', '4')),
+            max_wait_ms=max_wait_ms if max_wait_ms is not None else float(os.getenv('BLIP_MAX_WAIT_MS', '0')),
+            name='blip'
+        )
+
+    def _caption_batch(self, images: List[np.ndarray]) -> List[str]:
+        import torch
+
+        inputs = self.processor(images=list(images), return_tensors="pt")
+        with torch.no_grad():
+            out = self.model.generate(**inputs, **self.generate_kwargs)
+
+        return [self.processor.decode(sequence, skip_special_tokens=True) for sequence in out]
+
+    def caption(self, image_rgb: np.ndarray) -> str:
+        """Caption one RGB image, sharing a generate() call with concurrent requests"""
+        return self.batcher(image_rgb)
+
+    def stats(self) -> Dict:
+        return {**self.batcher.stats(), 'generate_kwargs': self.generate_kwargs}
@@ -8,21 +8,33 @@ import cv2
 import numpy as np
 import json
 import os
-from flask import Flask, request, jsonify
-from nudenet import NudeDetector
+from flask import Flask, Response, request, jsonify
 import logging
 from typing import Dict, List, Tuple, Optional
 import traceback
-from PIL import Image, ExifTags
-import tempfile
 import random
 from datetime import datetime
+from moderation_image import ImageSource, decode_image, describe_image_source
+from upload_buffer import BufferedUploadRequest, listen_address, request_image
+from nudenet_engine import NudeNetEngine
+from inference_batching import MicroBatcher
+from blip_captioning import CaptionService
+from functools import partial
+from result_cache import ResultCache, canonical_hash
+from perceptual_index import PerceptualIndex, phash
+from stage_graph import SKIPPED_STAGES, STAGE_TIMINGS, StageGraph
+from stage_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, StageTimer, metrics
+from request_profiler import RequestProfiler, profiling_allowed
+from flight_recorder import recorder_from_env
+from job_store import JobRunner, JobStore
+from inference_sidecar import SidecarCaptionService, SidecarNudeDetector, sidecar_from_env
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.request_class = BufferedUploadRequest
 
 class ConfigurableAnalysisComponents:
     """Manages configurable detection components"""
@@ -44,9 +56,32 @@ class ConfigurableAnalysisComponents:
             'risk_thresholds': {
                 'child_keywords': ['child', 'kid', 'baby', 'toddler', 'minor', 'young', 'teen'],
                 'age_threshold': 18
+            },
+            # Per-context limits (same max_nudity_score as the moderation_rules table).
+            # Stages listed in mandatory_stages are never skipped by the cascade; child
+            # analysis can turn any verdict into a review, so it is mandatory everywhere.
+            'context_policies': {
+                'profile_pic': {'max_nudity_score': 30, 'mandatory_stages': ['child_analysis']},
+                'public_gallery': {'max_nudity_score': 60, 'mandatory_stages': ['child_analysis']},
+                'premium_gallery': {'max_nudity_score': 90, 'mandatory_stages': ['child_analysis']},
+                'private_content': {'max_nudity_score': 100, 'mandatory_stages': ['child_analysis']}
+            },
+            # Reject when explicit nudity exceeds the context's max_nudity_score even
+            # though the risk score is below the auto-reject threshold (off: risk score only)
+            'enforce_context_nudity_limit': False,
+            'cascade': {
+                'enabled': True
             }
         }
         
+        # Stages a mandatory stage needs, which are therefore mandatory too
+        self.stage_prerequisites = {
+            'child_analysis': ['image_description']
+        }
+        
+        # Contexts without a policy keep every stage and no extra nudity limit
+        self.fallback_context_policy = {'max_nudity_score': 100, 'mandatory_stages': ['child_analysis']}
+        
         # In-memory configuration storage (could be replaced with database)
         self.active_config = self.default_config.copy()
         
@@ -64,6 +99,15 @@ class ConfigurableAnalysisComponents:
                 'age_estimation': request_form.get('enable_age_estimation', 'true').lower() == 'true',
                 'child_content_detection': request_form.get('enable_child_detection', 'true').lower() == 'true',
                 'image_description': request_form.get('enable_image_description', 'true').lower() == 'true'
+            },
+            # Thresholds and policies are server-side settings (see /config)
+            'risk_thresholds': self.active_config.get('risk_thresholds', self.default_config['risk_thresholds']),
+            'context_policies': self.active_config.get('context_policies', self.default_config['context_policies']),
+            'enforce_context_nudity_limit': self.active_config.get('enforce_context_nudity_limit',
+                                                                   self.default_config['enforce_context_nudity_limit']),
+            'cascade': {
+                'enabled': (request_form.get('enable_cascade', 'true').lower() == 'true' and
+                            self.active_config.get('cascade', self.default_config['cascade']).get('enabled', True))
             }
         }
         
@@ -115,6 +159,23 @@ class ConfigurableAnalysisComponents:
         logger.info(f"📊 Filtered detections: {len(detections)} → {len(filtered_detections)}")
         return filtered_detections
 
+    def context_policy(self, config: Dict, context_type: str) -> Dict:
+        """Context policy for context_type, with mandatory stages expanded to their prerequisites"""
+        policies = config.get('context_policies', self.default_config['context_policies'])
+        policy = dict(policies.get(context_type, self.fallback_context_policy))
+        
+        mandatory = list(policy.get('mandatory_stages', []))
+        # A policy edited through /config cannot drop child analysis while it is enabled
+        if (config.get('blip_components', {}).get('child_content_detection', True)
+                and 'child_analysis' not in mandatory):
+            mandatory.append('child_analysis')
+        for stage_name in list(mandatory):
+            for prerequisite in self.stage_prerequisites.get(stage_name, []):
+                if prerequisite not in mandatory:
+                    mandatory.append(prerequisite)
+        policy['mandatory_stages'] = mandatory
+        return policy
+
 
 class EnhancedMinimalV4Configurable:
     def __init__(self):
@@ -125,44 +186,162 @@ class EnhancedMinimalV4Configurable:
             # Initialize configuration manager
             self.config_manager = ConfigurableAnalysisComponents()
             
-            # Initialize NudeNet detector
-            self.nude_detector = NudeDetector()
+            # Models come from the shared inference sidecar when INFERENCE_SIDECAR_SOCKET is set
+            self.sidecar = sidecar_from_env()
+            
+            # Initialize NudeNet (in-process ONNX engine, takes decoded arrays)
+            if self.sidecar and 'nudenet' in self.sidecar.models:
+                self.nude_detector = SidecarNudeDetector(self.sidecar)
+            else:
+                with metrics.time_model_load('nudenet'):
+                    self.nude_detector = NudeNetEngine()
+            
+            # Concurrent /analyze requests share NudeNet batches
+            self.nudenet_batcher = MicroBatcher(
+                self.nude_detector.detect_batch,
+                max_batch_size=int(os.getenv('NUDENET_MAX_BATCH', '8')),
+                max_wait_ms=float(os.getenv('NUDENET_MAX_WAIT_MS', '5')),
+                name='nudenet'
+            )
             
             # Try to initialize BLIP for descriptions
             self.blip_available = False
-            try:
-                logger.info("🖼️ Attempting to load BLIP model...")
-                from transformers import BlipProcessor, BlipForConditionalGeneration
-                self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-                self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+            if self.sidecar and 'blip' in self.sidecar.models:
+                self.caption_service = SidecarCaptionService(self.sidecar, generate_kwargs={'max_length': 50})
                 self.blip_available = True
-                logger.info("✅ BLIP model loaded successfully")
-            except Exception as e:
-                logger.warning(f"⚠️ BLIP model failed to load: {e}")
-                logger.info("📝 Will use fallback image description method")
+            else:
+                try:
+                    logger.info("🖼️ Attempting to load BLIP model...")
+                    from transformers import BlipProcessor, BlipForConditionalGeneration
+                    with metrics.time_model_load('blip'):
+                        self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
+                        self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+                    self.caption_service = CaptionService(self.blip_processor, self.blip_model,
+                                                          generate_kwargs={'max_length': 50})
+                    self.blip_available = True
+                    logger.info("✅ BLIP model loaded successfully")
+                except Exception as e:
+                    logger.warning(f"⚠️ BLIP model failed to load: {e}")
+                    logger.info("📝 Will use fallback image description method")
             
             # Age thresholds
             self.MIN_AGE_THRESHOLD = 16
             self.SUSPICIOUS_AGE_THRESHOLD = 18
             
+            # Risk score thresholds used by make_moderation_decision
+            self.AUTO_REJECT_RISK_SCORE = 80
+            self.REVIEW_RISK_SCORE = 40
+            
+            # Classes that count against a context's max_nudity_score (faces and
+            # covered parts drive nudity_score but are allowed everywhere)
+            self.EXPLICIT_NUDITY_CLASSES = {
+                'FEMALE_BREAST_EXPOSED', 'FEMALE_GENITALIA_EXPOSED', 'MALE_GENITALIA_EXPOSED',
+                'BUTTOCKS_EXPOSED', 'ANUS_EXPOSED'
+            }
+            
+            # Stage graph: NudeNet, face and description stages run concurrently;
+            # child analysis and risk assessment join on their results
+            self.stage_graph = StageGraph('v4_configurable')
+            self.stage_graph.add('nudity_detection', self._run_nudity_stage, deps=['image_rgb', 'config'])
+            self.stage_graph.add('face_analysis', self._run_face_stage, deps=['config'])
+            self.stage_graph.add('image_description', self._run_description_stage, deps=['image_rgb', 'config'])
+            self.stage_graph.add('child_analysis', self._run_child_stage,
+                                 deps=['image_description', 'face_analysis', 'config'])
+            self.stage_graph.add('combined_assessment', self._run_risk_stage,
+                                 deps=['nudity_detection', 'child_analysis', 'config'])
+            
+            # Cascade graph: cheapest stages first (simulated faces, NudeNet), then BLIP
+            # and child analysis only while their result can still change the decision
+            self.cascade_graph = StageGraph('v4_cascade')
+            self.cascade_graph.add('face_analysis', self._run_face_stage, deps=['config'])
+            self.cascade_graph.add('nudity_detection', self._run_nudity_stage, deps=['image_rgb', 'config'])
+            self.cascade_graph.add('image_description', self._run_description_stage, deps=['image_rgb', 'config'],
+                                   gate=partial(self._cascade_skip_reason, 'image_description'),
+                                   gate_deps=['nudity_detection', 'config', 'context_type'],
+                                   on_skip=self._skipped_description)
+            self.cascade_graph.add('child_analysis', self._run_child_stage,
+                                   deps=['image_description', 'face_analysis', 'config'],
+                                   gate=partial(self._cascade_skip_reason, 'child_analysis'),
+                                   gate_deps=['nudity_detection', 'config', 'context_type'],
+                                   on_skip=self._skipped_child_analysis)
+            self.cascade_graph.add('combined_assessment', self._run_risk_stage,
+                                   deps=['nudity_detection', 'child_analysis', 'config'])
+            
+            # Result cache: identical bytes under the same config and models reuse the analysis
+            self.model_versions = {
+                'analysis': '4.0_configurable',
+                'nudenet': self.nude_detector.model_version,
+                'blip': 'Salesforce/blip-image-captioning-base' if self.blip_available else None
+            }
+            self.result_cache = ResultCache(
+                max_entries=int(os.getenv('RESULT_CACHE_ENTRIES', '1024')),
+                max_bytes=int(float(os.getenv('RESULT_CACHE_MAX_MB', '64')) * 1024 * 1024),
+                sqlite_path=os.getenv('RESULT_CACHE_DB') or None
+            )
+            
+            # Near-duplicate index: resized/recompressed copies reuse prior verdicts
+            self.perceptual_index = None
+            if os.getenv('PHASH_INDEX_ENABLED', 'true').lower() == 'true':
+                self.perceptual_index = PerceptualIndex(
+                    max_distance=int(os.getenv('PHASH_MAX_DISTANCE', '6')),
+                    blocklist_distance=int(os.getenv('PHASH_BLOCKLIST_DISTANCE', '10')),
+                    max_entries=int(os.getenv('PHASH_INDEX_ENTRIES', '10000'))
+                )
+            
             logger.info("✅ Enhanced Minimal v4.0 initialized successfully")
             
         except Exception as e:
             logger.error(f"❌ Failed to initialize: {e}")
             raise
 
-    def analyze_image(self, image_path: str, context_type: str = 'public_gallery', 
-                     model_id: int = 1, config: Dict = None) -> Dict:
+    def analyze_image(self, image_source: ImageSource, context_type: str = 'public_gallery', 
+                     model_id: int = 1, config: Dict = None, timer: Optional[StageTimer] = None,
+                     reuse_near_duplicates: bool = True) -> Dict:
         """
         Enhanced minimal v4.0 analysis with configurable components
+        (per-stage durations are recorded on timer and returned in metadata['timings'])
         """
+        timer = timer or StageTimer()
+        image_info = None
         try:
-            logger.info(f"🔍 Starting configurable analysis for: {os.path.basename(image_path)}")
+            logger.info(f"🔍 Starting configurable analysis for: {describe_image_source(image_source)}")
             
             # Use provided config or default
             if config is None:
                 config = self.config_manager.default_config
             
+            # Decode once; NudeNet and BLIP share the same upright RGB buffer
+            with timer.stage('decode_exif'):
+                decoded = decode_image(image_source)
+            image_rgb = decoded.rgb
+            image_info = {'width': decoded.width, 'height': decoded.height, 'format': decoded.format,
+                          'exif_orientation': decoded.exif_orientation}
+            
+            # Near-duplicates of an image already analysed in this scope reuse its result;
+            # the hash is only needed when the perceptual index is enabled
+            image_phash = phash_scope = None
+            if self.perceptual_index is not None:
+                with timer.stage('phash'):
+                    image_phash = phash(image_rgb)
+                phash_scope = canonical_hash({'config': config, 'models': self.model_versions,
+                                              'context_type': context_type})
+            if image_phash is not None and reuse_near_duplicates:
+                with timer.stage('near_duplicate_lookup'):
+                    near_duplicate = self.perceptual_index.lookup(phash_scope, image_phash)
+                if near_duplicate is not None:
+                    prior_result, match = near_duplicate
+                    logger.info(f"♻️ Near-duplicate ({match['match_type']}, distance {match['distance']}) - "
+                                f"reusing {match['prior_status']} verdict")
+                    prior_result['metadata'].update({
+                        'timestamp': datetime.now().isoformat(),
+                        'model_id': model_id,
+                        'phash': f'{image_phash:016x}',
+                        'near_duplicate': match,
+                        'image': image_info,
+                        'timings': timer.as_metadata()
+                    })
+                    return prior_result
+            
             analysis_results = {
                 'success': True,
                 'metadata': {
@@ -170,80 +349,45 @@ class EnhancedMinimalV4Configurable:
                     'timestamp': datetime.now().isoformat(),
                     'context_type': context_type,
                     'model_id': model_id,
-                    'configuration_used': config
+                    'configuration_used': config,
+                    'image': image_info
                 }
             }
             
-            # 1. NudeNet Analysis (if any components enabled)
-            nudenet_enabled = any(config.get('nudenet_components', {}).values())
-            if nudenet_enabled:
-                logger.info("🔍 Running NudeNet detection...")
-                nudenet_results = self.analyze_nudity_configurable(image_path, config)
-                analysis_results.update(nudenet_results)
-            else:
-                logger.info("⚠️ All NudeNet components disabled - skipping")
-                analysis_results.update({
-                    'nudity_detection': {
-                        'detected_parts': {},
-                        'part_locations': {},
-                        'nudity_score': 0,
-                        'has_nudity': False,
-                        'analysis_skipped': 'all_nudenet_components_disabled'
-                    }
-                })
-            
-            # 2. Face Analysis (simulated for now)
-            if config.get('nudenet_components', {}).get('face_detection', True):
-                logger.info("👤 Running simulated face analysis...")
-                face_results = self.simulate_face_analysis()
-                analysis_results['face_analysis'] = face_results
-            else:
-                logger.info("⚠️ Face detection disabled - skipping")
-                analysis_results['face_analysis'] = {
-                    'faces_detected': False,
-                    'face_count': 0,
-                    'analysis_skipped': 'face_detection_disabled'
-                }
-            
-            # 3. BLIP Image Description (if enabled)
-            if config.get('blip_components', {}).get('image_description', True):
-                logger.info("📝 Running BLIP image description...")
-                description_results = self.generate_image_description(image_path)
-                analysis_results['image_description'] = description_results
-            else:
-                logger.info("⚠️ Image description disabled - skipping")
-                analysis_results['image_description'] = {
-                    'description': 'Image description disabled',
-                    'tags': [],
-                    'generation_method': 'disabled_by_config'
-                }
-            
-            # 4. Child Content Analysis (if enabled)
-            if config.get('blip_components', {}).get('child_content_detection', True):
-                logger.info("🛡️ Running child content analysis...")
-                child_results = self.analyze_child_content(
-                    analysis_results.get('image_description', {}),
-                    analysis_results.get('face_analysis', {}),
-                    config
-                )
-                analysis_results['child_analysis'] = child_results
-            else:
-                logger.info("⚠️ Child content detection disabled - skipping")
-                analysis_results['child_analysis'] = {
-                    'contains_children': False,
-                    'child_keywords_found': [],
-                    'analysis_skipped': 'child_detection_disabled'
-                }
-            
-            # 5. Enhanced Risk Assessment
-            logger.info("⚖️ Computing enhanced risk assessment...")
-            risk_results = self.compute_enhanced_risk_assessment(analysis_results, config)
-            analysis_results['combined_assessment'] = risk_results
+            # 1-5. Stage graph: NudeNet, face analysis and BLIP description run
+            # concurrently, then child content analysis and enhanced risk assessment.
+            # With the cascade, BLIP and child analysis wait for NudeNet and are
+            # skipped when the decision is already determined.
+            context_policy = self.config_manager.context_policy(config, context_type)
+            use_cascade = (config.get('cascade', {}).get('enabled', True) and
+                           'child_analysis' not in context_policy['mandatory_stages'])
+            stage_graph = self.cascade_graph if use_cascade else self.stage_graph
+            
+            stage_results = stage_graph.run(image_rgb=image_rgb, config=config, context_type=context_type)
+            for stage_name, seconds in stage_results[STAGE_TIMINGS].items():
+                timer.record(stage_name, seconds)
+            for stage_name in stage_graph.stages:
+                analysis_results[stage_name] = stage_results[stage_name]
+            
+            analysis_results['metadata']['cascade'] = {
+                'enabled': use_cascade,
+                'stage_order': list(stage_graph.stages),
+                'mandatory_stages': context_policy['mandatory_stages'],
+                'skipped_stages': stage_results[SKIPPED_STAGES]
+            }
+            if stage_results[SKIPPED_STAGES]:
+                logger.info(f"⏭️ Cascade skipped: {stage_results[SKIPPED_STAGES]}")
             
             # 6. Moderation Decision
-            moderation_decision = self.make_moderation_decision(analysis_results, config)
+            with timer.stage('moderation_decision'):
+                moderation_decision = self.make_moderation_decision(analysis_results, config)
             analysis_results['moderation_decision'] = moderation_decision
             
+            if image_phash is not None:
+                analysis_results['metadata']['phash'] = f'{image_phash:016x}'
+                self.perceptual_index.add(phash_scope, image_phash, analysis_results)
+            
+            analysis_results['metadata']['timings'] = timer.as_metadata()
             logger.info(f"✅ Configurable analysis complete: {analysis_results.get('combined_assessment', {}).get('risk_level', 'unknown')} risk")
             return analysis_results
             
@@ -253,15 +397,117 @@ class EnhancedMinimalV4Configurable:
             return {
                 'success': False,
                 'error': str(e),
+                'error_type': type(e).__name__,
                 'analysis_version': '4.0_configurable_error',
-                'timestamp': datetime.now().isoformat()
+                'timestamp': datetime.now().isoformat(),
+                'image': image_info,
+                'timings': timer.as_metadata()
             }
 
-    def analyze_nudity_configurable(self, image_path: str, config: Dict) -> Dict:
+    def _cascade_skip_reason(self, stage_name: str, nudity_detection: Dict, config: Dict,
+                             context_type: str) -> Optional[str]:
+        """Skip reason for a cascade stage, or None when its result can still change the decision"""
+        context_policy = self.config_manager.context_policy(config, context_type)
+        if stage_name in context_policy['mandatory_stages']:
+            return None
+        
+        # Risk only grows from the nudity score, so these verdicts are final; child
+        # content (-> review) is the one override, and child_analysis plus its
+        # prerequisites are mandatory whenever child detection is enabled
+        nudity_score = nudity_detection.get('nudity_score', 0)
+        if nudity_score >= self.AUTO_REJECT_RISK_SCORE:
+            return f'nudity_score_{nudity_score:.1f}_at_auto_reject_threshold_{self.AUTO_REJECT_RISK_SCORE}'
+        
+        if config.get('enforce_context_nudity_limit', False):
+            explicit_nudity_score = nudity_detection.get('explicit_nudity_score', 0)
+            max_nudity_score = context_policy.get('max_nudity_score', 100)
+            if explicit_nudity_score > max_nudity_score:
+                return f'explicit_nudity_{explicit_nudity_score:.1f}_over_{context_type}_limit_{max_nudity_score}'
+        
+        return None
+
+    def _skipped_description(self, reason: str) -> Dict:
+        return {
+            'description': 'Image description skipped',
+            'tags': [],
+            'generation_method': 'skipped_by_cascade',
+            'analysis_skipped': reason
+        }
+
+    def _skipped_child_analysis(self, reason: str) -> Dict:
+        return {
+            'contains_children': False,
+            'child_keywords_found': [],
+            'analysis_skipped': reason
+        }
+
+    def _run_nudity_stage(self, image_rgb: np.ndarray, config: Dict) -> Dict:
+        """Stage 1: NudeNet analysis (if any components enabled)"""
+        if not any(config.get('nudenet_components', {}).values()):
+            logger.info("⚠️ All NudeNet components disabled - skipping")
+            return {
+                'detected_parts': {},
+                'part_locations': {},
+                'nudity_score': 0,
+                'has_nudity': False,
+                'analysis_skipped': 'all_nudenet_components_disabled'
+            }
+        
+        logger.info("🔍 Running NudeNet detection...")
+        return self.analyze_nudity_configurable(image_rgb, config)['nudity_detection']
+
+    def _run_face_stage(self, config: Dict) -> Dict:
+        """Stage 2: Face analysis (simulated for now)"""
+        if not config.get('nudenet_components', {}).get('face_detection', True):
+            logger.info("⚠️ Face detection disabled - skipping")
+            return {
+                'faces_detected': False,
+                'face_count': 0,
+                'analysis_skipped': 'face_detection_disabled'
+            }
+        
+        logger.info("👤 Running simulated face analysis...")
+        return self.simulate_face_analysis()
+
+    def _run_description_stage(self, image_rgb: np.ndarray, config: Dict) -> Dict:
+        """Stage 3: BLIP image description (if enabled)"""
+        if not config.get('blip_components', {}).get('image_description', True):
+            logger.info("⚠️ Image description disabled - skipping")
+            return {
+                'description': 'Image description disabled',
+                'tags': [],
+                'generation_method': 'disabled_by_config'
+            }
+        
+        logger.info("📝 Running BLIP image description...")
+        return self.generate_image_description(image_rgb)
+
+    def _run_child_stage(self, image_description: Dict, face_analysis: Dict, config: Dict) -> Dict:
+        """Stage 4: Child content analysis (if enabled), joins description and faces"""
+        if not config.get('blip_components', {}).get('child_content_detection', True):
+            logger.info("⚠️ Child content detection disabled - skipping")
+            return {
+                'contains_children': False,
+                'child_keywords_found': [],
+                'analysis_skipped': 'child_detection_disabled'
+            }
+        
+        logger.info("🛡️ Running child content analysis...")
+        return self.analyze_child_content(image_description, face_analysis, config)
+
+    def _run_risk_stage(self, nudity_detection: Dict, child_analysis: Dict, config: Dict) -> Dict:
+        """Stage 5: Enhanced risk assessment, joins nudity and child analysis"""
+        logger.info("⚖️ Computing enhanced risk assessment...")
+        return self.compute_enhanced_risk_assessment({
+            'nudity_detection': nudity_detection,
+            'child_analysis': child_analysis
+        }, config)
+
+    def analyze_nudity_configurable(self, image_rgb: np.ndarray, config: Dict) -> Dict:
         """Run NudeNet analysis with configurable component filtering"""
         try:
-            # Run full NudeNet detection
-            raw_detections = self.nude_detector.detect(image_path)
+            # Run full NudeNet detection (batched with other in-flight requests)
+            raw_detections = self.nudenet_batcher(image_rgb)
             logger.info(f"🔍 NudeNet raw detections: {len(raw_detections)} items")
             
             # Filter based on configuration
@@ -272,12 +518,15 @@ class EnhancedMinimalV4Configurable:
             detected_parts = {}
             part_locations = {}
             max_confidence = 0
+            explicit_confidence = 0
             
             for detection in filtered_detections:
                 class_name = detection['class'].upper()
                 confidence = detection['score'] * 100
                 detected_parts[class_name] = confidence
                 max_confidence = max(max_confidence, confidence)
+                if class_name in self.EXPLICIT_NUDITY_CLASSES:
+                    explicit_confidence = max(explicit_confidence, confidence)
                 
                 # Store location
                 box = detection['box']
@@ -294,6 +543,7 @@ class EnhancedMinimalV4Configurable:
                     'detected_parts': detected_parts,
                     'part_locations': part_locations,
                     'nudity_score': max_confidence,
+                    'explicit_nudity_score': explicit_confidence,
                     'has_nudity': max_confidence > 30,
                     'raw_detection_count': len(raw_detections),
                     'filtered_detection_count': len(filtered_detections),
@@ -324,7 +574,7 @@ class EnhancedMinimalV4Configurable:
             'simulation_note': 'Simulated face analysis - not real detection'
         }
 
-    def generate_image_description(self, image_path: str) -> Dict:
+    def generate_image_description(self, image_rgb: np.ndarray) -> Dict:
         """Generate BLIP-based image description"""
         if not self.blip_available:
             return {
@@ -334,13 +584,8 @@ class EnhancedMinimalV4Configurable:
             }
         
         try:
-            # Load and process image
-            image = Image.open(image_path).convert('RGB')
-            inputs = self.blip_processor(image, return_tensors="pt")
-            
-            # Generate description
-            out = self.blip_model.generate(**inputs, max_length=50)
-            description = self.blip_processor.decode(out[0], skip_special_tokens=True)
+            # Generate description (batched with concurrent requests)
+            description = self.caption_service.caption(image_rgb)
             
             # Extract tags from description
             tags = [word.lower() for word in description.split() 
@@ -464,6 +709,9 @@ class EnhancedMinimalV4Configurable:
         """Make final moderation decision"""
         risk_score = analysis_results.get('combined_assessment', {}).get('final_risk_score', 0)
         child_detected = analysis_results.get('child_analysis', {}).get('contains_children', False)
+        explicit_nudity_score = analysis_results.get('nudity_detection', {}).get('explicit_nudity_score', 0)
+        context_type = analysis_results.get('metadata', {}).get('context_type', 'public_gallery')
+        max_nudity_score = self.config_manager.context_policy(config, context_type).get('max_nudity_score', 100)
         
         # Always flag child content regardless of other factors
         if child_detected:
@@ -475,14 +723,21 @@ class EnhancedMinimalV4Configurable:
             }
         
         # Risk-based decisions
-        if risk_score >= 80:
+        if risk_score >= self.AUTO_REJECT_RISK_SCORE:
             return {
                 'status': 'auto_rejected',
                 'action': 'reject',
                 'human_review_required': False,
                 'reason': f'high_risk_score_{risk_score}'
             }
-        elif risk_score >= 40:
+        elif config.get('enforce_context_nudity_limit', False) and explicit_nudity_score > max_nudity_score:
+            return {
+                'status': 'auto_rejected',
+                'action': 'reject',
+                'human_review_required': False,
+                'reason': f'nudity_over_{context_type}_limit_{max_nudity_score}'
+            }
+        elif risk_score >= self.REVIEW_RISK_SCORE:
             return {
                 'status': 'flagged_for_review',
                 'action': 'require_human_review',
@@ -500,22 +755,35 @@ class EnhancedMinimalV4Configurable:
 # Global instance
 api = EnhancedMinimalV4Configurable()
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint with configuration status"""
-    return jsonify({
+def health_status() -> Dict:
+    """Health payload shared by the Flask app and the async front end"""
+    return {
         'status': 'healthy',
         'version': '4.0_configurable',
         'message': 'Enhanced Minimal v4.0 with Configurable Components',
         'blip_available': api.blip_available,
         'blip_model': 'Salesforce/blip-image-captioning-base' if api.blip_available else None,
         'device': 'cpu',
+        'nudenet_batching': api.nudenet_batcher.stats(),
+        'blip_batching': api.caption_service.stats() if api.blip_available else None,
+        'result_cache': api.result_cache.stats(),
+        'perceptual_index': api.perceptual_index.stats() if api.perceptual_index else None,
+        'jobs': job_runner.stats() if job_runner.started else None,
+        'model_versions': api.model_versions,
+        'inference_sidecar': api.sidecar.socket_path if api.sidecar else None,
         'features': [
             'configurable_nudenet_components',
+            'nudenet_micro_batching',
             'configurable_blip_components', 
             'component_filtering',
             'enhanced_risk_assessment',
-            'child_content_detection'
+            'child_content_detection',
+            'decision_cascade',
+            'result_cache',
+            'near_duplicate_index',
+            'async_jobs',
+            'raw_body_and_shared_path_uploads',
+            'flight_recorder'
         ],
         'pipeline_stages': [
             'request_config_parsing',
@@ -525,45 +793,122 @@ def health_check():
             'optional_child_analysis',
             'enhanced_risk_assessment'
         ]
-    })
+    }
+
+def parse_model_id(form) -> int:
+    """model_id form field as an int (ValueError, answered with 400, when it is not one)"""
+    try:
+        return int(form.get('model_id', 1))
+    except (TypeError, ValueError):
+        raise ValueError(f"model_id must be an integer, got {form.get('model_id')!r}")
+
+def analyze_upload(image_bytes: bytes, form, use_cache: bool = True) -> Tuple[Dict, int]:
+    """Analyze uploaded image bytes with form parameters; returns (response body, status)
+    
+    use_cache=False always runs the full pipeline (no result cache or near-duplicate reuse).
+    """
+    # Get basic parameters
+    context_type = form.get('context_type', 'public_gallery')
+    model_id = parse_model_id(form)
+    
+    # Parse configuration from request
+    config = api.config_manager.parse_request_config(form)
+    
+    logger.info(f"📊 Received analysis request:")
+    logger.info(f"  Context: {context_type}, Model: {model_id}")
+    logger.info(f"  Config version: {form.get('config_version', 'not_specified')}")
+    
+    timer = StageTimer()
+    with metrics.track_in_flight():
+        # Identical bytes under the same effective config reuse the cached analysis
+        with timer.stage('cache_lookup'):
+            cache_key = api.result_cache.make_key(image_bytes, config, api.model_versions, context_type=context_type)
+            cached_result = api.result_cache.get(cache_key) if use_cache else None
+        if cached_result is not None:
+            logger.info("⚡ Result cache hit")
+            cached_result['metadata']['model_id'] = model_id
+            cached_result['metadata']['cache'] = {'hit': True, 'key': cache_key}
+            cached_result['metadata']['timings'] = timer.as_metadata()
+            metrics.observe(timer, context_type, 'cache_hit')
+            return cached_result, 200
+        
+        # Analyze the image with configuration, decoding from the upload buffer
+        result = api.analyze_image(image_bytes, context_type, model_id, config, timer=timer,
+                                   reuse_near_duplicates=use_cache)
+    
+    if result.get('success'):
+        api.result_cache.put(cache_key, result)
+        result['metadata']['cache'] = {'hit': False, 'key': cache_key}
+        outcome = 'near_duplicate' if 'near_duplicate' in result['metadata'] else result['moderation_decision']['status']
+    else:
+        outcome = 'error'
+    metrics.observe(timer, context_type, outcome)
+    flight_recorder.observe(image_bytes, result, form, config, image_hash=cache_key.split(':')[0])
+    return result, 200
+
+# Slowest and failed analyses for /debug/slow (FLIGHT_RECORDER_SIZE, FLIGHT_RECORDER_DIR)
+flight_recorder = recorder_from_env()
+
+# Durable job queue: POST /jobs returns immediately, workers run analyze_upload
+job_runner = JobRunner(
+    JobStore(os.getenv('JOB_DB', 'moderation_jobs.db'),
+             lease_seconds=float(os.getenv('JOB_LEASE_SECONDS', '300'))),
+    handler=analyze_upload,
+    workers=int(os.getenv('JOB_WORKERS', '2')),
+    callback_batch_size=int(os.getenv('JOB_CALLBACK_BATCH', '50'))
+)
+
+# Scrape-time gauges next to the stage histograms
+metrics.gauge('queue_depth', 'Items waiting in each internal queue', lambda: {
+    'nudenet_batch': api.nudenet_batcher.stats()['queued'],
+    'blip_batch': api.caption_service.stats().get('queued', 0) if api.blip_available else 0,
+    'jobs': job_runner.store.stats()['jobs'].get('queued', 0)
+}, label='queue')
+
+@app.before_request
+def start_job_runner():
+    """Resume queued jobs as soon as this process (or a pre-forked worker) serves traffic"""
+    job_runner.ensure_started()
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint with configuration status"""
+    return jsonify(health_status())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics: per-stage latency histograms, queue depth, in-flight requests, model load times"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/analyze', methods=['POST'])  
 def analyze_image_endpoint():
-    """Main image analysis endpoint with configuration support"""
+    """Main image analysis endpoint with configuration support
+    
+    Accepts a multipart 'image', a raw application/octet-stream body (parameters in
+    the query string or X-Moderation-* headers) or an image_path under SHARED_UPLOAD_ROOT.
+    profile=1 (with PROFILING_ENABLED or X-Admin-Token) runs the request under the
+    sampling profiler and returns the profile in metadata['profile'].
+    """
     try:
-        if 'image' not in request.files:
+        image_bytes, form = request_image(request)
+        if image_bytes is None:
             return jsonify({'success': False, 'error': 'No image file provided'}), 400
         
-        image_file = request.files['image']
-        if image_file.filename == '':
-            return jsonify({'success': False, 'error': 'Empty filename'}), 400
-        
-        # Get basic parameters
-        context_type = request.form.get('context_type', 'public_gallery')
-        model_id = int(request.form.get('model_id', 1))
-        
-        # Parse configuration from request
-        config = api.config_manager.parse_request_config(request.form)
-        
-        logger.info(f"📊 Received analysis request:")
-        logger.info(f"  Context: {context_type}, Model: {model_id}")
-        logger.info(f"  Config version: {request.form.get('config_version', 'not_specified')}")
+        if form.get('profile') == '1':
+            if not profiling_allowed(request.headers.get('X-Admin-Token')):
+                return jsonify({'success': False, 'error': 'Profiling not allowed'}), 403
+            # Profiled runs skip the caches so the slow path is what gets sampled
+            with RequestProfiler('analyze') as profiler:
+                result, status = analyze_upload(image_bytes, form, use_cache=False)
+            result.setdefault('metadata', {})['profile'] = profiler.export(form.get('profile_format', 'speedscope'))
+            logger.info(f"🔬 Profiled analysis: {profiler.sample_count} samples")
+            return jsonify(result), status
         
-        # Save uploaded file temporarily
-        temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg')
-        os.close(temp_fd)
-        image_file.save(temp_path)
-        
-        try:
-            # Analyze the image with configuration
-            result = api.analyze_image(temp_path, context_type, model_id, config)
-            return jsonify(result)
-        finally:
-            # Clean up
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+        result, status = analyze_upload(image_bytes, form)
+        return jsonify(result), status
+    
+    except (ValueError, PermissionError, FileNotFoundError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
                 
     except Exception as e:
         logger.error(f"API endpoint error: {e}")
@@ -574,6 +919,54 @@ def analyze_image_endpoint():
             'analysis_version': '4.0_configurable_error'
         }), 500
 
+@app.route('/debug/slow', methods=['GET'])
+def debug_slow_endpoint():
+    """Flight recorder: the slowest and most recently failed analyses (?limit=N)
+
+    Entries carry the request form, config and input path, so this needs the
+    same PROFILING_ENABLED / X-Admin-Token permission as profile=1.
+    """
+    if not profiling_allowed(request.headers.get('X-Admin-Token')):
+        return jsonify({'success': False, 'error': 'Debug endpoints not allowed'}), 403
+    return jsonify(flight_recorder.snapshot(request.args.get('limit', type=int)))
+
+@app.route('/jobs', methods=['POST'])
+def submit_job_endpoint():
+    """Queue an analysis job (same form fields as /analyze, plus optional callback_url)"""
+    try:
+        image_bytes, form = request_image(request)
+        if image_bytes is None:
+            return jsonify({'success': False, 'error': 'No image file provided'}), 400
+        
+        parse_model_id(form)
+        form.pop('image_path', None)
+        callback_url = form.pop('callback_url', None) or None
+        job_id = job_runner.submit(image_bytes, form, callback_url)
+        
+        logger.info(f"🗂️ Queued job {job_id} (context: {form.get('context_type', 'public_gallery')}, "
+                    f"model: {form.get('model_id', 1)})")
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/jobs/{job_id}'
+        }), 202
+    
+    except (ValueError, PermissionError, FileNotFoundError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+        
+    except Exception as e:
+        logger.error(f"Job submit error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_endpoint(job_id):
+    """Job status, plus the analysis result once finished"""
+    job = job_runner.store.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/config', methods=['GET'])
 def get_current_config():
     """Get current active configuration"""
@@ -610,4 +1003,6 @@ def update_config():
 
 if __name__ == '__main__':
     logger.info("🚀 Starting Enhanced Minimal v4.0 with Configurable Components")
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    job_runner.ensure_started()
+    host, port = listen_address('0.0.0.0', 5000)
+    app.run(host=host, port=port, debug=False, threaded=True)
\ No newline at end of file
@@ -5,25 +5,31 @@ Multi-stage content moderation with NudeNet + InsightFace (BLIP optional)
 Focus on age detection with fallback image descriptions
 """
 
-import cv2
 import numpy as np
 import json
 import os
-from flask import Flask, request, jsonify
-from nudenet import NudeDetector
+from flask import Flask, Response, request, jsonify
 import logging
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Optional
 import traceback
-from PIL import Image, ExifTags
-import tempfile
 import insightface
 from insightface.app import FaceAnalysis
+from moderation_image import DecodedImage, ImageSource, decode_image, describe_image_source
+from upload_buffer import BufferedUploadRequest, listen_address, request_image
+from nudenet_engine import NudeNetEngine
+from blip_captioning import CaptionService
+from stage_graph import STAGE_TIMINGS, StageGraph
+from stage_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, StageTimer, metrics
+from request_profiler import RequestProfiler, profiling_allowed
+from flight_recorder import recorder_from_env
+from inference_sidecar import SidecarCaptionService, SidecarFaceAnalyzer, SidecarNudeDetector, sidecar_from_env
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.request_class = BufferedUploadRequest
 
 class EnhancedModerationPipelineV3Simplified:
     def __init__(self):
@@ -31,111 +37,109 @@ class EnhancedModerationPipelineV3Simplified:
         try:
             logger.info("🚀 Initializing Enhanced Moderation Pipeline v3.0 (Simplified)...")
             
-            # 1. Initialize NudeNet detector (existing)
-            logger.info("📱 Loading NudeNet detector...")
-            self.nude_detector = NudeDetector()
+            # Models hosted by the shared inference sidecar (INFERENCE_SIDECAR_SOCKET) are not loaded here
+            self.sidecar = sidecar_from_env()
+            sidecar_models = self.sidecar.models if self.sidecar else {}
+            
+            # 1. Initialize NudeNet (in-process ONNX engine, takes decoded arrays)
+            if 'nudenet' in sidecar_models:
+                self.nude_detector = SidecarNudeDetector(self.sidecar)
+            else:
+                logger.info("📱 Loading NudeNet detector...")
+                with metrics.time_model_load('nudenet'):
+                    self.nude_detector = NudeNetEngine()
             
             # 2. Initialize InsightFace for age/gender detection
-            logger.info("👤 Loading InsightFace for age estimation...")
-            self.face_analyzer = FaceAnalysis(providers=['CPUExecutionProvider'])
-            self.face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
+            if 'faces' in sidecar_models:
+                self.face_analyzer = SidecarFaceAnalyzer(self.sidecar)
+            else:
+                logger.info("👤 Loading InsightFace for age estimation...")
+                with metrics.time_model_load('insightface'):
+                    self.face_analyzer = FaceAnalysis(providers=['CPUExecutionProvider'])
+                    self.face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
             
             # 3. BLIP is optional - will use fallback if not available
             self.blip_available = False
-            try:
-                logger.info("🖼️ Attempting to load BLIP model...")
-                from transformers import BlipProcessor, BlipForConditionalGeneration
-                self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-                self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+            if 'blip' in sidecar_models:
+                self.caption_service = SidecarCaptionService(self.sidecar,
+                                                             generate_kwargs={'max_length': 100, 'num_beams': 3})
                 self.blip_available = True
-                logger.info("✅ BLIP model loaded successfully")
-            except Exception as e:
-                logger.warning(f"⚠️ BLIP model failed to load: {e}")
-                logger.info("📝 Will use fallback image description method")
+            else:
+                try:
+                    logger.info("🖼️ Attempting to load BLIP model...")
+                    from transformers import BlipProcessor, BlipForConditionalGeneration
+                    with metrics.time_model_load('blip'):
+                        self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
+                        self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+                    self.caption_service = CaptionService(self.blip_processor, self.blip_model,
+                                                          generate_kwargs={'max_length': 100, 'num_beams': 3})
+                    self.blip_available = True
+                    logger.info("✅ BLIP model loaded successfully")
+                except Exception as e:
+                    logger.warning(f"⚠️ BLIP model failed to load: {e}")
+                    logger.info("📝 Will use fallback image description method")
             
             # Age thresholds
             self.MIN_AGE_THRESHOLD = 16
             self.SUSPICIOUS_AGE_THRESHOLD = 18
             
+            # Stage graph: the model stages only need the image and run concurrently;
+            # risk assessment joins them and the decision follows
+            self.stage_graph = StageGraph('v3_simplified')
+            self.stage_graph.add('nudity_analysis', self._analyze_nudity, deps=['image_rgb'])
+            self.stage_graph.add('face_analysis', self._analyze_faces, deps=['image_rgb'])
+            self.stage_graph.add('image_description', self._generate_image_description, deps=['image_rgb'])
+            self.stage_graph.add('combined_assessment', self._combine_v3_assessments,
+                                 deps=['nudity_analysis', 'face_analysis', 'image_description', 'context_type'])
+            self.stage_graph.add('moderation_decision', self._generate_v3_moderation_decision,
+                                 deps=['combined_assessment', 'face_analysis', 'context_type'])
+            
             logger.info("✅ Enhanced Moderation Pipeline v3.0 (Simplified) initialized successfully!")
             
         except Exception as e:
             logger.error(f"Failed to initialize Enhanced Moderation Pipeline v3.0: {e}")
             raise
 
-    def normalize_image_orientation(self, image_path: str) -> str:
-        """Apply EXIF rotation and normalize orientation"""
-        try:
-            img = Image.open(image_path)
-            
-            # Apply EXIF rotation
-            try:
-                exif = img._getexif()
-                if exif is not None:
-                    for key, value in ExifTags.TAGS.items():
-                        if value == 'Orientation':
-                            orientation = exif.get(key)
-                            if orientation == 3:
-                                img = img.rotate(180, expand=True)
-                            elif orientation == 6:
-                                img = img.rotate(90, expand=True)
-                            elif orientation == 8:
-                                img = img.rotate(-90, expand=True)
-                            break
-            except Exception as e:
-                logger.warning(f"EXIF processing failed: {e}")
-            
-            # Save normalized image
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg')
-            os.close(temp_fd)
-            img.save(temp_path, 'JPEG', quality=95, exif=b'')
-            return temp_path
-            
-        except Exception as e:
-            logger.error(f"Image orientation normalization failed: {e}")
-            return image_path
+    def normalize_image_orientation(self, image_source: ImageSource) -> DecodedImage:
+        """Decode the upload once and apply EXIF rotation in memory"""
+        return decode_image(image_source)
 
-    def analyze_image(self, image_path: str, context_type: str = 'public_gallery', 
+    def analyze_image(self, image_source: ImageSource, context_type: str = 'public_gallery', 
                      model_id: int = 1) -> Dict:
         """
         Multi-stage content analysis pipeline v3.0 (simplified)
         """
+        timer = StageTimer()
+        image_info = None
         try:
-            logger.info(f"🚀 Starting moderation pipeline v3.0 for: {image_path}")
-            
-            # Load and validate image
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError(f"Could not load image from {image_path}")
-            
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            logger.info(f"📷 Image loaded: {image.shape}")
-            
-            # Stage 1: NSFW Detection with NudeNet
-            logger.info("🔞 Stage 1: Running NSFW detection...")
-            nudity_analysis = self._analyze_nudity(image_path)
-            
-            # Stage 2: Face Detection & Age Estimation
-            logger.info("👤 Stage 2: Running face detection and age estimation...")
-            face_analysis = self._analyze_faces(image_rgb)
+            logger.info(f"🚀 Starting moderation pipeline v3.0 for: {describe_image_source(image_source)}")
             
-            # Stage 3: Image Description Generation (with fallback)
-            logger.info("📝 Stage 3: Generating image description...")
-            image_description = self._generate_image_description(image_path)
-            
-            # Stage 4: Combined Risk Assessment
-            logger.info("⚖️ Stage 4: Performing combined risk assessment...")
-            combined_assessment = self._combine_v3_assessments(
-                nudity_analysis, face_analysis, image_description, context_type
-            )
-            
-            # Stage 5: Generate Moderation Decision
-            logger.info("🎯 Stage 5: Generating moderation decision...")
-            moderation_decision = self._generate_v3_moderation_decision(
-                combined_assessment, face_analysis, context_type
-            )
+            # Decode once; every stage consumes the same upright RGB buffer
+            try:
+                with timer.stage('decode_exif'):
+                    decoded = self.normalize_image_orientation(image_source)
+            except Exception as e:
+                raise ValueError(f"Could not load image from {describe_image_source(image_source)}: {e}")
+            
+            image_rgb = decoded.rgb
+            image_info = {'width': decoded.width, 'height': decoded.height, 'format': decoded.format,
+                          'exif_orientation': decoded.exif_orientation}
+            logger.info(f"📷 Image loaded: {image_rgb.shape} (EXIF orientation {decoded.exif_orientation})")
+            
+            # Stages 1-3 (NudeNet, InsightFace, description) run concurrently,
+            # then combined risk assessment (4) and the moderation decision (5)
+            logger.info("🔀 Stages 1-3: Running NSFW detection, face analysis and description concurrently...")
+            stage_results = self.stage_graph.run(image_rgb=image_rgb, context_type=context_type)
+            for stage_name, seconds in stage_results[STAGE_TIMINGS].items():
+                timer.record(stage_name, seconds)
+            nudity_analysis = stage_results['nudity_analysis']
+            face_analysis = stage_results['face_analysis']
+            image_description = stage_results['image_description']
+            combined_assessment = stage_results['combined_assessment']
+            moderation_decision = stage_results['moderation_decision']
             
             logger.info(f"✅ Analysis complete - Status: {moderation_decision['status']}")
+            metrics.observe(timer, context_type, moderation_decision['status'])
             
             return {
                 'success': True,
@@ -150,6 +154,8 @@ class EnhancedModerationPipelineV3Simplified:
                     'context_type': context_type,
                     'model_id': model_id,
                     'analysis_version': '3.0_simplified_nudenet_insightface',
+                    'image': image_info,
+                    'timings': timer.as_metadata(),
                     'pipeline_stages': ['nudity_detection', 'face_analysis', 'image_description', 'risk_assessment'],
                     'blip_available': self.blip_available
                 }
@@ -158,18 +164,20 @@ class EnhancedModerationPipelineV3Simplified:
         except Exception as e:
             logger.error(f"Pipeline v3.0 analysis failed: {e}")
             logger.error(traceback.format_exc())
+            metrics.observe(timer, context_type, 'error')
             return {
                 'success': False,
                 'error': str(e),
-                'analysis_version': '3.0_simplified_nudenet_insightface'
+                'error_type': type(e).__name__,
+                'analysis_version': '3.0_simplified_nudenet_insightface',
+                'image': image_info,
+                'timings': timer.as_metadata()
             }
 
-    def _analyze_nudity(self, image_path: str) -> Dict:
+    def _analyze_nudity(self, image_rgb: np.ndarray) -> Dict:
         """Stage 1: Analyze nudity using NudeNet"""
-        normalized_path = None
         try:
-            normalized_path = self.normalize_image_orientation(image_path)
-            predictions = self.nude_detector.detect(normalized_path)
+            predictions = self.nude_detector.detect(image_rgb)
             
             if not predictions:
                 return {
@@ -217,12 +225,6 @@ class EnhancedModerationPipelineV3Simplified:
                 'part_locations': {},
                 'part_count': 1
             }
-        finally:
-            if normalized_path and normalized_path != image_path:
-                try:
-                    os.unlink(normalized_path)
-                except:
-                    pass
 
     def _analyze_faces(self, image_rgb: np.ndarray) -> Dict:
         """Stage 2: Detect faces and estimate ages using InsightFace"""
@@ -305,28 +307,18 @@ class EnhancedModerationPipelineV3Simplified:
                 'error': str(e)
             }
 
-    def _generate_image_description(self, image_path: str) -> Dict:
+    def _generate_image_description(self, image_rgb: np.ndarray) -> Dict:
         """Stage 3: Generate image description using BLIP or fallback method"""
         if self.blip_available:
-            return self._generate_blip_description(image_path)
+            return self._generate_blip_description(image_rgb)
         else:
-            return self._generate_fallback_description(image_path)
+            return self._generate_fallback_description(image_rgb)
 
-    def _generate_blip_description(self, image_path: str) -> Dict:
+    def _generate_blip_description(self, image_rgb: np.ndarray) -> Dict:
         """Generate description using BLIP model"""
         try:
-            import torch
-            
-            # Load and process image
-            image = Image.open(image_path).convert('RGB')
-            
-            # Generate description
-            inputs = self.blip_processor(image, return_tensors="pt")
-            
-            with torch.no_grad():
-                out = self.blip_model.generate(**inputs, max_length=100, num_beams=3)
-            
-            description = self.blip_processor.decode(out[0], skip_special_tokens=True)
+            # Generate description (batched with concurrent requests)
+            description = self.caption_service.caption(image_rgb)
             
             # Generate tags from description
             tags = self._extract_tags_from_description(description)
@@ -341,14 +333,13 @@ class EnhancedModerationPipelineV3Simplified:
             
         except Exception as e:
             logger.error(f"BLIP description generation failed: {e}")
-            return self._generate_fallback_description(image_path)
+            return self._generate_fallback_description(image_rgb)
 
-    def _generate_fallback_description(self, image_path: str) -> Dict:
+    def _generate_fallback_description(self, image_rgb: np.ndarray) -> Dict:
         """Generate basic description using image analysis"""
         try:
             # Basic image analysis
-            image = Image.open(image_path)
-            width, height = image.size
+            height, width = image_rgb.shape[:2]
             
             # Simple heuristic-based description
             aspect_ratio = width / height
@@ -557,39 +548,59 @@ def health_check():
         'status': 'healthy',
         'version': '3.0_simplified',
         'pipeline_stages': ['nudity_detection', 'face_analysis', 'image_description', 'risk_assessment'],
-        'blip_available': api.blip_available
+        'blip_available': api.blip_available,
+        'blip_batching': api.caption_service.stats() if api.blip_available else None,
+        'inference_sidecar': api.sidecar.socket_path if api.sidecar else None
     })
 
+# Slowest and failed analyses for /debug/slow (FLIGHT_RECORDER_SIZE, FLIGHT_RECORDER_DIR)
+flight_recorder = recorder_from_env()
+
+@app.route('/debug/slow', methods=['GET'])
+def debug_slow_endpoint():
+    """Flight recorder: the slowest and most recently failed analyses (?limit=N)
+
+    Entries carry the request form, config and input path, so this needs the
+    same PROFILING_ENABLED / X-Admin-Token permission as profile=1.
+    """
+    if not profiling_allowed(request.headers.get('X-Admin-Token')):
+        return jsonify({'success': False, 'error': 'Debug endpoints not allowed'}), 403
+    return jsonify(flight_recorder.snapshot(request.args.get('limit', type=int)))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics: per-stage latency histograms, in-flight requests, model load times"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/analyze', methods=['POST'])
 def analyze_image_endpoint():
-    """Main image analysis endpoint"""
+    """Main image analysis endpoint (multipart 'image', raw octet-stream body or shared image_path)"""
     try:
-        if 'image' not in request.files:
+        image_bytes, params = request_image(request)
+        if image_bytes is None:
             return jsonify({'success': False, 'error': 'No image file provided'}), 400
         
-        image_file = request.files['image']
-        if image_file.filename == '':
-            return jsonify({'success': False, 'error': 'Empty filename'}), 400
-        
         # Get parameters
-        context_type = request.form.get('context_type', 'public_gallery')
-        model_id = int(request.form.get('model_id', 1))
+        context_type = params.get('context_type', 'public_gallery')
+        model_id = int(params.get('model_id', 1))
         
-        # Save uploaded file temporarily
-        temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg')
-        os.close(temp_fd)
-        image_file.save(temp_path)
-        
-        try:
-            # Analyze the image
-            result = api.analyze_image(temp_path, context_type, model_id)
+        # Decode straight from the in-memory upload buffer
+        # profile=1 (with PROFILING_ENABLED or X-Admin-Token) samples this request's stacks
+        if params.get('profile') == '1':
+            if not profiling_allowed(request.headers.get('X-Admin-Token')):
+                return jsonify({'success': False, 'error': 'Profiling not allowed'}), 403
+            with metrics.track_in_flight(), RequestProfiler('analyze') as profiler:
+                result = api.analyze_image(image_bytes, context_type, model_id)
+            result.setdefault('metadata', {})['profile'] = profiler.export(params.get('profile_format', 'speedscope'))
             return jsonify(result)
-        finally:
-            # Clean up
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+        
+        with metrics.track_in_flight():
+            result = api.analyze_image(image_bytes, context_type, model_id)
+        flight_recorder.observe(image_bytes, result, params, config={})
+        return jsonify(result)
+    
+    except (ValueError, PermissionError, FileNotFoundError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
                 
     except Exception as e:
         logger.error(f"API endpoint error: {e}")
@@ -602,4 +613,5 @@ def analyze_image_endpoint():
 
 if __name__ == '__main__':
     logger.info("🚀 Starting Enhanced Moderation Pipeline v3.0 (Simplified)")
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    host, port = listen_address('0.0.0.0', 5000)
+    app.run(host=host, port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Flight recorder for slow and failed analyses
+Keeps the N slowest and the N most recent failed analyses in memory, each with
+the image hash, dimensions, format, EXIF orientation, effective config,
+per-stage durations and the error. /debug/slow serves the buffers to admins
+only (PROFILING_ENABLED or X-Admin-Token, as for profile=1). With
+FLIGHT_RECORDER_DIR set, the input bytes and the entry are also written there
+(content-addressed, deleted again once no buffer references them) so a case
+can be replayed offline:
+
+    python flight_recorder.py replay /var/lib/moderation/flight/<sha256>.json --url http://127.0.0.1:5000/analyze
+"""
+
+import os
+import json
+import heapq
+import hashlib
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FlightRecorder:
+    """Bounded buffers of the slowest and most recently failed analyses"""
+
+    def __init__(self, capacity: int = 20, persist_dir: Optional[str] = None):
+        self.capacity = max(1, capacity)
+        self.persist_dir = persist_dir
+        self._slowest: List[tuple] = []  # min-heap of (total_ms, sequence, entry)
+        self._failures = deque(maxlen=self.capacity)
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.observed = 0
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+
+    def _admits_slow(self, total_ms: float) -> bool:
+        return len(self._slowest) < self.capacity or total_ms > self._slowest[0][0]
+
+    def observe(self, image_bytes: bytes, result: Dict, form: Dict, config: Dict,
+                image_hash: Optional[str] = None):
+        """Consider one finished analysis; cheap unless it is a failure or among the slowest"""
+        metadata = result.get('metadata') or {}
+        timings = metadata.get('timings') or result.get('timings') or {}
+        total_ms = timings.get('total_ms', 0.0)
+        failed = not result.get('success')
+
+        with self._lock:
+            self.observed += 1
+            if not failed and not self._admits_slow(total_ms):
+                return
+
+        image = metadata.get('image') or result.get('image') or {}
+        image_hash = image_hash or hashlib.sha256(image_bytes).hexdigest()
+        entry = {
+            'recorded_at': datetime.now().isoformat(),
+            'image_sha256': image_hash,
+            'size_bytes': len(image_bytes),
+            'width': image.get('width'),
+            'height': image.get('height'),
+            'format': image.get('format'),
+            'exif_orientation': image.get('exif_orientation'),
+            'context_type': form.get('context_type', 'public_gallery'),
+            'model_id': form.get('model_id', 1),
+            'form': {key: value for key, value in form.items() if key not in ('image_path', 'profile')},
+            'config': config,
+            'total_ms': total_ms,
+            'stages_ms': timings.get('stages_ms', {}),
+            'status': (result.get('moderation_decision') or {}).get('status'),
+            'error': result.get('error'),
+            'error_type': result.get('error_type')
+        }
+
+        evicted = []
+        with self._lock:
+            self._sequence += 1
+            if failed:
+                if len(self._failures) == self._failures.maxlen:
+                    evicted.append(self._failures[0])
+                self._failures.append(entry)
+            elif self._admits_slow(total_ms):
+                if len(self._slowest) < self.capacity:
+                    heapq.heappush(self._slowest, (total_ms, self._sequence, entry))
+                else:
+                    evicted.append(heapq.heapreplace(self._slowest, (total_ms, self._sequence, entry))[2])
+            else:
+                return
+
+        if self.persist_dir:
+            self._persist(entry, image_bytes)
+            for old_entry in evicted:
+                self._discard(old_entry)
+
+    def _path(self, image_hash: str, suffix: str) -> str:
+        return os.path.join(self.persist_dir, f'{image_hash}{suffix}')
+
+    def _persist(self, entry: Dict, image_bytes: bytes):
+        try:
+            input_path = self._path(entry['image_sha256'], '.bin')
+            if not os.path.exists(input_path):
+                with open(input_path, 'wb') as f:
+                    f.write(image_bytes)
+            entry['input_path'] = input_path
+            with open(self._path(entry['image_sha256'], '.json'), 'w') as f:
+                json.dump(entry, f, indent=2, default=str)
+        except OSError as e:
+            logger.warning(f"⚠️ Flight recorder could not persist {entry['image_sha256']}: {e}")
+
+    def _discard(self, entry: Dict):
+        """Remove an evicted entry's files unless another buffered entry shares the image"""
+        image_hash = entry['image_sha256']
+        with self._lock:
+            if any(other['image_sha256'] == image_hash for other in self._entries()):
+                return
+        for suffix in ('.bin', '.json'):
+            try:
+                os.unlink(self._path(image_hash, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _entries(self) -> List[Dict]:
+        return [item[2] for item in self._slowest] + list(self._failures)
+
+    def snapshot(self, limit: Optional[int] = None) -> Dict:
+        """Slowest first, then most recent failures first"""
+        with self._lock:
+            slowest = [item[2] for item in sorted(self._slowest, key=lambda item: item[0], reverse=True)]
+            failures = list(reversed(self._failures))
+            observed = self.observed
+        return {
+            'capacity': self.capacity,
+            'observed': observed,
+            'persist_dir': self.persist_dir,
+            'slowest': slowest[:limit] if limit else slowest,
+            'failures': failures[:limit] if limit else failures
+        }
+
+
+def recorder_from_env() -> FlightRecorder:
+    return FlightRecorder(capacity=int(os.getenv('FLIGHT_RECORDER_SIZE', '20')),
+                          persist_dir=os.getenv('FLIGHT_RECORDER_DIR') or None)
+
+
+def replay(entry_path: str, url: str) -> Dict:
+    """POST a persisted input back to a server's /analyze with its original parameters"""
+    with open(entry_path) as f:
+        entry = json.load(f)
+    with open(entry['input_path'], 'rb') as f:
+        image_bytes = f.read()
+    request = urllib.request.Request(f"{url}?{urllib.parse.urlencode(entry['form'])}", data=image_bytes,
+                                     headers={'Content-Type': 'application/octet-stream'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay flight recorder inputs')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    replay_parser = subcommands.add_parser('replay', help='Send a recorded input to /analyze again')
+    replay_parser.add_argument('entry', help='<sha256>.json written to FLIGHT_RECORDER_DIR')
+    replay_parser.add_argument('--url', default='http://127.0.0.1:5000/analyze')
+    args = parser.parse_args()
+
+    result = replay(args.entry, args.url)
+    timings = (result.get('metadata') or {}).get('timings') or result.get('timings')
+    print(json.dumps({'success': result.get('success'), 'error': result.get('error'), 'timings': timings}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
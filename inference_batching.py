@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Dynamic micro-batching for model inference
+Concurrent requests submit single items; a background thread groups whatever
+arrives within max_wait_ms (up to max_batch_size items) into one batch call
+and fans the results back out to the waiting callers
+"""
+
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Groups concurrent submit() calls into batched calls of batch_fn"""
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 8,
+                 max_wait_ms: float = 5.0, name: str = 'batcher'):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+        # Counters reported in /health
+        self.batches_run = 0
+        self.items_processed = 0
+        self.largest_batch = 0
+
+    def _ensure_worker(self):
+        """Start the worker thread lazily (and again in a forked child)"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; the returned future resolves to its batch_fn result"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Submit one item and block until its result is ready"""
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect_batch(self, work_queue: queue.Queue) -> List:
+        """Block for the first item, then gather more until full or max_wait_ms passes"""
+        batch = [work_queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(work_queue.get_nowait())
+                else:
+                    batch.append(work_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        work_queue = self._queue
+        while True:
+            batch = self._collect_batch(work_queue)
+            futures = [future for _, future in batch if future.set_running_or_notify_cancel()]
+            items = [item for item, future in batch if future in futures]
+            if not items:
+                continue
+
+            try:
+                results = self._call_batch(items)
+            except Exception as e:
+                if len(items) == 1:
+                    futures[0].set_exception(e)
+                    continue
+                # One bad input must not fail unrelated requests: retry each item alone
+                logger.warning(f"⚠️ {self.name} batch of {len(items)} failed ({e}), retrying items one by one")
+                self._run_individually(items, futures)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+
+            self.batches_run += 1
+            self.items_processed += len(items)
+            self.largest_batch = max(self.largest_batch, len(items))
+
+    def _call_batch(self, items: List[Any]) -> List[Any]:
+        results = self.batch_fn(items)
+        if len(results) != len(items):
+            raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items")
+        return results
+
+    def _run_individually(self, items: List[Any], futures: List[Future]):
+        for item, future in zip(items, futures):
+            try:
+                future.set_result(self._call_batch([item])[0])
+            except Exception as e:
+                logger.error(f"❌ {self.name} item failed: {e}")
+                future.set_exception(e)
+
+    def stats(self) -> Dict:
+        """Batching configuration and counters"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'batches_run': self.batches_run,
+            'items_processed': self.items_processed,
+            'largest_batch': self.largest_batch,
+            'average_batch_size': round(self.items_processed / self.batches_run, 2) if self.batches_run else 0
+        }
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Bounded inference queue with explicit backpressure and priority lanes
+Requests are queued for a fixed pool of inference worker threads; once a
+lane is full, submit() raises QueueFullError with a Retry-After estimate
+instead of letting work pile up until clients time out. Workers serve the
+highest-priority lane first, with aging so lower lanes are never starved.
+Within a lane, tenants (model_id) share workers by weighted deficit
+round-robin, so one creator's 500-photo upload cannot hold everyone else back.
+Per-tenant counters are kept for at most max_tenants tenants; the least
+recently seen idle ones are folded into 'other', so /health stays bounded
+however many model_ids clients send.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_LANE = 'default'
+DEFAULT_TENANT = 'default'
+OTHER_TENANT = 'other'
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised by InferenceQueue.submit when the request's lane is at capacity"""
+
+    def __init__(self, depth: int, retry_after: int, lane: str = DEFAULT_LANE, tenant: Optional[str] = None):
+        scope = f"lane '{lane}'" if tenant is None else f"lane '{lane}' share for tenant '{tenant}'"
+        super().__init__(f"Inference queue {scope} full ({depth} waiting), retry after {retry_after}s")
+        self.depth = depth
+        self.retry_after = retry_after
+        self.lane = lane
+        self.tenant = tenant
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an unsorted list (0 when empty)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class _Lane:
+    """One priority lane: its own bound, per-tenant FIFOs scheduled by deficit round-robin
+
+    Each item costs one unit; a tenant's deficit grows by its weight whenever
+    it reaches the front of the rotation, so over a busy period tenants are
+    served in proportion to their weights regardless of how much they queued.
+    """
+
+    def __init__(self, name: str, rank: int, max_depth: int):
+        self.name = name
+        self.rank = rank
+        self.max_depth = max(1, int(max_depth))
+        self.tenants: Dict[str, deque] = {}
+        self.active = OrderedDict()  # tenant -> deficit, in round-robin order
+        self.depth = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=1000)
+        self.latencies = deque(maxlen=1000)
+
+    def tenant_depth(self, tenant: str) -> int:
+        items = self.tenants.get(tenant)
+        return len(items) if items else 0
+
+    def oldest_enqueued_at(self) -> Optional[float]:
+        """Enqueue time of the longest-waiting item, used for aging across lanes"""
+        heads = [self.tenants[tenant][0][0] for tenant in self.active]
+        return min(heads) if heads else None
+
+    def push(self, tenant: str, item):
+        items = self.tenants.setdefault(tenant, deque())
+        items.append(item)
+        if tenant not in self.active:
+            self.active[tenant] = 0.0
+        self.depth += 1
+
+    def pop(self, weight_of: Callable[[str], float]):
+        """Next (tenant, item) by weighted deficit round-robin"""
+        while True:
+            tenant, deficit = next(iter(self.active.items()))
+            if deficit < 1.0:
+                # Top up and send the tenant to the back of the rotation
+                self.active[tenant] = deficit + weight_of(tenant)
+                self.active.move_to_end(tenant)
+                continue
+
+            items = self.tenants[tenant]
+            item = items.popleft()
+            self.depth -= 1
+            if items:
+                self.active[tenant] = deficit - 1.0
+            else:
+                # Idle tenants do not bank credit
+                del self.active[tenant]
+                del self.tenants[tenant]
+            return tenant, item
+
+    def clear(self):
+        self.tenants.clear()
+        self.active.clear()
+        self.depth = 0
+
+    def stats(self) -> Dict:
+        wait_times = list(self.wait_times)
+        latencies = list(self.latencies)
+        return {
+            'priority': self.rank,
+            'depth': self.depth,
+            'active_tenants': len(self.active),
+            'max_depth': self.max_depth,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'wait_ms': {
+                'p50': round(percentile(wait_times, 0.50) * 1000, 1),
+                'p95': round(percentile(wait_times, 0.95) * 1000, 1)
+            },
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.50) * 1000, 1),
+                'p95': round(percentile(latencies, 0.95) * 1000, 1),
+                'p99': round(percentile(latencies, 0.99) * 1000, 1)
+            }
+        }
+
+
+class InferenceQueue:
+    """Bounded priority lanes feeding a pool of worker threads that run handler(payload)
+
+    lanes is an ordered list of (name, max_depth), highest priority first; by
+    default there is a single lane of max_depth. A queued item's effective
+    priority improves by one lane per aging_seconds waited, so a lower lane
+    is served at the latest after (rank difference * aging_seconds).
+
+    tenant_weights sets relative shares per tenant (default_weight otherwise),
+    and tenant_share caps the fraction of a lane's depth one tenant may hold.
+    max_tenants bounds how many tenants get their own counters in stats().
+    """
+
+    def __init__(self, handler: Callable[[Any], Any], workers: int = 4, max_depth: int = 32,
+                 name: str = 'inference', lanes: Optional[List[Tuple[str, int]]] = None,
+                 aging_seconds: float = 10.0, tenant_weights: Optional[Dict[str, float]] = None,
+                 default_weight: float = 1.0, tenant_share: float = 1.0, max_tenants: int = 256):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.name = name
+        self.aging_seconds = aging_seconds
+        self.tenant_weights = {str(tenant): float(weight) for tenant, weight in (tenant_weights or {}).items()}
+        self.default_weight = default_weight
+        self.tenant_share = min(1.0, max(0.0, tenant_share))
+        self.max_tenants = max(1, int(max_tenants))
+
+        lanes = lanes or [(DEFAULT_LANE, max_depth)]
+        self.lanes = {lane_name: _Lane(lane_name, rank, depth) for rank, (lane_name, depth) in enumerate(lanes)}
+        self.max_depth = sum(lane.max_depth for lane in self.lanes.values())
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._threads = []
+        self._pid = None
+
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_times = deque(maxlen=1000)
+        self._service_time_ewma = None
+        self._tenant_counters = OrderedDict()  # tenant -> counters, least recently seen first
+
+    def _ensure_workers(self):
+        """Start worker threads lazily (and again in a forked child); caller holds the lock"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for lane in self.lanes.values():
+            lane.clear()
+        self._threads = []
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'{self.name}-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def depth(self) -> int:
+        return sum(lane.depth for lane in self.lanes.values())
+
+    def weight(self, tenant: str) -> float:
+        """Positive scheduling weight of a tenant"""
+        return max(0.01, self.tenant_weights.get(tenant, self.default_weight))
+
+    def _tenant_counter(self, tenant: str) -> Dict[str, int]:
+        """Counters of a tenant, making room under max_tenants; caller holds the lock"""
+        counter = self._tenant_counters.get(tenant)
+        if counter is not None:
+            if tenant != OTHER_TENANT:
+                self._tenant_counters.move_to_end(tenant)
+            return counter
+        while len(self._tenant_counters) >= self.max_tenants and self._fold_idle_tenant():
+            pass
+        counter = self._tenant_counters[tenant] = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+        return counter
+
+    def _fold_idle_tenant(self) -> bool:
+        """Merge the least recently seen tenant with nothing queued into 'other'; False if there is none"""
+        for tenant in self._tenant_counters:
+            if tenant != OTHER_TENANT and not any(lane.tenant_depth(tenant) for lane in self.lanes.values()):
+                break
+        else:
+            # Every tenant has queued work, so the count is bounded by the lanes' depth anyway
+            return False
+        folded = self._tenant_counters.pop(tenant)
+        other = self._tenant_counters.setdefault(OTHER_TENANT, dict.fromkeys(folded, 0))
+        for key, value in folded.items():
+            other[key] += value
+        return True
+
+    def retry_after(self, lane_name: Optional[str] = None) -> int:
+        """Seconds until a new request in lane_name (or any lane) would likely be served"""
+        if lane_name is None:
+            ahead = self.depth
+        else:
+            rank = self.lanes[lane_name].rank
+            ahead = sum(lane.depth for lane in self.lanes.values() if lane.rank <= rank)
+        service_time = self._service_time_ewma or 1.0
+        return max(1, min(60, math.ceil((ahead + 1) * service_time / self.workers)))
+
+    def submit(self, payload: Any, lane: Optional[str] = None, tenant: Optional[Any] = None) -> Future:
+        """Queue payload for handler() in a lane on behalf of a tenant
+
+        Raises QueueFullError when the lane, or the tenant's share of it, is full.
+        """
+        tenant = DEFAULT_TENANT if tenant is None else str(tenant)
+        with self._lock:
+            self._ensure_workers()
+            if lane is None:
+                lane = next(iter(self.lanes))
+            if lane not in self.lanes:
+                raise ValueError(f"Unknown lane '{lane}' (lanes: {list(self.lanes)})")
+
+            target = self.lanes[lane]
+            counter = self._tenant_counter(tenant)
+            tenant_limit = max(1, math.ceil(target.max_depth * self.tenant_share))
+            tenant_depth = target.tenant_depth(tenant)
+            if target.depth >= target.max_depth or tenant_depth >= tenant_limit:
+                target.rejected += 1
+                counter['rejected'] += 1
+                self.rejected += 1
+                if target.depth >= target.max_depth:
+                    raise QueueFullError(target.depth, self.retry_after(lane), lane)
+                raise QueueFullError(tenant_depth, self.retry_after(lane), lane, tenant)
+
+            future = Future()
+            target.push(tenant, (time.monotonic(), payload, future))
+            target.submitted += 1
+            counter['submitted'] += 1
+            self.submitted += 1
+            self._not_empty.notify()
+            return future
+
+    def _next_lane(self, now: float) -> _Lane:
+        """Lane whose oldest item has the best aged priority; caller holds the lock"""
+        best, best_score = None, None
+        for lane in self.lanes.values():
+            oldest = lane.oldest_enqueued_at()
+            if oldest is None:
+                continue
+            score = lane.rank - (now - oldest) / self.aging_seconds
+            if best is None or score < best_score:
+                best, best_score = lane, score
+        return best
+
+    def _take(self):
+        with self._lock:
+            while not self.depth:
+                self._not_empty.wait()
+            now = time.monotonic()
+            lane = self._next_lane(now)
+            tenant, (enqueued_at, payload, future) = lane.pop(self.weight)
+            self.in_flight += 1
+            self._wait_times.append(now - enqueued_at)
+            lane.wait_times.append(now - enqueued_at)
+            return lane, tenant, enqueued_at, payload, future
+
+    def _run(self):
+        while True:
+            lane, tenant, enqueued_at, payload, future = self._take()
+            started = time.monotonic()
+            succeeded = False
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(self.handler(payload))
+                    succeeded = True
+            except Exception as e:
+                logger.error(f"❌ {self.name} worker failed: {e}")
+                future.set_exception(e)
+            finally:
+                finished = time.monotonic()
+                service_time = finished - started
+                with self._lock:
+                    self.in_flight -= 1
+                    lane.latencies.append(finished - enqueued_at)
+                    counter = self._tenant_counter(tenant)
+                    if succeeded:
+                        self.completed += 1
+                        counter['completed'] += 1
+                    else:
+                        self.failed += 1
+                        counter['failed'] += 1
+                    if self._service_time_ewma is None:
+                        self._service_time_ewma = service_time
+                    else:
+                        self._service_time_ewma = 0.8 * self._service_time_ewma + 0.2 * service_time
+
+    def tenant_stats(self) -> Dict[str, Dict]:
+        """Per-tenant weight, queued depth per lane and counters; caller holds the lock"""
+        tenants = {}
+        for tenant, counter in self._tenant_counters.items():
+            depths = {name: lane.tenant_depth(tenant) for name, lane in self.lanes.items()}
+            tenants[tenant] = dict(counter, weight=self.weight(tenant), depth=sum(depths.values()),
+                                   lane_depths={name: depth for name, depth in depths.items() if depth})
+        return tenants
+
+    def stats(self) -> Dict:
+        """Queue depth, wait times and counters for /health"""
+        with self._lock:
+            wait_times = list(self._wait_times)
+            return {
+                'depth': self.depth,
+                'max_depth': self.max_depth,
+                'in_flight': self.in_flight,
+                'workers': self.workers,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'wait_ms': {
+                    'p50': round(percentile(wait_times, 0.50) * 1000, 1),
+                    'p95': round(percentile(wait_times, 0.95) * 1000, 1),
+                    'max': round(max(wait_times) * 1000, 1) if wait_times else 0.0
+                },
+                'service_time_ms': round((self._service_time_ewma or 0.0) * 1000, 1),
+                'retry_after_s': self.retry_after(),
+                'aging_seconds': self.aging_seconds,
+                'tenant_share': self.tenant_share,
+                'lanes': {name: lane.stats() for name, lane in self.lanes.items()},
+                'tenants': self.tenant_stats()
+            }
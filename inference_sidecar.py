@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Shared model-hosting sidecar for the moderation front ends
+One process owns the NudeNet, BLIP and InsightFace weights and serves them over a
+Unix domain socket. Front ends started with INFERENCE_SIDECAR_SOCKET become thin
+clients, so each host keeps a single copy of the models and NudeNet/BLIP requests
+from every front end are micro-batched together.
+
+Wire format (all integers big-endian):
+    request   header  !2sBBIHI  magic b'MS', version, op, request_id, image_count, params_len
+              params  JSON object (params_len bytes, may be empty)
+              images  image_count x (!III height, width, channels + raw uint8 pixels, RGB)
+    response  header  !2sBBII   magic b'MS', version, status (0 ok / 1 error), request_id, body_len
+              body    JSON object: {"results": [...]} or {"error": "..."}
+
+Usage:
+    python inference_sidecar.py --socket /run/moderation/inference.sock --models nudenet,blip,faces
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import struct
+import logging
+import argparse
+import threading
+import socketserver
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from moderation_image import decode_image
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MS'
+PROTOCOL_VERSION = 1
+REQUEST_HEADER = struct.Struct('!2sBBIHI')
+RESPONSE_HEADER = struct.Struct('!2sBBII')
+IMAGE_HEADER = struct.Struct('!III')
+
+OP_PING = 0
+OP_INFO = 1
+OP_NUDENET = 2
+OP_CAPTION = 3
+OP_FACES = 4
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# Errors that mean the request never reached a live sidecar, so resending it is safe
+RETRYABLE_ERRORS = (ConnectionRefusedError, ConnectionResetError, BrokenPipeError, FileNotFoundError)
+
+BLIP_MODEL_NAME = 'Salesforce/blip-image-captioning-base'
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytearray:
+    """Read exactly size bytes
+
+    EOF before the first byte raises ConnectionResetError (the peer closed an
+    idle connection); EOF part-way through raises ConnectionError.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            if received == 0:
+                raise ConnectionResetError('Connection closed')
+            raise ConnectionError('Connection closed mid-frame')
+        received += count
+    return buffer
+
+
+def _send_images(sock: socket.socket, images: Sequence[np.ndarray]):
+    for image in images:
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        sock.sendall(IMAGE_HEADER.pack(height, width, channels))
+        sock.sendall(memoryview(image).cast('B'))
+
+
+def _recv_images(sock: socket.socket, count: int) -> List[np.ndarray]:
+    images = []
+    for _ in range(count):
+        height, width, channels = IMAGE_HEADER.unpack(_recv_exact(sock, IMAGE_HEADER.size))
+        pixels = _recv_exact(sock, height * width * channels)
+        images.append(np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, channels))
+    return images
+
+
+def serialize_face(face) -> Dict:
+    """InsightFace Face -> JSON fields the front ends read"""
+    return {
+        'bbox': [float(v) for v in face.bbox],
+        'det_score': float(face.det_score),
+        'age': int(face.age) if getattr(face, 'age', None) is not None else None,
+        'sex': face.sex if getattr(face, 'gender', None) is not None else None
+    }
+
+
+class InferenceSidecar:
+    """Loads the requested models once and answers inference ops"""
+
+    def __init__(self, models: Sequence[str] = ('nudenet', 'blip', 'faces')):
+        self.models = {}
+        self.load_seconds = {}
+        self.started_at = time.time()
+        self.requests = 0
+        self._caption_services = {}
+        self._caption_lock = threading.Lock()
+
+        if 'nudenet' in models:
+            self._load('nudenet', self._load_nudenet)
+        if 'blip' in models:
+            self._load('blip', self._load_blip)
+        if 'faces' in models:
+            self._load('faces', self._load_faces)
+
+    def _load(self, name: str, loader):
+        started = time.monotonic()
+        try:
+            loader()
+            self.load_seconds[name] = round(time.monotonic() - started, 2)
+            logger.info(f"✅ {name} loaded in {self.load_seconds[name]}s")
+        except Exception as e:
+            logger.warning(f"⚠️ {name} failed to load: {e}")
+
+    def _load_nudenet(self):
+        from nudenet_engine import NudeNetEngine
+        from inference_batching import MicroBatcher
+
+        engine = NudeNetEngine()
+        self.nudenet_batcher = MicroBatcher(
+            engine.detect_batch,
+            max_batch_size=int(os.getenv('NUDENET_MAX_BATCH', '8')),
+            max_wait_ms=float(os.getenv('NUDENET_MAX_WAIT_MS', '5')),
+            name='sidecar-nudenet'
+        )
+        self.models['nudenet'] = {'model_version': engine.model_version}
+
+    def _load_blip(self):
+        from transformers import BlipProcessor, BlipForConditionalGeneration
+
+        self.blip_processor = BlipProcessor.from_pretrained(BLIP_MODEL_NAME)
+        self.blip_model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL_NAME)
+        self.models['blip'] = {'model_version': BLIP_MODEL_NAME}
+
+    def _load_faces(self):
+        from insightface.app import FaceAnalysis
+
+        self.face_analyzer = FaceAnalysis(providers=['CPUExecutionProvider'])
+        self.face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
+        self.models['faces'] = {'model_version': 'insightface_buffalo_l'}
+
+    def caption_service(self, generate_kwargs: Dict):
+        """One batched CaptionService per generate() profile, sharing the BLIP weights"""
+        from blip_captioning import CaptionService
+
+        key = json.dumps(generate_kwargs, sort_keys=True)
+        with self._caption_lock:
+            service = self._caption_services.get(key)
+            if service is None:
+                service = CaptionService(self.blip_processor, self.blip_model, generate_kwargs=generate_kwargs)
+                self._caption_services[key] = service
+            return service
+
+    def _require(self, name: str):
+        if name not in self.models:
+            raise RuntimeError(f"Model '{name}' is not loaded in this sidecar")
+
+    def handle(self, op: int, params: Dict, images: List[np.ndarray]) -> Dict:
+        self.requests += 1
+        if op == OP_PING:
+            return {'results': []}
+        if op == OP_INFO:
+            return self.info()
+        if op == OP_NUDENET:
+            self._require('nudenet')
+            futures = [self.nudenet_batcher.submit(image) for image in images]
+            return {'results': [future.result() for future in futures]}
+        if op == OP_CAPTION:
+            self._require('blip')
+            service = self.caption_service(params.get('generate_kwargs', {}))
+            futures = [service.batcher.submit(image) for image in images]
+            return {'results': [future.result() for future in futures]}
+        if op == OP_FACES:
+            self._require('faces')
+            return {'results': [[serialize_face(face) for face in self.face_analyzer.get(image)]
+                                for image in images]}
+        raise ValueError(f'Unknown op {op}')
+
+    def info(self) -> Dict:
+        stats = {'nudenet': self.nudenet_batcher.stats()} if 'nudenet' in self.models else {}
+        stats.update({f'blip:{key}': service.stats() for key, service in self._caption_services.items()})
+        return {
+            'pid': os.getpid(),
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'requests': self.requests,
+            'models': self.models,
+            'model_load_seconds': self.load_seconds,
+            'batching': stats
+        }
+
+
+class _SidecarRequestHandler(socketserver.BaseRequestHandler):
+    """Serves frames on one persistent client connection until it closes"""
+
+    def handle(self):
+        sidecar: InferenceSidecar = self.server.sidecar
+        sock = self.request
+        while True:
+            try:
+                header = _recv_exact(sock, REQUEST_HEADER.size)
+            except (ConnectionError, OSError):
+                return
+
+            magic, version, op, request_id, image_count, params_len = REQUEST_HEADER.unpack(header)
+            if magic != MAGIC or version != PROTOCOL_VERSION:
+                logger.warning(f"⚠️ Dropping client with bad frame header (magic={magic!r}, version={version})")
+                return
+
+            try:
+                params = json.loads(_recv_exact(sock, params_len)) if params_len else {}
+                images = _recv_images(sock, image_count)
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                body, status = sidecar.handle(op, params, images), STATUS_OK
+            except Exception as e:
+                logger.error(f"❌ Sidecar op {op} failed: {e}")
+                body, status = {'error': str(e)}, STATUS_ERROR
+
+            payload = json.dumps(body, separators=(',', ':')).encode('utf-8')
+            try:
+                sock.sendall(RESPONSE_HEADER.pack(MAGIC, PROTOCOL_VERSION, status, request_id, len(payload)) + payload)
+            except OSError:
+                return
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class SidecarError(RuntimeError):
+    """The sidecar answered with an error status"""
+
+
+class InferenceSidecarClient:
+    """Thread-safe client: one persistent Unix socket connection per calling thread"""
+
+    def __init__(self, socket_path: str, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.models = {}
+        self._local = threading.local()
+        self._request_ids = iter(range(1, 2 ** 32))
+        self._id_lock = threading.Lock()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, 'sock', None)
+        if sock is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def _drop_connection(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def call(self, op: int, images: Sequence[np.ndarray] = (), params: Optional[Dict] = None) -> Dict:
+        """Send one frame and wait for its response
+
+        Reconnects and resends once when the connection was stale (refused, reset
+        or closed before any response bytes arrived). A timeout or a response cut
+        off part-way is raised as is: the sidecar may still be working on it.
+        """
+        with self._id_lock:
+            request_id = next(self._request_ids)
+        params_bytes = json.dumps(params).encode('utf-8') if params else b''
+
+        for attempt in range(2):
+            response_started = False
+            try:
+                sock = self._connection()
+                sock.sendall(REQUEST_HEADER.pack(MAGIC, PROTOCOL_VERSION, op, request_id, len(images),
+                                                 len(params_bytes)) + params_bytes)
+                _send_images(sock, images)
+                magic, _, status, response_id, body_len = RESPONSE_HEADER.unpack(
+                    _recv_exact(sock, RESPONSE_HEADER.size))
+                response_started = True
+                body = json.loads(_recv_exact(sock, body_len))
+                break
+            except RETRYABLE_ERRORS:
+                # Nothing came back on a dead connection, so resending the request is safe
+                self._drop_connection()
+                if attempt or response_started:
+                    raise
+            except OSError:
+                # socket.timeout lands here too: never resend work the sidecar may still be running
+                self._drop_connection()
+                raise
+
+        if magic != MAGIC or response_id != request_id:
+            self._drop_connection()
+            raise SidecarError(f'Out-of-sync response from sidecar (request {request_id}, got {response_id})')
+        if status != STATUS_OK:
+            raise SidecarError(body.get('error', 'sidecar error'))
+        return body
+
+    def ping(self) -> bool:
+        self.call(OP_PING)
+        return True
+
+    def info(self) -> Dict:
+        info = self.call(OP_INFO)
+        self.models = info.get('models', {})
+        return info
+
+    def nudenet(self, images_rgb: Sequence[np.ndarray]) -> List[List[Dict]]:
+        return self.call(OP_NUDENET, images_rgb)['results']
+
+    def caption(self, images_rgb: Sequence[np.ndarray], generate_kwargs: Optional[Dict] = None) -> List[str]:
+        return self.call(OP_CAPTION, images_rgb, {'generate_kwargs': generate_kwargs or {}})['results']
+
+    def faces(self, images_rgb: Sequence[np.ndarray]) -> List[List[Dict]]:
+        return self.call(OP_FACES, images_rgb)['results']
+
+
+class SidecarNudeDetector:
+    """Stands in for NudeNetEngine / NudeDetector in a front end
+
+    bgr_input=True mirrors NudeDetector, which takes BGR arrays and reads paths
+    with cv2.imread; otherwise inputs follow NudeNetEngine (RGB arrays, paths and
+    bytes decoded with EXIF orientation applied).
+    """
+
+    def __init__(self, client: InferenceSidecarClient, bgr_input: bool = False):
+        self.client = client
+        self.bgr_input = bgr_input
+        self.model_version = client.models.get('nudenet', {}).get('model_version')
+
+    def _to_rgb(self, image) -> np.ndarray:
+        if self.bgr_input:
+            bgr = image if isinstance(image, np.ndarray) else cv2.imread(image)
+            if bgr is None:
+                raise ValueError(f'Could not read image: {image}')
+            return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        if isinstance(image, np.ndarray):
+            return image
+        return decode_image(image).rgb
+
+    def detect_batch(self, images) -> List[List[Dict]]:
+        return self.client.nudenet([self._to_rgb(image) for image in images])
+
+    def detect(self, image) -> List[Dict]:
+        return self.detect_batch([image])[0]
+
+
+class SidecarCaptionService:
+    """Stands in for blip_captioning.CaptionService; batching happens in the sidecar"""
+
+    def __init__(self, client: InferenceSidecarClient, generate_kwargs: Optional[Dict] = None):
+        self.client = client
+        self.generate_kwargs = dict(generate_kwargs or {})
+
+    def caption(self, image_rgb: np.ndarray) -> str:
+        return self.client.caption([image_rgb], self.generate_kwargs)[0]
+
+    def stats(self) -> Dict:
+        return {'sidecar': self.client.socket_path, 'generate_kwargs': self.generate_kwargs}
+
+
+class SidecarFaceAnalyzer:
+    """Stands in for insightface FaceAnalysis.get(); faces expose bbox, det_score, age and sex"""
+
+    def __init__(self, client: InferenceSidecarClient):
+        self.client = client
+
+    def get(self, image_rgb: np.ndarray) -> List[SimpleNamespace]:
+        faces = self.client.faces([image_rgb])[0]
+        return [SimpleNamespace(bbox=np.asarray(face['bbox'], dtype=np.float32), det_score=face['det_score'],
+                                age=face['age'], sex=face['sex'])
+                for face in faces]
+
+
+def sidecar_from_env() -> Optional[InferenceSidecarClient]:
+    """Client for INFERENCE_SIDECAR_SOCKET, or None to load models in-process"""
+    socket_path = os.getenv('INFERENCE_SIDECAR_SOCKET')
+    if not socket_path:
+        return None
+
+    client = InferenceSidecarClient(socket_path, timeout=float(os.getenv('INFERENCE_SIDECAR_TIMEOUT', '60')))
+    try:
+        info = client.info()
+    except (OSError, SidecarError) as e:
+        logger.warning(f"⚠️ Inference sidecar at {socket_path} unavailable ({e}); loading models in-process")
+        return None
+
+    logger.info(f"🔌 Using inference sidecar at {socket_path} (pid {info['pid']}, models: {', '.join(client.models)})")
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared inference sidecar for the moderation front ends')
+    parser.add_argument('--socket', default=os.getenv('INFERENCE_SIDECAR_SOCKET', '/tmp/moderation-inference.sock'))
+    parser.add_argument('--models', default=os.getenv('SIDECAR_MODELS', 'nudenet,blip,faces'),
+                        help='Comma-separated models to host: nudenet, blip, faces')
+    parser.add_argument('--mode', type=lambda value: int(value, 8), default=0o660,
+                        help='Socket file permissions (octal)')
+    args = parser.parse_args()
+
+    sidecar = InferenceSidecar([name.strip() for name in args.models.split(',') if name.strip()])
+    if not sidecar.models:
+        raise SystemExit('No models loaded')
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = _ThreadingUnixServer(args.socket, _SidecarRequestHandler)
+    server.sidecar = sidecar
+    os.chmod(args.socket, args.mode)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    logger.info(f"🚀 Inference sidecar listening on {args.socket} (models: {', '.join(sidecar.models)})")
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
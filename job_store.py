@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Durable asynchronous moderation jobs
+POST /jobs stores the upload in a local SQLite queue and returns a job id right
+away; JobRunner threads claim queued jobs, run the analysis and record the
+result for GET /jobs/<id>. Finished jobs with a callback_url are POSTed back in
+batches. Jobs survive restarts: a claimed job whose worker died (or whose
+lease expired) goes back to the queue, until it runs out of attempts. Callbacks are claimed the same way, so
+pre-forked workers sharing the store never POST the same job twice. Only
+http(s) URLs are accepted: to the hosts in JOB_CALLBACK_ALLOWED_HOSTS when it is
+set, otherwise to any host that resolves (checked again at delivery time) to
+public addresses only, so POST /jobs cannot reach loopback, link-local (cloud
+metadata) or private-network services.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import ipaddress
+import sqlite3
+import logging
+import threading
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'queued',
+    form TEXT NOT NULL,
+    image BLOB,
+    result TEXT,
+    http_status INTEGER,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    lease_expires_at REAL,
+    callback_url TEXT,
+    callback_state TEXT,
+    callback_attempts INTEGER NOT NULL DEFAULT 0,
+    next_callback_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_callbacks ON jobs (callback_state, next_callback_at);
+"""
+
+# Job states: queued -> running -> completed | failed
+QUEUED, RUNNING, COMPLETED, FAILED = 'queued', 'running', 'completed', 'failed'
+
+# Callback states: pending -> sending (claimed, leased) -> sent | pending (retry) | failed
+CALLBACK_PENDING, CALLBACK_SENDING = 'pending', 'sending'
+
+# Comma-separated hosts callbacks may go to; '.example.com' also matches subdomains; empty allows any public host
+CALLBACK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv('JOB_CALLBACK_ALLOWED_HOSTS', '').split(',')
+                          if host.strip()]
+
+
+def _public_address(address: str) -> bool:
+    """False for loopback, link-local, private, reserved and multicast addresses"""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_callback_url(url: str, allowed_hosts: Optional[List[str]] = None, resolve: bool = False) -> str:
+    """Return url if it is an http(s) URL to an allowed host, else raise ValueError
+
+    Without an allow-list the host must be public: IP literals and localhost are
+    checked here, and with resolve=True (at delivery) every address the name
+    resolves to must be public too.
+    """
+    allowed_hosts = CALLBACK_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('callback_url must be an http(s) URL')
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        if not any(host == allowed or (allowed.startswith('.') and host.endswith(allowed))
+                   for allowed in allowed_hosts):
+            raise ValueError(f'callback_url host {host} is not allowed')
+        return url
+
+    if host == 'localhost' or host.endswith('.localhost'):
+        raise ValueError(f'callback_url host {host} is not allowed')
+    try:
+        literal = _public_address(host)
+    except ValueError:
+        literal = None
+    if literal is False:
+        raise ValueError(f'callback_url host {host} is not a public address')
+    if resolve and literal is None:
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port, proto=socket.IPPROTO_TCP)}
+        except (socket.gaierror, UnicodeError) as e:
+            raise ValueError(f'callback_url host {host} does not resolve: {e}')
+        private = sorted(address for address in addresses if not _public_address(address))
+        if private:
+            raise ValueError(f'callback_url host {host} resolves to non-public address {private[0]}')
+    return url
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Callbacks are not followed across redirects (which could leave the allow-list)"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def worker_identity() -> str:
+    """host:pid of this process, recorded on claimed jobs"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """SQLite job queue shared by every worker process on the host (WAL mode)"""
+
+    def __init__(self, path: str, lease_seconds: float = 300.0, max_attempts: int = 3,
+                 max_callback_attempts: int = 8, callback_lease_seconds: float = 120.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_callback_attempts = max_callback_attempts
+        self.callback_lease_seconds = callback_lease_seconds
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Per-thread connection, reopened in forked children; the file is created on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def submit(self, image_bytes: bytes, form: Dict, callback_url: Optional[str] = None) -> str:
+        """Persist a new job and return its id (ValueError for a callback_url that is not allowed)"""
+        if callback_url:
+            validate_callback_url(callback_url)
+        job_id = uuid.uuid4().hex
+        self._connection().execute(
+            'INSERT INTO jobs (id, form, image, callback_url, callback_state, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, json.dumps(form), sqlite3.Binary(image_bytes), callback_url,
+             CALLBACK_PENDING if callback_url else None, time.time()))
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Tuple[str, bytes, Dict]]:
+        """Atomically move the oldest queued job to running; returns (id, image, form)"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, image, form FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, claimed_by = ?, lease_expires_at = ?, '
+                'started_at = ? WHERE id = ?',
+                (RUNNING, worker, now + self.lease_seconds, now, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return row['id'], bytes(row['image']), json.loads(row['form'])
+
+    def complete(self, job_id: str, result: Dict, http_status: int):
+        """Record a finished analysis; the image is dropped once it is no longer needed"""
+        status = COMPLETED if http_status < 400 and result.get('success', True) else FAILED
+        self._connection().execute(
+            'UPDATE jobs SET status = ?, result = ?, http_status = ?, image = NULL, finished_at = ?, '
+            'lease_expires_at = NULL, next_callback_at = ? WHERE id = ?',
+            (status, json.dumps(result, default=str), http_status, time.time(), time.time(), job_id))
+
+    def fail(self, job_id: str, error: str):
+        """Requeue a job whose analysis raised, until it runs out of attempts"""
+        conn = self._connection()
+        row = conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is not None and row['attempts'] < self.max_attempts:
+            conn.execute('UPDATE jobs SET status = ?, error = ?, claimed_by = NULL, lease_expires_at = NULL '
+                         'WHERE id = ?', (QUEUED, error, job_id))
+            return
+        conn.execute(
+            'UPDATE jobs SET status = ?, error = ?, image = NULL, finished_at = ?, lease_expires_at = NULL, '
+            'next_callback_at = ? WHERE id = ?', (FAILED, error, time.time(), time.time(), job_id))
+
+    def requeue_stale(self) -> int:
+        """Return running jobs to the queue when their lease expired or their worker on this host is gone
+
+        A job that keeps taking its worker down (a crash or OOM kill mid-analysis)
+        is failed once it has used up max_attempts instead of being claimed forever.
+        """
+        conn = self._connection()
+        host = socket.gethostname()
+        stale = []
+        for row in conn.execute('SELECT id, attempts, claimed_by, lease_expires_at FROM jobs WHERE status = ?',
+                                (RUNNING,)):
+            claimed_host, _, pid = (row['claimed_by'] or '').rpartition(':')
+            expired = row['lease_expires_at'] is not None and row['lease_expires_at'] < time.time()
+            orphaned = claimed_host == host and pid.isdigit() and not _process_alive(int(pid))
+            if expired or orphaned:
+                stale.append((row['id'], row['attempts']))
+
+        requeued = failed = 0
+        for job_id, attempts in stale:
+            if attempts < self.max_attempts:
+                conn.execute('UPDATE jobs SET status = ?, claimed_by = NULL, lease_expires_at = NULL '
+                             'WHERE id = ? AND status = ?', (QUEUED, job_id, RUNNING))
+                requeued += 1
+                continue
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, image = NULL, finished_at = ?, claimed_by = NULL, '
+                'lease_expires_at = NULL, next_callback_at = ? WHERE id = ? AND status = ?',
+                (FAILED, f'worker died ({attempts} attempts)', time.time(), time.time(), job_id, RUNNING))
+            failed += 1
+        if requeued:
+            logger.warning(f"♻️ Requeued {requeued} interrupted job(s)")
+        if failed:
+            logger.error(f"❌ Failed {failed} job(s) whose worker died {self.max_attempts} times")
+        return len(stale)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Public view of a job (no image bytes)"""
+        row = self._connection().execute(
+            'SELECT id, status, result, http_status, error, attempts, callback_url, callback_state, '
+            'created_at, started_at, finished_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row['id'],
+            'status': row['status'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'http_status': row['http_status'],
+            'error': row['error'],
+            'attempts': row['attempts'],
+            'callback_url': row['callback_url'],
+            'callback_state': row['callback_state'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at']
+        }
+
+    def claim_callbacks(self, limit: int = 500) -> Dict[str, List[Dict]]:
+        """Atomically claim finished jobs awaiting delivery, grouped by callback URL
+
+        Claimed rows move to 'sending' with a lease in next_callback_at; a process
+        that dies mid-delivery leaves them to be claimed again once it expires.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = [row['id'] for row in conn.execute(
+                'SELECT id FROM jobs WHERE callback_state IN (?, ?) AND status IN (?, ?) AND next_callback_at <= ? '
+                'ORDER BY finished_at LIMIT ?',
+                (CALLBACK_PENDING, CALLBACK_SENDING, COMPLETED, FAILED, now, limit)).fetchall()]
+            conn.executemany('UPDATE jobs SET callback_state = ?, next_callback_at = ? WHERE id = ?',
+                             [(CALLBACK_SENDING, now + self.callback_lease_seconds, job_id) for job_id in ids])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        batches = defaultdict(list)
+        for job_id in ids:
+            job = self.get(job_id)
+            batches[job['callback_url']].append(job)
+        return batches
+
+    def mark_callbacks(self, job_ids: List[str], delivered: bool):
+        """Record a delivery attempt on claimed rows; failures back off exponentially, then give up"""
+        conn = self._connection()
+        for job_id in job_ids:
+            if delivered:
+                conn.execute("UPDATE jobs SET callback_state = 'sent', callback_attempts = callback_attempts + 1 "
+                             "WHERE id = ? AND callback_state = ?", (job_id, CALLBACK_SENDING))
+                continue
+            row = conn.execute('SELECT callback_attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            attempts = (row['callback_attempts'] if row else 0) + 1
+            state = 'failed' if attempts >= self.max_callback_attempts else CALLBACK_PENDING
+            conn.execute('UPDATE jobs SET callback_state = ?, callback_attempts = ?, next_callback_at = ? '
+                         'WHERE id = ? AND callback_state = ?',
+                         (state, attempts, time.time() + min(300, 2 ** attempts), job_id, CALLBACK_SENDING))
+
+    def stats(self) -> Dict:
+        rows = self._connection().execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, COMPLETED: 0, FAILED: 0}
+        counts.update({row['status']: row['n'] for row in rows})
+        pending = self._connection().execute(
+            'SELECT COUNT(*) FROM jobs WHERE callback_state IN (?, ?)',
+            (CALLBACK_PENDING, CALLBACK_SENDING)).fetchone()[0]
+        return {'path': self.path, 'jobs': counts, 'pending_callbacks': pending}
+
+
+class JobRunner:
+    """Worker threads draining a JobStore through handler(image_bytes, form) -> (result, http_status)"""
+
+    def __init__(self, store: JobStore, handler: Callable[[bytes, Dict], Tuple[Dict, int]], workers: int = 2,
+                 poll_interval: float = 1.0, callback_batch_size: int = 50, callback_interval: float = 1.0,
+                 callback_timeout: float = 10.0):
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.callback_batch_size = callback_batch_size
+        self.callback_interval = callback_interval
+        self.callback_timeout = callback_timeout
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self.processed = 0
+        self.failed = 0
+        self.callbacks_sent = 0
+
+    @property
+    def started(self) -> bool:
+        """True once worker threads run in this process (False again in a forked child)"""
+        return self._pid == os.getpid()
+
+    def ensure_started(self):
+        """Start worker and callback threads lazily (and again in a forked child)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wakeup = threading.Event()
+            self.store.requeue_stale()
+            for index in range(self.workers):
+                threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True).start()
+            threading.Thread(target=self._deliver_callbacks, name='job-callbacks', daemon=True).start()
+            logger.info(f"🗂️ Job runner started ({self.workers} workers, store {self.store.path})")
+
+    def submit(self, image_bytes: bytes, form: Dict, callback_url: Optional[str] = None) -> str:
+        self.ensure_started()
+        job_id = self.store.submit(image_bytes, form, callback_url)
+        self._wakeup.set()
+        return job_id
+
+    def _work(self):
+        worker = worker_identity()
+        idle_polls = 0
+        while True:
+            try:
+                claimed = self.store.claim(worker)
+            except sqlite3.Error as e:
+                logger.error(f"❌ Job claim failed: {e}")
+                claimed = None
+
+            if claimed is None:
+                # Other processes may have died holding jobs; check now and then
+                idle_polls += 1
+                if idle_polls % 60 == 0:
+                    self.store.requeue_stale()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            idle_polls = 0
+            job_id, image_bytes, form = claimed
+            try:
+                result, http_status = self.handler(image_bytes, form)
+                self.store.complete(job_id, result, http_status)
+                self.processed += 1
+            except Exception as e:
+                logger.error(f"❌ Job {job_id} failed: {e}")
+                self.store.fail(job_id, str(e))
+                self.failed += 1
+
+    def _deliver_callbacks(self):
+        while True:
+            time.sleep(self.callback_interval)
+            try:
+                batches = self.store.claim_callbacks()
+            except sqlite3.Error as e:
+                logger.error(f"❌ Callback scan failed: {e}")
+                continue
+
+            for url, jobs in batches.items():
+                for start in range(0, len(jobs), self.callback_batch_size):
+                    batch = jobs[start:start + self.callback_batch_size]
+                    delivered = self._post(url, batch)
+                    self.store.mark_callbacks([job['job_id'] for job in batch], delivered)
+                    if delivered:
+                        self.callbacks_sent += len(batch)
+
+    def _post(self, url: str, jobs: List[Dict]) -> bool:
+        try:
+            # Checked again: the allow-list or the host's DNS may have changed since the job was queued
+            validate_callback_url(url, resolve=True)
+        except ValueError as e:
+            logger.warning(f"⚠️ Not delivering callback to {url}: {e}")
+            return False
+        body = json.dumps({'jobs': jobs}, default=str).encode('utf-8')
+        request = urllib.request.Request(url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with _callback_opener.open(request, timeout=self.callback_timeout) as response:
+                return 200 <= response.status < 300
+        except Exception as e:
+            logger.warning(f"⚠️ Callback to {url} failed ({len(jobs)} jobs): {e}")
+            return False
+
+    def stats(self) -> Dict:
+        stats = self.store.stats()
+        stats.update({
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': self.failed,
+            'callbacks_sent': self.callbacks_sent
+        })
+        return stats
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Shared image decoding for the moderation pipelines
+Decodes an upload once into an EXIF-transposed RGB buffer that every stage consumes
+"""
+
+import io
+import os
+from dataclasses import dataclass
+from typing import BinaryIO, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+ImageSource = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+
+@dataclass
+class DecodedImage:
+    """A decoded upload: HxWx3 uint8 RGB pixels with EXIF orientation applied
+
+    The pixel buffer is read-only so stages can share it safely.
+    """
+    rgb: np.ndarray
+    width: int
+    height: int
+    format: str
+    exif_orientation: int
+
+    @property
+    def bgr(self) -> np.ndarray:
+        """BGR copy for consumers that follow the OpenCV channel order"""
+        return np.ascontiguousarray(self.rgb[:, :, ::-1])
+
+
+def describe_image_source(source: ImageSource) -> str:
+    """Short label for logs: the file name of a path, the size of in-memory data"""
+    if isinstance(source, str):
+        return os.path.basename(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f'<{len(source)} byte upload>'
+    return getattr(source, 'name', '<stream>')
+
+
+def decode_image(source: ImageSource) -> DecodedImage:
+    """Decode a path, raw bytes or file object into a DecodedImage
+
+    The EXIF orientation is applied in memory (no re-encode, no temp file) so
+    NudeNet, InsightFace, MediaPipe and BLIP all see the upright image.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with Image.open(source) as img:
+        image_format = img.format or 'UNKNOWN'
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+
+        img.load()
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        rgb = np.asarray(img)
+
+    height, width = rgb.shape[:2]
+    return DecodedImage(
+        rgb=rgb,
+        width=width,
+        height=height,
+        format=image_format,
+        exif_orientation=orientation
+    )
@@ -2,19 +2,52 @@
 """
 Simple command-line NudeNet processor for phoenix4ge
 Usage: python3 nudenet-cli.py --image /path/to/image.jpg --context_type public_gallery
+
+Batch mode (one JSON line per image, streamed as results finish):
+    python3 nudenet-cli.py --images a.jpg b.jpg c.jpg
+    python3 nudenet-cli.py --dir public/uploads/some-model --workers 8
+    python3 nudenet-cli.py --manifest rescan.jsonl
+
+Worker mode (detector loaded once, JSON-lines in / JSON-lines out):
+    python3 nudenet-cli.py --serve
+    python3 nudenet-cli.py --serve --socket /tmp/nudenet.sock
+
+Each request line is {"id": ..., "image": "/path/to/image.jpg", "context_type": "..."};
+each response line is the single-image result object plus the echoed "id".
 """
 
 import argparse
 import json
+import os
+import socketserver
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from nudenet import NudeDetector
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif')
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def get_detector():
+    """Load the NudeNet detector once per process"""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                from nudenet import NudeDetector
+                _detector = NudeDetector()
+    return _detector
 
 def analyze_image(image_path, context_type='public_gallery'):
-    """Analyze image with NudeNet and return JSON result"""
+    """Analyze image with NudeNet and return JSON result
+
+    image_path may also be an already decoded BGR ndarray (batch mode).
+    """
     try:
-        # Initialize NudeNet detector
-        detector = NudeDetector()
+        # Reuse the process-wide NudeNet detector
+        detector = get_detector()
         
         # Analyze the image
         detections = detector.detect(image_path)
@@ -89,13 +122,213 @@ def analyze_image(image_path, context_type='public_gallery'):
             'processing_method': 'local_nudenet_cli'
         }
 
+def handle_request_line(line):
+    """Process one JSON-lines request and return the response object"""
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return {
+            'success': False,
+            'error': f'Invalid request JSON: {e}',
+            'processing_method': 'local_nudenet_cli'
+        }
+
+    request_id = request.get('id')
+    image_path = request.get('image')
+    context_type = request.get('context_type', 'public_gallery')
+
+    if not image_path or not Path(image_path).exists():
+        result = {
+            'success': False,
+            'error': f'Image file not found: {image_path}',
+            'processing_method': 'local_nudenet_cli'
+        }
+    else:
+        result = analyze_image(image_path, context_type)
+
+    result['id'] = request_id
+    return result
+
+def serve_stdin():
+    """Read JSON-lines requests from stdin and stream results to stdout"""
+    get_detector()
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        sys.stdout.write(json.dumps(handle_request_line(line)) + '\n')
+        sys.stdout.flush()
+
+class _JsonLinesHandler(socketserver.StreamRequestHandler):
+    """One connection = a stream of JSON-lines requests"""
+
+    def handle(self):
+        for raw_line in self.rfile:
+            line = raw_line.decode('utf-8').strip()
+            if not line:
+                continue
+            response = json.dumps(handle_request_line(line)) + '\n'
+            self.wfile.write(response.encode('utf-8'))
+            self.wfile.flush()
+
+def serve_socket(socket_path):
+    """Serve JSON-lines requests on a Unix domain socket"""
+    get_detector()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _JsonLinesHandler)
+    server.daemon_threads = True
+    print(f'NudeNet worker listening on {socket_path}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+
+def collect_batch_items(args):
+    """Build the (id, image_path, context_type) work list from --images/--dir/--manifest
+
+    Returns (items, rejected): manifest lines that are not JSON objects become
+    failed results with id 'line_N' instead of aborting the batch.
+    """
+    items = []
+    rejected = []
+
+    for image_path in args.images or []:
+        items.append((image_path, image_path, args.context_type))
+
+    if args.dir:
+        for path in sorted(Path(args.dir).rglob(args.pattern)):
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
+                items.append((str(path), str(path), args.context_type))
+
+    if args.manifest:
+        with open(args.manifest) as manifest:
+            for line_number, line in enumerate(manifest, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                    if not isinstance(entry, dict):
+                        raise ValueError('manifest entry must be a JSON object')
+                except ValueError as e:
+                    rejected.append({
+                        'success': False,
+                        'id': f'line_{line_number}',
+                        'error': f'Invalid manifest line: {e}',
+                        'processing_method': 'local_nudenet_cli'
+                    })
+                    continue
+                image_path = entry.get('image') or entry.get('image_path')
+                items.append((
+                    entry.get('id', image_path or f'line_{line_number}'),
+                    image_path,
+                    entry.get('context_type', args.context_type)
+                ))
+
+    return items, rejected
+
+def decode_image(image_path):
+    """Decode an image file to a BGR ndarray (runs in the decode thread pool)"""
+    import cv2
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f'Could not decode image: {image_path}')
+    return image
+
+def iter_decoded(items, workers):
+    """Decode images in parallel, yielding (item, image, error) as each decode finishes
+
+    At most workers * 2 decoded images are held in memory at once.
+    """
+    max_in_flight = max(1, workers) * 2
+    pending = {}
+    item_iter = iter(items)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            while len(pending) < max_in_flight:
+                item = next(item_iter, None)
+                if item is None:
+                    break
+                pending[pool.submit(decode_image, item[1])] = item
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    yield item, None, e
+
+def run_batch(items, workers, rejected=()):
+    """Analyze every item and stream one JSON line per image; returns failure count"""
+    for result in rejected:
+        sys.stdout.write(json.dumps(result) + '\n')
+    sys.stdout.flush()
+
+    get_detector()
+    failures = len(rejected)
+
+    for (item_id, image_path, context_type), image, error in iter_decoded(items, workers):
+        if error is not None:
+            result = {
+                'success': False,
+                'error': str(error),
+                'processing_method': 'local_nudenet_cli'
+            }
+        else:
+            result = analyze_image(image, context_type)
+
+        result['id'] = item_id
+        result['image'] = image_path
+        if not result['success']:
+            failures += 1
+
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush()
+
+    return failures
+
 def main():
     parser = argparse.ArgumentParser(description='Analyze image with NudeNet')
-    parser.add_argument('--image', required=True, help='Path to image file')
+    parser.add_argument('--image', help='Path to image file')
     parser.add_argument('--context_type', default='public_gallery', help='Context type for analysis')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a long-lived worker reading JSON-lines requests')
+    parser.add_argument('--socket', help='Unix socket path for --serve (default: stdin/stdout)')
+    parser.add_argument('--images', nargs='+', help='Analyze several image files')
+    parser.add_argument('--dir', help='Analyze every image under this directory (recursive)')
+    parser.add_argument('--pattern', default='*', help='Glob pattern used with --dir')
+    parser.add_argument('--manifest', help='JSON-lines file of {"id", "image", "context_type"} entries')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4,
+                        help='Parallel image decode threads for batch modes')
     
     args = parser.parse_args()
     
+    if args.serve:
+        if args.socket:
+            serve_socket(args.socket)
+        else:
+            serve_stdin()
+        return
+    
+    if args.images or args.dir or args.manifest:
+        items, rejected = collect_batch_items(args)
+        failures = run_batch(items, args.workers, rejected)
+        sys.exit(0 if failures == 0 else 1)
+    
+    if not args.image:
+        parser.error('one of --image, --images, --dir, --manifest or --serve is required')
+    
     # Check if image file exists
     if not Path(args.image).exists():
         result = {
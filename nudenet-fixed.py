@@ -9,7 +9,6 @@ import json
 import time
 import logging
 import base64
-import tempfile
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass, asdict
 
@@ -18,6 +17,10 @@ from flask_cors import CORS
 from nudenet import NudeDetector
 from PIL import Image
 import requests
+import numpy as np
+
+from upload_buffer import (SHARED_UPLOAD_ROOT, decode_upload_bgr, is_raw_image, listen_address,
+                           read_raw_image, request_params, resolve_shared_path)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -81,8 +84,8 @@ class FixedContentModerator:
         
         self.setup_routes()
     
-    def analyze_nudity(self, image_path: str) -> Tuple[float, Dict[str, float]]:
-        """Analyze nudity using NudeNet"""
+    def analyze_nudity(self, image_path: str, image: Optional[np.ndarray] = None) -> Tuple[float, Dict[str, float]]:
+        """Analyze nudity using NudeNet (image: decoded BGR array to use instead of reading image_path)"""
         try:
             if not self.nude_detector:
                 logger.warning("NudeNet model not loaded, using fallback")
@@ -91,7 +94,7 @@ class FixedContentModerator:
             logger.info(f"Analyzing image: {image_path}")
             
             # Detect nudity
-            detections = self.nude_detector.detect(image_path)
+            detections = self.nude_detector.detect(image if image is not None else image_path)
             logger.info(f"NudeNet detections: {detections}")
             
             # Calculate overall nudity score and part-specific scores
@@ -238,49 +241,53 @@ class FixedContentModerator:
         @self.app.route('/analyze', methods=['POST'])
         def analyze_image():
             try:
-                data = request.json
+                # Raw octet-stream bodies carry parameters in the query string or X-Moderation-* headers
+                data = request_params(request) if is_raw_image(request) else request.get_json(silent=True)
+                if not isinstance(data, dict):
+                    return jsonify({'error': 'Request body must be a JSON object'}), 400
                 context_type = data.get('context_type', 'public_gallery')
-                model_id = data.get('model_id', 0)
+                try:
+                    model_id = int(data.get('model_id', 0))
+                except (TypeError, ValueError):
+                    return jsonify({'error': 'model_id must be an integer'}), 400
                 
-                # Handle different input methods
+                # Handle different input methods (raw, base64 and URL payloads are decoded in memory)
                 image_path = None
-                temp_file = None
+                image = None
                 
-                if 'image_path' in data:
-                    # Direct file path
-                    image_path = data['image_path']
+                if is_raw_image(request):
+                    # Raw image bytes as the request body (no base64 inflation)
+                    try:
+                        image = decode_upload_bgr(read_raw_image(request))
+                        image_path = data.get('filename', 'image_body')
+                    except ValueError as e:
+                        return jsonify({'error': f'Invalid image data: {e}'}), 400
+                elif 'image_path' in data:
+                    # Direct file path, read by NudeNet in place; confined to the shared root when one is set
+                    try:
+                        image_path = resolve_shared_path(data['image_path']) if SHARED_UPLOAD_ROOT else data['image_path']
+                    except (PermissionError, FileNotFoundError) as e:
+                        return jsonify({'error': str(e)}), 400
                 elif 'image_data' in data:
                     # Base64 encoded image
                     try:
-                        image_data = base64.b64decode(data['image_data'])
-                        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-                        temp_file.write(image_data)
-                        temp_file.close()
-                        image_path = temp_file.name
+                        image = decode_upload_bgr(base64.b64decode(data['image_data']))
+                        image_path = 'image_data'
                     except Exception as e:
                         return jsonify({'error': f'Invalid image data: {e}'}), 400
                 elif 'image_url' in data:
                     # Download from URL
                     try:
                         response = requests.get(data['image_url'], timeout=10)
-                        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-                        temp_file.write(response.content)
-                        temp_file.close()
-                        image_path = temp_file.name
+                        image = decode_upload_bgr(response.content)
+                        image_path = data['image_url']
                     except Exception as e:
                         return jsonify({'error': f'Failed to download image: {e}'}), 400
                 else:
                     return jsonify({'error': 'No image provided (need image_path, image_data, or image_url)'}), 400
                 
                 # Perform analysis
-                result = self.moderate_image(image_path, context_type, model_id)
-                
-                # Clean up temp file if created
-                if temp_file and os.path.exists(temp_file.name):
-                    try:
-                        os.unlink(temp_file.name)
-                    except:
-                        pass
+                result = self.moderate_image(image_path, context_type, model_id, image=image)
                 
                 if result:
                     return jsonify({
@@ -306,17 +313,12 @@ class FixedContentModerator:
                 if not image_url:
                     return jsonify({'error': 'image_url required'}), 400
                 
-                # Download image
+                # Download and decode in memory
                 response = requests.get(image_url, timeout=30)
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-                temp_file.write(response.content)
-                temp_file.close()
+                image = decode_upload_bgr(response.content)
                 
                 # Analyze
-                result = self.moderate_image(temp_file.name, context_type, model_id)
-                
-                # Cleanup
-                os.unlink(temp_file.name)
+                result = self.moderate_image(image_url, context_type, model_id, image=image)
                 
                 if result:
                     return jsonify({
@@ -353,13 +355,14 @@ class FixedContentModerator:
                 'model_loaded': True
             })
     
-    def moderate_image(self, image_path: str, context_type: str, model_id: int) -> Optional[ModerationResult]:
-        """Main moderation function"""
+    def moderate_image(self, image_path: str, context_type: str, model_id: int,
+                       image: Optional[np.ndarray] = None) -> Optional[ModerationResult]:
+        """Main moderation function (image: in-memory BGR array; image_path is then just its label)"""
         try:
             logger.info(f"Analyzing image: {image_path} for context: {context_type}")
             
             # 1. Real Nudity Analysis with NudeNet
-            nudity_score, detected_parts = self.analyze_nudity(image_path)
+            nudity_score, detected_parts = self.analyze_nudity(image_path, image)
             
             # 2. Enhanced Pose Analysis based on detection
             pose_class, explicit_pose_score = self.analyze_pose(nudity_score, detected_parts)
@@ -400,6 +403,7 @@ class FixedContentModerator:
     
     def run(self, host='0.0.0.0', port=5001, debug=False):
         """Run the Flask application"""
+        host, port = listen_address(host, port)
         logger.info(f"Starting Fixed AI Content Moderation Service on {host}:{port}")
         self.app.run(host=host, port=port, debug=debug)
 
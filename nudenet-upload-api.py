@@ -8,7 +8,6 @@ import os
 import json
 import time
 import logging
-import tempfile
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 
@@ -17,6 +16,10 @@ from flask_cors import CORS
 from nudenet import NudeDetector
 from PIL import Image
 import werkzeug
+import numpy as np
+
+from upload_buffer import BufferedUploadRequest, decode_upload_bgr, listen_address, request_image
+from inference_sidecar import SidecarNudeDetector, sidecar_from_env
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -45,19 +48,22 @@ class NudeNetUploadAPI:
         self.app = Flask(__name__)
         CORS(self.app)
         
-        # Configure upload settings
+        # Configure upload settings (uploads are analysed from memory, never written to disk)
         self.app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
-        self.upload_folder = '/tmp/nudenet_uploads'
-        os.makedirs(self.upload_folder, exist_ok=True)
+        self.app.request_class = BufferedUploadRequest
         
-        # Initialize NudeNet detector
-        try:
-            logger.info("Loading NudeNet model...")
-            self.nude_detector = NudeDetector()
-            logger.info("NudeNet model loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load NudeNet model: {e}")
-            self.nude_detector = None
+        # Initialize NudeNet detector (or use the shared inference sidecar when INFERENCE_SIDECAR_SOCKET is set)
+        self.sidecar = sidecar_from_env()
+        if self.sidecar and 'nudenet' in self.sidecar.models:
+            self.nude_detector = SidecarNudeDetector(self.sidecar, bgr_input=True)
+        else:
+            try:
+                logger.info("Loading NudeNet model...")
+                self.nude_detector = NudeDetector()
+                logger.info("NudeNet model loaded successfully")
+            except Exception as e:
+                logger.error(f"Failed to load NudeNet model: {e}")
+                self.nude_detector = None
         
         # Moderation rules
         self.moderation_rules = {
@@ -69,8 +75,8 @@ class NudeNetUploadAPI:
         
         self.setup_routes()
     
-    def analyze_nudity(self, image_path: str) -> Tuple[float, Dict[str, float]]:
-        """Analyze nudity using NudeNet"""
+    def analyze_nudity(self, image_path: str, image: Optional[np.ndarray] = None) -> Tuple[float, Dict[str, float]]:
+        """Analyze nudity using NudeNet (image: decoded BGR array to use instead of reading image_path)"""
         try:
             if not self.nude_detector:
                 logger.warning("NudeNet model not loaded")
@@ -79,7 +85,7 @@ class NudeNetUploadAPI:
             logger.info(f"Analyzing image: {image_path}")
             
             # Detect nudity
-            detections = self.nude_detector.detect(image_path)
+            detections = self.nude_detector.detect(image if image is not None else image_path)
             logger.info(f"NudeNet detections: {detections}")
             
             # Calculate scores and locations
@@ -188,46 +194,45 @@ class NudeNetUploadAPI:
                 'status': 'healthy',
                 'version': 'nudenet-upload-api',
                 'models_loaded': self.nude_detector is not None,
-                'upload_enabled': True
+                'upload_enabled': True,
+                'inference_sidecar': self.sidecar.socket_path if self.sidecar else None
             })
         
         @self.app.route('/upload', methods=['POST'])
         def upload_and_analyze():
-            """Upload file and analyze with NudeNet"""
+            """Upload file and analyze with NudeNet (multipart 'file', raw octet-stream body or shared image_path)"""
             try:
-                # Check if file was uploaded
-                if 'file' not in request.files:
+                try:
+                    image_bytes, params = request_image(request, field='file')
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                except (PermissionError, FileNotFoundError) as e:
+                    return jsonify({'error': str(e)}), 400
+                if image_bytes is None:
                     return jsonify({'error': 'No file uploaded'}), 400
                 
-                file = request.files['file']
-                if file.filename == '':
-                    return jsonify({'error': 'No file selected'}), 400
-                
                 # Get parameters
-                context_type = request.form.get('context_type', 'public_gallery')
-                model_id = int(request.form.get('model_id', 1))
+                context_type = params.get('context_type', 'public_gallery')
+                model_id = int(params.get('model_id', 1))
                 
-                # Validate file type
-                if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+                # Validate file type (raw bodies name themselves via ?filename= or X-Moderation-Filename)
+                if 'file' in request.files:
+                    original_name = request.files['file'].filename
+                else:
+                    original_name = params.get('filename') or os.path.basename(params.get('image_path', '')) or 'upload.jpg'
+                if not original_name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
                     return jsonify({'error': 'Invalid file type. Use PNG, JPG, JPEG, GIF, or BMP'}), 400
                 
-                # Save uploaded file
-                filename = werkzeug.utils.secure_filename(file.filename)
-                timestamp = int(time.time() * 1000)
-                safe_filename = f"{timestamp}_{filename}"
-                filepath = os.path.join(self.upload_folder, safe_filename)
-                
-                file.save(filepath)
-                logger.info(f"File saved: {filepath}")
+                # Decode straight from the in-memory request buffer
+                filename = werkzeug.utils.secure_filename(original_name)
+                try:
+                    image = decode_upload_bgr(image_bytes)
+                except ValueError as e:
+                    return jsonify({'error': f'Invalid image: {e}'}), 400
+                logger.info(f"File received: {filename}")
                 
                 # Analyze with NudeNet
-                result = self.moderate_image(filepath, context_type, model_id)
-                
-                # Clean up uploaded file
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
+                result = self.moderate_image(filename, context_type, model_id, image=image)
                 
                 if result:
                     # Convert result object to dict
@@ -301,13 +306,14 @@ class NudeNetUploadAPI:
                 logger.error(f"Analysis error: {e}")
                 return jsonify({'error': str(e)}), 500
     
-    def moderate_image(self, image_path: str, context_type: str, model_id: int) -> Optional[ModerationResult]:
-        """Main moderation function"""
+    def moderate_image(self, image_path: str, context_type: str, model_id: int,
+                       image: Optional[np.ndarray] = None) -> Optional[ModerationResult]:
+        """Main moderation function (image: in-memory BGR array; image_path is then just its label)"""
         try:
             logger.info(f"Analyzing: {image_path} for context: {context_type}")
             
             # 1. Real Nudity Analysis
-            nudity_score, detected_parts, part_locations = self.analyze_nudity(image_path)
+            nudity_score, detected_parts, part_locations = self.analyze_nudity(image_path, image)
             
             # 2. Generate detailed pose analysis
             pose_class, explicit_score, caption = self.analyze_pose_details(detected_parts, nudity_score)
@@ -355,6 +361,7 @@ class NudeNetUploadAPI:
     
     def run(self, host='0.0.0.0', port=5001, debug=False):
         """Run the Flask application"""
+        host, port = listen_address(host, port)
         logger.info(f"Starting NudeNet Upload API on {host}:{port}")
         self.app.run(host=host, port=port, debug=debug)
 
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+NudeNet inference engine - ndarray and batch inference on the NudeNet ONNX model
+Drop-in for NudeDetector.detect() that skips the file round trip and runs
+several images per onnxruntime call
+"""
+
+import os
+import hashlib
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+import onnxruntime
+
+from moderation_image import DecodedImage, decode_image
+
+logger = logging.getLogger(__name__)
+
+# Class order of the NudeNet 3.x 320n detector head
+NUDENET_LABELS = [
+    'FEMALE_GENITALIA_COVERED',
+    'FACE_FEMALE',
+    'BUTTOCKS_EXPOSED',
+    'FEMALE_BREAST_EXPOSED',
+    'FEMALE_GENITALIA_EXPOSED',
+    'MALE_BREAST_EXPOSED',
+    'ANUS_EXPOSED',
+    'FEET_EXPOSED',
+    'BELLY_COVERED',
+    'FEET_COVERED',
+    'ARMPITS_COVERED',
+    'ARMPITS_EXPOSED',
+    'FACE_MALE',
+    'BELLY_EXPOSED',
+    'MALE_GENITALIA_EXPOSED',
+    'ANUS_COVERED',
+    'FEMALE_BREAST_COVERED',
+    'BUTTOCKS_COVERED',
+]
+
+# Same thresholds NudeDetector uses
+CANDIDATE_SCORE_THRESHOLD = 0.2
+NMS_SCORE_THRESHOLD = 0.25
+NMS_IOU_THRESHOLD = 0.45
+
+EngineInput = Union[np.ndarray, DecodedImage, str, bytes]
+
+
+def default_model_path() -> str:
+    """Location of the ONNX model shipped with the nudenet package"""
+    import nudenet
+    return os.path.join(os.path.dirname(nudenet.__file__), '320n.onnx')
+
+
+def model_fingerprint(model_path: str) -> str:
+    """Short content hash of a model file, used to version cached results"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"{os.path.basename(model_path)}:{digest.hexdigest()[:12]}"
+
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray,
+                        score_threshold: float = NMS_SCORE_THRESHOLD,
+                        iou_threshold: float = NMS_IOU_THRESHOLD) -> np.ndarray:
+    """Greedy class-agnostic NMS over [x, y, w, h] boxes (matches cv2.dnn.NMSBoxes)"""
+    candidates = np.flatnonzero(scores > score_threshold)
+    if candidates.size == 0:
+        return candidates
+
+    order = candidates[np.argsort(-scores[candidates], kind='stable')]
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = x1 + boxes[:, 2]
+    y2 = y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    keep = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+
+        inter_w = np.maximum(0.0, np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]))
+        inter_h = np.maximum(0.0, np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]))
+        intersection = inter_w * inter_h
+        union = areas[best] + areas[rest] - intersection
+        iou = np.where(union > 0, intersection / np.maximum(union, 1e-12), 0.0)
+
+        order = rest[iou <= iou_threshold]
+
+    return np.asarray(keep, dtype=np.int64)
+
+
+class NudeNetEngine:
+    """Owns the NudeNet onnxruntime session and runs ndarray/batch inference"""
+
+    def __init__(self, model_path: Optional[str] = None, providers: Optional[List[str]] = None,
+                 inference_resolution: int = 320, max_batch_size: int = 16,
+                 intra_op_threads: Optional[int] = None):
+        session_options = onnxruntime.SessionOptions()
+        # INFERENCE_THREADS is set per worker by prefork_server.py
+        intra_op_threads = intra_op_threads or int(os.getenv('INFERENCE_THREADS', '0')) or None
+        if intra_op_threads:
+            session_options.intra_op_num_threads = intra_op_threads
+
+        self.model_path = model_path or default_model_path()
+        self.onnx_session = onnxruntime.InferenceSession(
+            self.model_path,
+            sess_options=session_options,
+            providers=providers or ['CPUExecutionProvider']
+        )
+
+        self.model_version = model_fingerprint(self.model_path)
+
+        model_input = self.onnx_session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_size = inference_resolution
+
+        # Exported models with a fixed batch dimension can only run one image per call
+        batch_dim = model_input.shape[0]
+        self.supports_batching = not isinstance(batch_dim, int) or batch_dim > 1
+        self.max_batch_size = max_batch_size if self.supports_batching else 1
+
+        logger.info(f"NudeNet engine ready: {os.path.basename(self.model_path)}, "
+                    f"{self.input_size}px, max batch {self.max_batch_size}")
+
+    def _to_rgb(self, image: EngineInput) -> np.ndarray:
+        """Accept RGB arrays, DecodedImage, paths or encoded bytes"""
+        if isinstance(image, DecodedImage):
+            return image.rgb
+        if isinstance(image, np.ndarray):
+            return image
+        return decode_image(image).rgb
+
+    def _letterbox(self, image_rgb: np.ndarray) -> Tuple[np.ndarray, float, int, int]:
+        """Pad bottom/right to a square and resize to the model size (NudeDetector geometry)"""
+        height, width = image_rgb.shape[:2]
+        max_side = max(height, width)
+        if height != width:
+            image_rgb = cv2.copyMakeBorder(image_rgb, 0, max_side - height, 0, max_side - width,
+                                           cv2.BORDER_CONSTANT, value=0)
+        canvas = cv2.resize(image_rgb, (self.input_size, self.input_size), interpolation=cv2.INTER_LINEAR)
+        return canvas, max_side / self.input_size, width, height
+
+    def preprocess(self, images: Sequence[np.ndarray]) -> Tuple[np.ndarray, List[Tuple[float, int, int]]]:
+        """Letterbox a batch of RGB arrays into one NCHW float32 tensor"""
+        canvases = np.empty((len(images), self.input_size, self.input_size, 3), dtype=np.uint8)
+        geometry = []
+        for i, image_rgb in enumerate(images):
+            canvases[i], box_scale, width, height = self._letterbox(image_rgb)
+            geometry.append((box_scale, width, height))
+
+        # Normalize the whole batch at once: uint8 NHWC -> float32 NCHW in [0, 1].
+        # NudeDetector's own preprocessing ends up feeding the model BGR planes,
+        # so the channels are reversed here to keep scores identical.
+        tensor = canvases[:, :, :, ::-1].transpose(0, 3, 1, 2).astype(np.float32)
+        tensor *= 1.0 / 255.0
+        return tensor, geometry
+
+    def postprocess(self, output: np.ndarray, geometry: List[Tuple[float, int, int]]) -> List[List[Dict]]:
+        """Score-filter the whole batch at once, then NMS each image"""
+        predictions = output.transpose(0, 2, 1)  # (batch, anchors, 4 + classes)
+        class_scores = predictions[:, :, 4:]
+        best_scores = class_scores.max(axis=2)
+        best_classes = class_scores.argmax(axis=2)
+        candidate_mask = best_scores >= CANDIDATE_SCORE_THRESHOLD
+
+        results = []
+        for i, (box_scale, width, height) in enumerate(geometry):
+            rows = np.flatnonzero(candidate_mask[i])
+            if rows.size == 0:
+                results.append([])
+                continue
+
+            cx, cy, w, h = (predictions[i, rows, k] * box_scale for k in range(4))
+            x = np.clip(cx - w / 2, 0, width)
+            y = np.clip(cy - h / 2, 0, height)
+            w = np.minimum(w, width - x)
+            h = np.minimum(h, height - y)
+            boxes = np.stack([x, y, w, h], axis=1)
+            scores = best_scores[i, rows]
+
+            detections = []
+            for k in non_max_suppression(boxes, scores):
+                detections.append({
+                    'class': NUDENET_LABELS[int(best_classes[i, rows[k]])],
+                    'score': float(scores[k]),
+                    'box': [int(v) for v in boxes[k]]
+                })
+            results.append(detections)
+
+        return results
+
+    def detect_batch(self, images: Sequence[EngineInput]) -> List[List[Dict]]:
+        """Detect on several images; returns one NudeDetector-style list per image"""
+        rgb_images = [self._to_rgb(image) for image in images]
+        results = []
+        for start in range(0, len(rgb_images), self.max_batch_size):
+            chunk = rgb_images[start:start + self.max_batch_size]
+            tensor, geometry = self.preprocess(chunk)
+            output = self.onnx_session.run(None, {self.input_name: tensor})[0]
+            results.extend(self.postprocess(output, geometry))
+        return results
+
+    def detect(self, image: EngineInput) -> List[Dict]:
+        """Detect on a single image; same {'class', 'score', 'box'} dicts as NudeDetector"""
+        return self.detect_batch([image])[0]
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash near-duplicate index
+Resized, recompressed and lightly cropped copies of an image share a pHash
+within a few bits; a BK-tree per analysis scope finds prior results by Hamming
+distance before any model runs. Prior auto_rejected results match at a looser
+distance so re-posts of rejected content are blocked cheaply.
+"""
+
+import json
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def phash(image_rgb: np.ndarray) -> int:
+    """64-bit DCT perceptual hash of an RGB image"""
+    gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(small)[:8, :8].flatten()
+
+    # Median without the DC term, which only encodes overall brightness
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes with the Hamming metric"""
+
+    def __init__(self):
+        # Node: [hash, value, {distance: child node}]
+        self.root = None
+        self.size = 0
+
+    def add(self, hash_value: int, value):
+        """Insert a hash; an identical hash replaces the previous value"""
+        if self.root is None:
+            self.root = [hash_value, value, {}]
+            self.size = 1
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1] = value
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, value, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, hash_value: int, radius: int) -> List[Tuple[int, int, object]]:
+        """All (distance, hash, value) within radius, nearest first"""
+        matches = []
+        if self.root is None:
+            return matches
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= radius:
+                matches.append((distance, node[0], node[1]))
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class PerceptualIndex:
+    """Near-duplicate lookup of prior analysis results, one BK-tree per scope
+
+    A scope is whatever must match for a result to be reusable (config hash,
+    model versions, context_type). Results are stored serialized so every
+    lookup returns an independent copy.
+    """
+
+    def __init__(self, max_distance: int = 6, blocklist_distance: int = 10, max_entries: int = 10000):
+        self.max_distance = max_distance
+        self.blocklist_distance = max(blocklist_distance, max_distance)
+        self.max_entries = max_entries
+
+        self._trees: Dict[str, BKTree] = {}
+        self._order = deque()
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.near_duplicate_hits = 0
+        self.blocklist_hits = 0
+
+    def lookup(self, scope: str, hash_value: int) -> Optional[Tuple[Dict, Dict]]:
+        """Prior result and match info for a near-duplicate, or None"""
+        with self._lock:
+            self.lookups += 1
+            tree = self._trees.get(scope)
+            if tree is None:
+                return None
+            candidates = tree.search(hash_value, self.blocklist_distance)
+
+        for distance, matched_hash, (status, serialized) in candidates:
+            if distance <= self.max_distance:
+                match_type = 'near_duplicate'
+            elif status == 'auto_rejected':
+                match_type = 'blocklist'
+            else:
+                continue
+
+            with self._lock:
+                if match_type == 'blocklist':
+                    self.blocklist_hits += 1
+                else:
+                    self.near_duplicate_hits += 1
+
+            return json.loads(serialized), {
+                'match_type': match_type,
+                'distance': distance,
+                'matched_phash': f'{matched_hash:016x}',
+                'prior_status': status
+            }
+
+        return None
+
+    def add(self, scope: str, hash_value: int, result: Dict):
+        """Index a finished analysis result under its scope"""
+        status = result.get('moderation_decision', {}).get('status')
+        serialized = json.dumps(result, separators=(',', ':'), default=str)
+
+        with self._lock:
+            self._trees.setdefault(scope, BKTree()).add(hash_value, (status, serialized))
+            self._order.append((scope, hash_value, status, serialized))
+            if len(self._order) > self.max_entries:
+                self._compact()
+
+    def _compact(self):
+        """Drop the oldest quarter of entries; BK-trees have no cheap delete, so rebuild"""
+        for _ in range(max(1, self.max_entries // 4)):
+            self._order.popleft()
+
+        self._trees = {}
+        for scope, hash_value, status, serialized in self._order:
+            self._trees.setdefault(scope, BKTree()).add(hash_value, (status, serialized))
+        logger.info(f"🧹 Perceptual index compacted to {len(self._order)} entries")
+
+    def stats(self) -> Dict:
+        return {
+            'entries': sum(tree.size for tree in self._trees.values()),
+            'scopes': len(self._trees),
+            'max_entries': self.max_entries,
+            'max_distance': self.max_distance,
+            'blocklist_distance': self.blocklist_distance,
+            'lookups': self.lookups,
+            'near_duplicate_hits': self.near_duplicate_hits,
+            'blocklist_hits': self.blocklist_hits
+        }
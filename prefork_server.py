@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Pre-fork serving entry point for the moderation servers
+Loads the Flask app (and its NudeNet/InsightFace/BLIP models) once, then forks
+N workers that share the weights copy-on-write and accept from one listening
+socket. Each worker is pinned to a fixed number of inference threads and is
+recycled after a request budget or RSS ceiling.
+
+Usage:
+    python prefork_server.py enhanced_minimal_v4_configurable:app --port 5000 --workers 4
+    python prefork_server.py nudenet-upload-api.py:NudeNetUploadAPI --port 5001
+    python prefork_server.py ai-moderation/app.py:ContentModerator --port 5001
+    python prefork_server.py enhanced_minimal_v4_configurable:app --unix-socket /run/phoenix4ge/moderation.sock
+
+The target is "module_or_path:attribute". The attribute may be a Flask app, or
+a class/factory whose result is an app or exposes one as `.app`; objects with
+initialize_models() (lazy loaders) have it called before forking.
+"""
+
+import os
+import sys
+import time
+import errno
+import random
+import signal
+import socket
+import logging
+import argparse
+import threading
+import importlib
+import importlib.util
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Thread-pool knobs read by the numeric libraries when they initialise;
+# INFERENCE_THREADS is read by NudeNetEngine for its onnxruntime session
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'INFERENCE_THREADS']
+
+
+def pin_thread_env(threads: int):
+    """Pin thread pools before any model library is imported"""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+
+
+def pin_torch_threads(threads: int):
+    """Apply the per-worker thread count to torch if the target imported it"""
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+def load_target(target: str):
+    """Import "module_or_path:attribute" and return (wsgi_app, owner object)"""
+    module_ref, _, attribute = target.partition(':')
+    if not attribute:
+        raise ValueError(f"Target '{target}' must look like module_or_path:attribute")
+
+    if module_ref.endswith('.py') or os.sep in module_ref:
+        path = os.path.abspath(module_ref)
+        sys.path.insert(0, os.path.dirname(path))
+        module_name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    else:
+        sys.path.insert(0, os.getcwd())
+        module = importlib.import_module(module_ref)
+
+    owner = getattr(module, attribute)
+    if not hasattr(owner, 'wsgi_app') and callable(owner):
+        owner = owner()
+
+    # Lazy loaders (e.g. ai-moderation's ContentModerator) load before the fork
+    if hasattr(owner, 'initialize_models'):
+        logger.info("📦 Preloading models via initialize_models()")
+        owner.initialize_models()
+
+    app = owner if hasattr(owner, 'wsgi_app') else getattr(owner, 'app', None)
+    if app is None or not hasattr(app, 'wsgi_app'):
+        raise ValueError(f"Target '{target}' did not resolve to a Flask app")
+    return app, owner
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process (Linux /proc, falling back to peak RSS)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _ClosingBody:
+    """Response body whose close() (called by the server after writing) runs a callback"""
+
+    def __init__(self, chunks, on_close):
+        self.chunks = chunks
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.on_close()
+
+
+class RecyclingMiddleware:
+    """Counts requests and asks the worker to exit once its budget or RSS ceiling is hit"""
+
+    def __init__(self, app, max_requests: int, max_rss_bytes: int, on_recycle):
+        self.app = app
+        self.max_requests = max_requests
+        self.max_rss_bytes = max_rss_bytes
+        self.on_recycle = on_recycle
+        self.requests_served = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._recycling = False
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.in_flight += 1
+        try:
+            app_iter = self.app(environ, start_response)
+            try:
+                chunks = list(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        except Exception:
+            self._finished()
+            raise
+        # The request only counts as finished once the server has written the response
+        return _ClosingBody(chunks, self._finished)
+
+    def _finished(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests_served += 1
+            reason = None
+            if self.max_requests and self.requests_served >= self.max_requests:
+                reason = f'served {self.requests_served} requests'
+            elif self.max_rss_bytes:
+                rss = current_rss_bytes()
+                if rss > self.max_rss_bytes:
+                    reason = f'RSS {rss // (1024 * 1024)}MB over ceiling'
+            if reason and not self._recycling:
+                self._recycling = True
+                self.on_recycle(reason)
+
+
+def run_worker(listen_socket: socket.socket, app, args) -> int:
+    """Serve on the inherited socket until recycled or told to stop"""
+    from werkzeug.serving import make_server
+
+    pin_torch_threads(args.threads_per_worker)
+    random.seed()
+
+    server = None
+    stopping = threading.Event()
+
+    def stop(reason: str):
+        if stopping.is_set():
+            return
+        stopping.set()
+        logger.info(f"♻️ Worker {os.getpid()} stopping: {reason}")
+        # shutdown() blocks until serve_forever exits, so it must run off the serving thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    max_requests = args.max_requests
+    if max_requests and args.max_requests_jitter:
+        max_requests += random.randint(0, args.max_requests_jitter)
+
+    middleware = RecyclingMiddleware(app, max_requests, args.max_rss_mb * 1024 * 1024, stop)
+    host, port = (f'unix://{args.unix_socket}', 0) if args.unix_socket else (args.host, args.port)
+    server = make_server(host, port, middleware, threaded=True, fd=listen_socket.fileno())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop('SIGTERM'))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    logger.info(f"👷 Worker {os.getpid()} serving (threads={args.threads_per_worker}, "
+                f"max_requests={max_requests or 'unlimited'}, max_rss_mb={args.max_rss_mb or 'unlimited'})")
+    server.serve_forever()
+
+    # Request threads are daemonic; let in-flight requests finish before exiting
+    deadline = time.monotonic() + args.graceful_timeout
+    while middleware.in_flight and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return 0
+
+
+def spawn_worker(listen_socket: socket.socket, app, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = run_worker(listen_socket, app, args)
+        except Exception as e:
+            logger.error(f"❌ Worker {os.getpid()} crashed: {e}")
+        finally:
+            os._exit(code)
+    return pid
+
+
+def create_listen_socket(args) -> socket.socket:
+    """TCP socket on host:port, or a Unix domain socket when --unix-socket is given"""
+    if not args.unix_socket:
+        return socket.create_server((args.host, args.port), backlog=args.backlog)
+    if os.path.exists(args.unix_socket):
+        os.unlink(args.unix_socket)
+    listen_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listen_socket.bind(args.unix_socket)
+    # Group-writable so the Node process can connect when it runs as a different user
+    os.chmod(args.unix_socket, 0o660)
+    listen_socket.listen(args.backlog)
+    return listen_socket
+
+
+def serve(args) -> int:
+    pin_thread_env(args.threads_per_worker)
+
+    logger.info(f"🚀 Loading {args.target} before forking {args.workers} workers")
+    started = time.monotonic()
+    app, _ = load_target(args.target)
+    logger.info(f"✅ Models loaded in {time.monotonic() - started:.1f}s")
+
+    listen_socket = create_listen_socket(args)
+    listen_socket.set_inheritable(True)
+
+    workers = {}
+    shutting_down = False
+
+    def handle_shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+
+    for _ in range(args.workers):
+        pid = spawn_worker(listen_socket, app, args)
+        workers[pid] = time.monotonic()
+
+    address = f'unix:{args.unix_socket}' if args.unix_socket else f'{args.host}:{args.port}'
+    logger.info(f"🌐 Listening on {address} with {args.workers} workers")
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        except OSError as e:
+            if e.errno == errno.ECHILD:
+                break
+            raise
+
+        started_at = workers.pop(pid, None)
+        if started_at is None:
+            continue
+        if shutting_down:
+            continue
+
+        # Back off if workers die right after starting (e.g. a broken model load)
+        if time.monotonic() - started_at < 1.0 and os.WEXITSTATUS(status) != 0:
+            time.sleep(1.0)
+        logger.info(f"🔁 Worker {pid} exited (status {status}), starting a replacement")
+        new_pid = spawn_worker(listen_socket, app, args)
+        workers[new_pid] = time.monotonic()
+
+    listen_socket.close()
+    if args.unix_socket and os.path.exists(args.unix_socket):
+        os.unlink(args.unix_socket)
+    logger.info("👋 All workers stopped")
+    return 0
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='Pre-fork multi-worker server for the moderation APIs')
+    parser.add_argument('target', help='module_or_path:attribute (Flask app, or class/factory providing .app)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--unix-socket', default=os.getenv('UNIX_SOCKET'),
+                        help='Listen on this Unix domain socket instead of host:port')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', cpu_count)))
+    parser.add_argument('--threads-per-worker', type=int, default=int(os.getenv('THREADS_PER_WORKER', 0)),
+                        help='Inference threads per worker (default: cores / workers)')
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('MAX_REQUESTS', 0)),
+                        help='Recycle a worker after this many requests (0 = never)')
+    parser.add_argument('--max-requests-jitter', type=int, default=int(os.getenv('MAX_REQUESTS_JITTER', 0)),
+                        help='Random extra requests per worker so they do not recycle together')
+    parser.add_argument('--max-rss-mb', type=int, default=int(os.getenv('MAX_RSS_MB', 0)),
+                        help='Recycle a worker whose RSS exceeds this many MB (0 = never)')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='Seconds a stopping worker waits for in-flight requests')
+    parser.add_argument('--backlog', type=int, default=128)
+    args = parser.parse_args()
+
+    args.workers = max(1, args.workers)
+    if args.threads_per_worker <= 0:
+        args.threads_per_worker = max(1, cpu_count // args.workers)
+
+    sys.exit(serve(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+On-demand sampling profiler for single /analyze requests
+A request sent with profile=1 (allowed by PROFILING_ENABLED or a matching
+X-Admin-Token) runs under a sampler thread that reads sys._current_frames()
+every PROFILE_INTERVAL_MS for the request thread and the stage threads working
+for it. Stacks are rooted at the stage name (nudity_detection, decode_exif, ...)
+and exported as collapsed stacks (flamegraph.pl, speedscope) or speedscope JSON.
+
+Nothing is sampled or hooked for requests without profile=1; stages only look
+up a thread-local to see whether a profiler is attached. Work that runs on
+shared threads (e.g. the NudeNet micro-batcher) shows up as the stage waiting.
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+# When set, every profile is also written here (speedscope.app opens both formats)
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+FORMATS = ('speedscope', 'collapsed')
+REQUEST_STAGE = 'request'
+
+_local = threading.local()
+
+
+def profiling_allowed(admin_token: Optional[str]) -> bool:
+    """profile=1 and /debug/slow are honoured when enabled by config or with the admin token"""
+    if PROFILING_ENABLED:
+        return True
+    return bool(PROFILE_ADMIN_TOKEN and admin_token and hmac.compare_digest(admin_token, PROFILE_ADMIN_TOKEN))
+
+
+def current_profiler() -> Optional['RequestProfiler']:
+    """Profiler attached to the calling thread, if any"""
+    return getattr(_local, 'profiler', None)
+
+
+@contextmanager
+def profiled_stage(name: str):
+    """Label the calling thread's samples with a stage name while a profiler is attached"""
+    profiler = current_profiler()
+    if profiler is None:
+        yield
+        return
+    with profiler.attach(name):
+        yield
+
+
+def _frame_name(code) -> str:
+    # Collapsed stacks split on ';' and the count on the last space
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+class RequestProfiler:
+    """Samples the threads attached to one request; use as a context manager around the request"""
+
+    def __init__(self, name: str = 'analyze', interval_ms: float = PROFILE_INTERVAL_MS):
+        self.name = name
+        self.interval = max(0.001, interval_ms / 1000)
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started = None
+        self.duration = 0.0
+        self._threads: Dict[int, list] = {}  # thread ident -> stack of stage labels
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def __enter__(self) -> 'RequestProfiler':
+        self.started = time.perf_counter()
+        self._register(threading.get_ident(), REQUEST_STAGE)
+        _local.profiler = self
+        self._sampler = threading.Thread(target=self._run, name=f'profiler-{self.name}', daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.started
+        _local.profiler = None
+        with self._lock:
+            self._threads.clear()
+        return False
+
+    def _register(self, ident: int, label: str):
+        with self._lock:
+            self._threads.setdefault(ident, []).append(label)
+
+    def _unregister(self, ident: int):
+        with self._lock:
+            labels = self._threads.get(ident)
+            if labels:
+                labels.pop()
+                if not labels:
+                    del self._threads[ident]
+
+    @contextmanager
+    def attach(self, stage: str):
+        """Sample the calling thread under a stage label (stage threads and nested stages)"""
+        ident = threading.get_ident()
+        previous = current_profiler()
+        _local.profiler = self
+        self._register(ident, stage)
+        try:
+            yield
+        finally:
+            self._unregister(ident)
+            _local.profiler = previous
+
+    def _run(self):
+        sampler_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = {ident: labels[-1] for ident, labels in self._threads.items() if ident != sampler_ident}
+            for ident, stage in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(stage)
+                self.samples[tuple(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def collapsed(self) -> str:
+        """Brendan Gregg collapsed stacks: 'stage;outer;...;inner count' per line"""
+        return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in sorted(self.samples.items())) + '\n'
+
+    def speedscope(self) -> Dict:
+        """speedscope.app 'sampled' profile (weights in seconds)"""
+        frames, frame_index = [], {}
+        samples, weights = [], []
+        for stack, count in sorted(self.samples.items()):
+            indexes = []
+            for name in stack:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({'name': name})
+                indexes.append(frame_index[name])
+            samples.append(indexes)
+            weights.append(round(count * self.interval, 6))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'exporter': 'request_profiler',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': self.name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(sum(weights), 6),
+                'samples': samples,
+                'weights': weights
+            }]
+        }
+
+    def export(self, profile_format: str = 'speedscope') -> Dict:
+        """Profile summary for the response, also written to PROFILE_DIR when configured"""
+        if profile_format not in FORMATS:
+            profile_format = 'speedscope'
+        data = self.speedscope() if profile_format == 'speedscope' else self.collapsed()
+        summary = {
+            'format': profile_format,
+            'interval_ms': round(self.interval * 1000, 3),
+            'samples': self.sample_count,
+            'duration_ms': round(self.duration * 1000, 2),
+            'stage_samples': self.stage_samples(),
+            'data': data
+        }
+        if PROFILE_DIR:
+            summary['path'] = self._write(data, profile_format)
+        return summary
+
+    def stage_samples(self) -> Dict[str, int]:
+        counts: Counter = Counter()
+        for stack, count in self.samples.items():
+            counts[stack[0]] += count
+        return dict(counts)
+
+    def _write(self, data, profile_format: str) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        suffix = 'speedscope.json' if profile_format == 'speedscope' else 'collapsed.txt'
+        path = os.path.join(PROFILE_DIR, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.{suffix}")
+        with open(path, 'w') as f:
+            if profile_format == 'speedscope':
+                json.dump(data, f)
+            else:
+                f.write(data)
+        return path
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Moderation result cache
+Keys are SHA-256(image bytes) + canonical hash of the effective config + model
+versions; an in-memory LRU tier is backed by an optional SQLite tier that
+survives restarts
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_hash(value: Any) -> str:
+    """Stable hash of a JSON-serializable value (key order independent)"""
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """LRU cache of serialized analysis results with an optional SQLite tier"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 sqlite_path: Optional[str] = None, sqlite_max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sqlite_path = sqlite_path
+        self.sqlite_max_entries = sqlite_max_entries
+
+        self._entries: 'OrderedDict[str, str]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._puts_since_prune = 0
+
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.evictions = 0
+
+        if sqlite_path:
+            self._connect()
+            logger.info(f"💾 Result cache disk tier: {sqlite_path}")
+
+    @staticmethod
+    def make_key(image_bytes: bytes, config: Dict, model_versions: Dict, **scope) -> str:
+        """Cache key for an image under a config, model versions and extra scope (e.g. context_type)"""
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        settings_hash = canonical_hash({'config': config, 'models': model_versions, 'scope': scope})
+        return f"{image_hash}:{settings_hash}"
+
+    def _connect(self):
+        """(Re)open the SQLite tier; connections are not shared across forks"""
+        self._db = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS analysis_results ('
+            'cache_key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._db.commit()
+        self._db_pid = os.getpid()
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        if not self.sqlite_path:
+            return None
+        if self._db_pid != os.getpid():
+            self._connect()
+        return self._db
+
+    def _remember(self, key: str, serialized: str):
+        """Insert into the memory tier and evict least recently used entries"""
+        if key in self._entries:
+            self._bytes -= len(self._entries.pop(key))
+        self._entries[key] = serialized
+        self._bytes += len(serialized)
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Cached result for key (a fresh copy), or None"""
+        with self._lock:
+            serialized = self._entries.get(key)
+            if serialized is not None:
+                self._entries.move_to_end(key)
+                self.hits['memory'] += 1
+                return json.loads(serialized)
+
+            db = self._disk()
+            if db is not None:
+                row = db.execute('SELECT result FROM analysis_results WHERE cache_key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.hits['disk'] += 1
+                    return json.loads(row[0])
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: Dict):
+        """Store a result in memory and, when configured, on disk"""
+        serialized = json.dumps(result, separators=(',', ':'), default=str)
+        with self._lock:
+            self._remember(key, serialized)
+
+            db = self._disk()
+            if db is None:
+                return
+            try:
+                db.execute('INSERT OR REPLACE INTO analysis_results (cache_key, result, created_at) VALUES (?, ?, ?)',
+                           (key, serialized, time.time()))
+                self._puts_since_prune += 1
+                if self._puts_since_prune >= 1000:
+                    self._puts_since_prune = 0
+                    db.execute('DELETE FROM analysis_results WHERE cache_key IN ('
+                               'SELECT cache_key FROM analysis_results ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                               (self.sqlite_max_entries,))
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Result cache disk write failed: {e}")
+
+    def stats(self) -> Dict:
+        """Size, hit/miss counters and hit rate"""
+        hits = self.hits['memory'] + self.hits['disk']
+        lookups = hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'disk_tier': self.sqlite_path,
+            'hits': dict(self.hits),
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0
+        }
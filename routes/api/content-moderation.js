@@ -43,6 +43,9 @@ const upload = multer({
 
 // AI Moderation Service Configuration
 const AI_SERVICE_URL = process.env.AI_MODERATION_URL || 'http://52.15.235.216:5000';
+// Same-host deployments can talk to the moderation server over a Unix socket (its UNIX_SOCKET)
+const AI_SERVICE_SOCKET = process.env.AI_MODERATION_SOCKET;
+const aiRequestOptions = (options) => (AI_SERVICE_SOCKET ? { ...options, socketPath: AI_SERVICE_SOCKET } : options);
 
 // Mock AI results for testing when service is unavailable
 const MOCK_AI_RESULTS = {
@@ -116,9 +119,9 @@ router.post('/upload', upload.single('image'), async (req, res) => {
                 image_path: fullImagePath,
                 model_id: parseInt(model_id),
                 context_type: context_type
-            }, {
+            }, aiRequestOptions({
                 timeout: 10000 // 10 second timeout
-            });
+            }));
 
             if (moderationResponse.data.success) {
                 const result = moderationResponse.data.result;
@@ -568,9 +571,9 @@ router.get('/rules', async (req, res) => {
  */
 router.get('/test', async (req, res) => {
     try {
-        const healthResponse = await axios.get(`${AI_SERVICE_URL}/health`, {
+        const healthResponse = await axios.get(`${AI_SERVICE_URL}/health`, aiRequestOptions({
             timeout: 5000
-        });
+        }));
 
         res.success({ ai_service_status: 'connected', ai_service_response: healthResponse.data });
 
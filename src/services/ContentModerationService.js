@@ -17,6 +17,7 @@ const path = require('path');
 const fs = require('fs').promises;
 const { spawn } = require('child_process');
 const VeniceAIService = require('./VeniceAIService');
+const NudeNetWorkerClient = require('./NudeNetWorkerClient');
 const sharp = require('sharp');
 const crypto = require('crypto');
 const mysql = require('mysql2/promise');
@@ -32,6 +33,10 @@ class ContentModerationService extends EventEmitter {
         this.analysisConfigs = new Map(); // Cache for new analysis configurations
         this.configCacheExpiry = 10 * 60 * 1000; // 10 minutes
         
+        // Long-lived nudenet-cli.py worker (detector loaded once, not per image)
+        this.useNudeNetWorker = process.env.NUDENET_PERSISTENT_WORKER !== 'false';
+        this.nudeNetWorker = new NudeNetWorkerClient();
+        
         // ML-based violation detection configuration
         this.violationDetectionConfig = {
             // Detection models and their weights
@@ -763,6 +768,60 @@ class ContentModerationService extends EventEmitter {
         // Generate batch ID for tracking (compatible with test interface)
         const batchId = `local_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`;
         
+        let result;
+        if (this.useNudeNetWorker) {
+            try {
+                result = await this.nudeNetWorker.analyze(imagePath, contextType);
+            } catch (workerError) {
+                // Only a worker that could not answer falls back; the CLI would repeat a real failure
+                if (!workerError.workerUnavailable) {
+                    throw workerError;
+                }
+                console.warn(`⚠️ NudeNet worker unavailable, running one-shot CLI: ${workerError.message}`);
+                result = await this.runNudeNetCli(imagePath, contextType);
+            }
+        } else {
+            result = await this.runNudeNetCli(imagePath, contextType);
+        }
+
+        if (result.success === false) {
+            throw new Error(`Local NudeNet analysis failed: ${result.error}`);
+        }
+        
+        // Apply nudity score correction (exclude faces and covered parts)
+        const detectedParts = result.detected_parts || {};
+        const ACTUAL_NUDITY_PARTS = [
+            'FEMALE_GENITALIA_EXPOSED',
+            'MALE_GENITALIA_EXPOSED', 
+            'BUTTOCKS_EXPOSED',
+            'FEMALE_BREAST_EXPOSED',
+            'ANUS_EXPOSED'
+        ];
+        
+        let correctedNudityScore = 0;
+        Object.entries(detectedParts).forEach(([part, confidence]) => {
+            if (ACTUAL_NUDITY_PARTS.includes(part)) {
+                correctedNudityScore = Math.max(correctedNudityScore, confidence);
+            }
+        });
+
+        console.log(`🔍 Local NudeNet results: Original=${result.nudity_score?.toFixed(1)}%, Corrected=${correctedNudityScore.toFixed(1)}%`);
+        
+        const { id, ...analysis } = result;
+        return {
+            ...analysis,
+            nudity_score: correctedNudityScore,
+            processing_method: 'local_nudenet',
+            analysis_version: 'local_v1.0',
+            batch_id: batchId,
+            moderation_status: 'pending' // Will be determined by moderation rules
+        };
+    }
+
+    /**
+     * Run nudenet-cli.py once for a single image (used when the worker is disabled or down)
+     */
+    runNudeNetCli(imagePath, contextType) {
         return new Promise((resolve, reject) => {
             const python = spawn('python3', [
                 path.join(__dirname, '../../nudenet-cli.py'),
@@ -798,35 +857,7 @@ class ContentModerationService extends EventEmitter {
 
                 try {
                     console.log('📝 Raw NudeNet output:', stdout);
-                    const result = JSON.parse(stdout.trim());
-                    
-                    // Apply nudity score correction (exclude faces and covered parts)
-                    const detectedParts = result.detected_parts || {};
-                    const ACTUAL_NUDITY_PARTS = [
-                        'FEMALE_GENITALIA_EXPOSED',
-                        'MALE_GENITALIA_EXPOSED', 
-                        'BUTTOCKS_EXPOSED',
-                        'FEMALE_BREAST_EXPOSED',
-                        'ANUS_EXPOSED'
-                    ];
-                    
-                    let correctedNudityScore = 0;
-                    Object.entries(detectedParts).forEach(([part, confidence]) => {
-                        if (ACTUAL_NUDITY_PARTS.includes(part)) {
-                            correctedNudityScore = Math.max(correctedNudityScore, confidence);
-                        }
-                    });
-
-                    console.log(`🔍 Local NudeNet results: Original=${result.nudity_score?.toFixed(1)}%, Corrected=${correctedNudityScore.toFixed(1)}%`);
-                    
-                    resolve({
-                        ...result,
-                        nudity_score: correctedNudityScore,
-                        processing_method: 'local_nudenet',
-                        analysis_version: 'local_v1.0',
-                        batch_id: batchId,
-                        moderation_status: 'pending' // Will be determined by moderation rules
-                    });
+                    resolve(JSON.parse(stdout.trim()));
                 } catch (parseError) {
                     console.error(`❌ Failed to parse NudeNet result:`, parseError.message);
                     console.error('stdout:', stdout);
@@ -2272,6 +2303,9 @@ except Exception as e:
                 await this.redis.disconnect();
             }
             
+            // Stop the NudeNet worker process
+            this.nudeNetWorker.shutdown();
+            
             // Remove all event listeners
             this.removeAllListeners();
             
@@ -0,0 +1,156 @@
+/**
+ * NudeNet Worker Client
+ * Keeps a single long-lived `nudenet-cli.py --serve` process and sends it
+ * JSON-lines requests, so the detector is loaded once instead of per image.
+ *
+ * Errors from a worker that could not answer (spawn failure, crash, timeout)
+ * carry workerUnavailable = true; a {success: false} reply is resolved as is.
+ */
+
+const path = require('path');
+const readline = require('readline');
+const { spawn } = require('child_process');
+
+const PROJECT_ROOT = path.join(__dirname, '../..');
+
+function unavailable(error) {
+    error.workerUnavailable = true;
+    return error;
+}
+
+class NudeNetWorkerClient {
+    constructor(options = {}) {
+        this.config = {
+            scriptPath: options.scriptPath || path.join(PROJECT_ROOT, 'nudenet-cli.py'),
+            pythonBin: options.pythonBin || 'python3',
+            requestTimeoutMs: options.requestTimeoutMs || 30000
+        };
+
+        this.process = null;
+        this.pending = new Map(); // request id -> { resolve, reject, timer }
+        this.nextRequestId = 1;
+    }
+
+    /**
+     * Start the worker process if it is not already running
+     */
+    ensureStarted() {
+        if (this.process) {
+            return this.process;
+        }
+
+        const worker = spawn(this.config.pythonBin, [this.config.scriptPath, '--serve'], {
+            cwd: PROJECT_ROOT,
+            env: {
+                ...process.env,
+                PATH: path.join(PROJECT_ROOT, '.venv/bin') + ':' + process.env.PATH,
+                VIRTUAL_ENV: path.join(PROJECT_ROOT, '.venv')
+            }
+        });
+
+        readline.createInterface({ input: worker.stdout }).on('line', (line) => this.handleLine(line));
+
+        worker.stderr.on('data', (data) => {
+            console.error('🐍 NudeNet worker:', data.toString().trim());
+        });
+
+        worker.stdin.on('error', (error) => {
+            this.handleExit(worker, unavailable(error));
+        });
+
+        worker.on('error', (error) => {
+            console.error('❌ Failed to start NudeNet worker:', error.message);
+            this.handleExit(worker, unavailable(error));
+        });
+
+        worker.on('close', (code) => {
+            this.handleExit(worker, unavailable(new Error(`NudeNet worker exited with code ${code}`)));
+        });
+
+        console.log(`🚀 NudeNet worker started (pid ${worker.pid})`);
+        this.process = worker;
+        return worker;
+    }
+
+    /**
+     * Analyze an image; resolves with the same JSON object nudenet-cli.py prints
+     */
+    analyze(imagePath, contextType) {
+        const worker = this.ensureStarted();
+        const id = this.nextRequestId++;
+
+        return new Promise((resolve, reject) => {
+            const timer = setTimeout(() => {
+                this.pending.delete(id);
+                reject(unavailable(new Error(`NudeNet worker timed out after ${this.config.requestTimeoutMs}ms`)));
+                this.restart(worker);
+            }, this.config.requestTimeoutMs);
+
+            this.pending.set(id, { resolve, reject, timer });
+            worker.stdin.write(JSON.stringify({ id, image: imagePath, context_type: contextType }) + '\n');
+        });
+    }
+
+    /**
+     * Route one response line to the request waiting on it
+     */
+    handleLine(line) {
+        let result;
+        try {
+            result = JSON.parse(line);
+        } catch (parseError) {
+            console.error('❌ Failed to parse NudeNet worker output:', line);
+            return;
+        }
+
+        const entry = this.pending.get(result.id);
+        if (!entry) {
+            return;
+        }
+
+        this.pending.delete(result.id);
+        clearTimeout(entry.timer);
+        entry.resolve(result);
+    }
+
+    /**
+     * Kill a hung worker and start a fresh one; its other in-flight requests fail over
+     */
+    restart(worker) {
+        if (this.process !== worker) {
+            return;
+        }
+        console.warn(`⚠️ Restarting unresponsive NudeNet worker (pid ${worker.pid})`);
+        this.handleExit(worker, unavailable(new Error('NudeNet worker restarted after a timeout')));
+        worker.kill('SIGKILL');
+        this.ensureStarted();
+    }
+
+    /**
+     * Fail in-flight requests; the next analyze() call respawns the worker
+     */
+    handleExit(worker, error) {
+        if (this.process !== worker) {
+            return;
+        }
+        this.process = null;
+        for (const entry of this.pending.values()) {
+            clearTimeout(entry.timer);
+            entry.reject(error);
+        }
+        this.pending.clear();
+    }
+
+    /**
+     * Stop the worker process
+     */
+    shutdown() {
+        if (this.process) {
+            this.process.stdin.end();
+            this.process.kill();
+            this.process = null;
+        }
+    }
+}
+
+module.exports = NudeNetWorkerClient;
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Stage dependency graph for the moderation pipelines
+Stages declare the stages (or run inputs) they depend on; independent stages
+run concurrently in a thread pool (onnxruntime and torch release the GIL) and
+join stages start as soon as their inputs are ready. A stage may carry a gate
+that skips it (with a recorded reason) once its result can no longer matter.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from request_profiler import current_profiler
+
+# Key in run() results mapping each skipped stage to its skip reason
+SKIPPED_STAGES = 'skipped_stages'
+# Key in run() results mapping each stage that ran to its duration in seconds
+STAGE_TIMINGS = 'stage_timings'
+
+
+@dataclass
+class Stage:
+    """One pipeline stage: fn is called with its dependencies as keyword arguments
+
+    gate (called with gate_deps as keyword arguments) returns a skip reason or
+    None; a skipped stage's result is on_skip(reason), or None without on_skip.
+    """
+    name: str
+    fn: Callable[..., Any]
+    deps: List[str] = field(default_factory=list)
+    gate: Optional[Callable[..., Optional[str]]] = None
+    gate_deps: List[str] = field(default_factory=list)
+    on_skip: Optional[Callable[[str], Any]] = None
+
+    @property
+    def requires(self) -> List[str]:
+        return self.deps + [dep for dep in self.gate_deps if dep not in self.deps]
+
+
+class StageGraph:
+    """A DAG of named stages that run as early as their dependencies allow"""
+
+    def __init__(self, name: str = 'pipeline', max_workers: Optional[int] = None):
+        self.name = name
+        self.stages: Dict[str, Stage] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-stage')
+
+    def add(self, name: str, fn: Callable[..., Any], deps: Sequence[str] = (),
+            gate: Optional[Callable[..., Optional[str]]] = None, gate_deps: Sequence[str] = (),
+            on_skip: Optional[Callable[[str], Any]] = None) -> 'StageGraph':
+        """Register a stage; deps name earlier stages or keyword inputs passed to run()"""
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' already registered in {self.name}")
+        self.stages[name] = Stage(name=name, fn=fn, deps=list(deps), gate=gate,
+                                  gate_deps=list(gate_deps), on_skip=on_skip)
+        return self
+
+    def _skip_reason(self, stage: Stage, results: Dict[str, Any]) -> Optional[str]:
+        if stage.gate is None:
+            return None
+        return stage.gate(**{dep: results[dep] for dep in stage.gate_deps})
+
+    def _call(self, stage: Stage, results: Dict[str, Any], timings: Dict[str, float], profiler=None) -> Any:
+        started = time.perf_counter()
+        try:
+            if profiler is None:
+                return stage.fn(**{dep: results[dep] for dep in stage.deps})
+            # A profiled request also samples this pool thread, under the stage's name
+            with profiler.attach(stage.name):
+                return stage.fn(**{dep: results[dep] for dep in stage.deps})
+        finally:
+            timings[stage.name] = time.perf_counter() - started
+
+    def run(self, **inputs) -> Dict[str, Any]:
+        """Run every stage once; returns inputs plus each stage's result by name
+
+        Skipped stages are listed with their reasons under SKIPPED_STAGES and
+        the duration of every stage that ran under STAGE_TIMINGS.
+        The first stage exception is re-raised after in-flight stages finish.
+        """
+        results: Dict[str, Any] = dict(inputs)
+        skipped: Dict[str, str] = {}
+        timings: Dict[str, float] = {}
+        profiler = current_profiler()
+        pending = dict(self.stages)
+        running = {}
+
+        for stage in pending.values():
+            missing = [dep for dep in stage.requires if dep not in self.stages and dep not in inputs]
+            if missing:
+                raise ValueError(f"{self.name}: stage '{stage.name}' is missing inputs {missing}")
+
+        while pending or running:
+            # Skipping a stage resolves it immediately, which can make more stages ready
+            progressed = True
+            while progressed:
+                progressed = False
+                ready = [stage for stage in pending.values() if all(dep in results for dep in stage.requires)]
+                for stage in ready:
+                    del pending[stage.name]
+                    reason = self._skip_reason(stage, results)
+                    if reason is None:
+                        running[self._executor.submit(self._call, stage, results, timings, profiler)] = stage.name
+                    else:
+                        skipped[stage.name] = reason
+                        results[stage.name] = stage.on_skip(reason) if stage.on_skip else None
+                        progressed = True
+
+            if not running:
+                if pending:
+                    raise ValueError(f"{self.name}: dependency cycle between stages {sorted(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage_name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    # Let siblings finish so no stage outlives the request
+                    wait(running)
+                    raise error
+                results[stage_name] = future.result()
+
+        results[SKIPPED_STAGES] = skipped
+        results[STAGE_TIMINGS] = timings
+        return results
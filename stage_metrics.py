@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and Prometheus metrics for the moderation servers
+Each analysis carries a StageTimer that records monotonic (perf_counter)
+durations for decode/EXIF, NudeNet, InsightFace, BLIP, MediaPipe, the DB write
+and so on; the breakdown goes into the response metadata and is folded into
+histograms labelled by stage, context_type and outcome. /metrics renders them
+in the Prometheus text format together with queue depth, in-flight requests
+and model load times. No client library is needed.
+
+Metrics are per process: behind prefork_server each scrape reaches one worker.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from request_profiler import profiled_stage
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# context_type comes from the client; anything else is labelled 'other' so
+# callers cannot create unbounded series
+CONTEXT_TYPES = frozenset({'profile_pic', 'public_gallery', 'premium_gallery', 'private_content'})
+OTHER_LABEL = 'other'
+
+# Seconds; wide enough for a cold BLIP generate on CPU
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class StageTimer:
+    """Monotonic per-stage durations for one request (stages may be recorded from several threads)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            with profiled_stage(name):
+                yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float):
+        # Repeated stages (e.g. EXIF normalization for NudeNet and for pose) accumulate
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_metadata(self) -> Dict:
+        """Breakdown for response metadata, in milliseconds"""
+        return {
+            'stages_ms': {name: round(seconds * 1000, 2) for name, seconds in list(self.stages.items())},
+            'total_ms': round(self.elapsed() * 1000, 2)
+        }
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: Tuple[str, ...], value: float):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [per-bucket counts..., sum, count]
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names + ('le',), label_values + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return '\n'.join(lines)
+
+
+class MetricsRegistry:
+    """Stage/request histograms, in-flight count, model load times and callback gauges"""
+
+    def __init__(self, namespace: str = 'moderation', context_types: Iterable[str] = CONTEXT_TYPES):
+        self.namespace = namespace
+        self.context_types = frozenset(context_types)
+        self.stage_seconds = Histogram(f'{namespace}_stage_duration_seconds',
+                                       'Time spent in each analysis stage',
+                                       ('stage', 'context_type', 'outcome'))
+        self.request_seconds = Histogram(f'{namespace}_request_duration_seconds',
+                                         'End-to-end analysis time',
+                                         ('context_type', 'outcome'))
+        self.model_load_seconds: Dict[str, float] = {}
+        self.in_flight = 0
+        self._gauges: Dict[str, Tuple[str, Optional[str], Callable]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, timer: StageTimer, context_type: str, outcome: str):
+        """Fold one finished request's stage breakdown into the histograms"""
+        if context_type not in self.context_types:
+            context_type = OTHER_LABEL
+        for stage_name, seconds in list(timer.stages.items()):
+            self.stage_seconds.observe((stage_name, context_type, outcome), seconds)
+        self.request_seconds.observe((context_type, outcome), timer.elapsed())
+
+    @contextmanager
+    def track_in_flight(self):
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @contextmanager
+    def time_model_load(self, model: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.model_load_seconds[model] = time.perf_counter() - started
+
+    def gauge(self, name: str, help_text: str, read: Callable, label: Optional[str] = None):
+        """Register a gauge read at scrape time; with label, read() returns {label_value: number}"""
+        self._gauges[f'{self.namespace}_{name}'] = (help_text, label, read)
+
+    def _render_gauge(self, name: str, help_text: str, label: Optional[str], read: Callable) -> str:
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        try:
+            value = read()
+        except Exception:
+            # A broken collector must not take /metrics down with it
+            return '\n'.join(lines)
+        if label is None:
+            lines.append(f'{name} {_format_value(value or 0)}')
+        else:
+            for label_value, number in sorted((value or {}).items()):
+                lines.append(f'{name}{_format_labels((label,), (label_value,))} {_format_value(number or 0)}')
+        return '\n'.join(lines)
+
+    def render(self) -> str:
+        """Prometheus text exposition of everything registered"""
+        blocks = [self.stage_seconds.render(), self.request_seconds.render()]
+        blocks.append(self._render_gauge(f'{self.namespace}_in_flight_requests',
+                                         'Analyses currently running', None, lambda: self.in_flight))
+        blocks.append(self._render_gauge(f'{self.namespace}_model_load_seconds',
+                                         'Time taken to load each model at startup', 'model',
+                                         lambda: dict(self.model_load_seconds)))
+        for name, (help_text, label, read) in sorted(self._gauges.items()):
+            blocks.append(self._render_gauge(name, help_text, label, read))
+        return '\n'.join(blocks) + '\n'
+
+
+# Process-wide registry shared by the server module and its front ends
+metrics = MetricsRegistry()
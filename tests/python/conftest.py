@@ -0,0 +1,13 @@
+"""
+Unit tests for the Python moderation modules
+The servers import their helpers by name from the repository root, so the
+tests do too. Run from the repository root: python -m pytest
+"""
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
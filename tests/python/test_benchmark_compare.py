@@ -0,0 +1,122 @@
+"""Benchmark baseline comparison and failed-call accounting"""
+
+import time
+
+from benchmarks.compare import compare_results
+from benchmarks.harness import Stage, measure_stage, percentile, synthetic_corpus
+
+
+def stage(p50=10.0, p95=12.0, p99=15.0, throughput=100.0, calls=60, errors=0, **extra):
+    return dict({'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'throughput_per_s': throughput,
+                 'calls': calls, 'errors': errors}, **extra)
+
+
+def results(stages, fingerprint='corpus-a'):
+    return {'corpus': {'fingerprint': fingerprint}, 'suites': {'v4': {'stages': stages}}}
+
+
+def regressed_metrics(comparison):
+    return {(entry['stage'], entry['metric']) for entry in comparison['regressions']}
+
+
+def test_identical_runs_pass():
+    baseline = results({'_analyze_nudity': stage()})
+
+    comparison = compare_results(baseline, baseline)
+
+    assert comparison['passed']
+    assert comparison['corpus_matches']
+    assert comparison['regressions'] == comparison['improvements'] == comparison['missing'] == []
+
+
+def test_latency_growth_over_threshold_regresses():
+    comparison = compare_results(results({'_analyze_nudity': stage(p95=14.0)}),
+                                 results({'_analyze_nudity': stage(p95=12.0)}), threshold_pct=10.0)
+
+    assert regressed_metrics(comparison) == {('_analyze_nudity', 'p95_ms')}
+    assert comparison['regressions'][0]['change_pct'] == 16.7
+    assert not comparison['passed']
+
+
+def test_throughput_drop_regresses_and_gain_improves():
+    comparison = compare_results(results({'slower': stage(throughput=80.0), 'faster': stage(throughput=130.0)}),
+                                 results({'slower': stage(), 'faster': stage()}))
+
+    assert regressed_metrics(comparison) == {('slower', 'throughput_per_s')}
+    assert [(entry['stage'], entry['metric']) for entry in comparison['improvements']] == \
+        [('faster', 'throughput_per_s')]
+
+
+def test_sub_millisecond_latency_noise_is_ignored():
+    comparison = compare_results(results({'combiner': stage(p50=0.09, p95=0.12, p99=0.2)}),
+                                 results({'combiner': stage(p50=0.03, p95=0.05, p99=0.1)}), min_delta_ms=1.0)
+
+    assert comparison['passed']
+
+
+def test_errors_appearing_regress():
+    comparison = compare_results(results({'_analyze_faces': stage(errors=3)}),
+                                 results({'_analyze_faces': stage(errors=0)}))
+
+    assert regressed_metrics(comparison) == {('_analyze_faces', 'error_rate')}
+    entry = comparison['regressions'][0]
+    assert entry['baseline'] == 0.0 and entry['current'] == 0.05
+    assert entry['change_pct'] is None
+    assert not comparison['passed']
+
+
+def test_error_rate_rise_regresses_and_fall_does_not():
+    comparison = compare_results(results({'worse': stage(errors=6), 'better': stage(errors=1)}),
+                                 results({'worse': stage(errors=3), 'better': stage(errors=3)}))
+
+    assert regressed_metrics(comparison) == {('worse', 'error_rate')}
+
+
+def test_error_rate_accounts_for_different_call_counts():
+    # Twice the calls with twice the errors is the same rate
+    comparison = compare_results(results({'stage': stage(calls=120, errors=2)}),
+                                 results({'stage': stage(calls=60, errors=1)}))
+
+    assert comparison['passed']
+
+
+def test_missing_or_failed_stages_fail_unless_filtered():
+    baseline = results({'ran': stage(), 'not_run': stage(), 'broke': stage()})
+    current = results({'ran': stage(), 'broke': {'stage': 'broke', 'error': 'prepare failed: boom'}})
+
+    comparison = compare_results(current, baseline)
+    assert comparison['missing'] == ['v4/not_run', 'v4/broke']
+    assert not comparison['passed']
+
+    filtered = compare_results(current, baseline, require_all=False)
+    assert filtered['missing'] == ['v4/broke']
+
+
+def test_corpus_mismatch_is_reported():
+    comparison = compare_results(results({'stage': stage()}, 'corpus-b'), results({'stage': stage()}, 'corpus-a'))
+
+    assert not comparison['corpus_matches']
+
+
+def test_percentile_interpolates_between_ranks():
+    assert percentile([], 50) == 0.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0], 100) == 4.0
+
+
+def test_failed_calls_are_counted_but_not_timed():
+    samples = synthetic_corpus()[:2]
+    calls = []
+
+    def slow_failure(sample):
+        calls.append(sample.name)
+        if len(calls) % 2:
+            time.sleep(0.05)
+            raise RuntimeError('model error')
+
+    summary = measure_stage(Stage('flaky', slow_failure), samples, iterations=3, warmup=0, allocations=False)
+
+    assert summary['calls'] == 6
+    assert summary['errors'] == 3
+    # Only the fast successful calls are in the latency distribution
+    assert summary['max_ms'] < 50
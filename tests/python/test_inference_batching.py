@@ -0,0 +1,81 @@
+"""MicroBatcher grouping and per-item error isolation"""
+
+import threading
+
+import pytest
+
+from inference_batching import MicroBatcher
+
+
+class GatedBatchFn:
+    """batch_fn that blocks until released, recording every batch it is given"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.batches = []
+        self.release = threading.Event()
+        self.entered = threading.Event()
+
+    def __call__(self, items):
+        self.entered.set()
+        self.release.wait(5)
+        self.batches.append(list(items))
+        if self.fail_on in items:
+            raise ValueError(f'bad item {self.fail_on}')
+        return [item * 10 for item in items]
+
+
+def test_concurrent_items_share_a_batch():
+    batch_fn = GatedBatchFn()
+    batcher = MicroBatcher(batch_fn, max_batch_size=8, max_wait_ms=0)
+    first = batcher.submit(0)
+    batch_fn.entered.wait(5)
+    rest = [batcher.submit(item) for item in (1, 2, 3)]
+    batch_fn.release.set()
+
+    assert first.result(timeout=5) == 0
+    assert [future.result(timeout=5) for future in rest] == [10, 20, 30]
+    assert batch_fn.batches == [[0], [1, 2, 3]]
+    assert batcher.stats()['largest_batch'] == 3
+
+
+def test_max_batch_size_caps_batches():
+    batch_fn = GatedBatchFn()
+    batcher = MicroBatcher(batch_fn, max_batch_size=2, max_wait_ms=0)
+    batcher.submit(0)
+    batch_fn.entered.wait(5)
+    futures = [batcher.submit(item) for item in (1, 2, 3)]
+    batch_fn.release.set()
+
+    assert [future.result(timeout=5) for future in futures] == [10, 20, 30]
+    assert all(len(batch) <= 2 for batch in batch_fn.batches)
+
+
+def test_failing_item_only_fails_its_own_future():
+    batch_fn = GatedBatchFn(fail_on=2)
+    batcher = MicroBatcher(batch_fn, max_batch_size=8, max_wait_ms=0)
+    batcher.submit(0)
+    batch_fn.entered.wait(5)
+    futures = {item: batcher.submit(item) for item in (1, 2, 3)}
+    batch_fn.release.set()
+
+    assert futures[1].result(timeout=5) == 10
+    assert futures[3].result(timeout=5) == 30
+    with pytest.raises(ValueError, match='bad item 2'):
+        futures[2].result(timeout=5)
+    # The failed batch was retried item by item
+    assert [1, 2, 3] in batch_fn.batches
+    assert [[1], [2], [3]] == batch_fn.batches[-3:]
+
+
+def test_wrong_result_count_fails_instead_of_misrouting():
+    batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=8, max_wait_ms=0)
+
+    with pytest.raises(RuntimeError, match='returned 0 results for 1 items'):
+        batcher(1, timeout=5)
+
+
+def test_call_blocks_for_the_result():
+    batcher = MicroBatcher(lambda items: [item + 1 for item in items], max_wait_ms=0)
+
+    assert batcher(41, timeout=5) == 42
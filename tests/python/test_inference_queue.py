@@ -0,0 +1,150 @@
+"""InferenceQueue priority lanes, aging, backpressure and per-tenant fair share"""
+
+import threading
+import time
+
+import pytest
+
+from inference_queue import InferenceQueue, QueueFullError
+
+
+class Recorder:
+    """Single-worker handler: holds the worker on 'blocker' so later submissions queue up"""
+
+    def __init__(self):
+        self.order = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, payload):
+        if payload == 'blocker':
+            self.started.set()
+            self.release.wait(5)
+            return payload
+        self.order.append(payload)
+        return payload
+
+
+def held_queue(recorder, **kwargs):
+    queue = InferenceQueue(recorder, workers=1, **kwargs)
+    queue.submit('blocker')
+    assert recorder.started.wait(5)
+    return queue
+
+
+def drain(recorder, futures):
+    recorder.release.set()
+    for future in futures:
+        future.result(timeout=5)
+    return recorder.order
+
+
+def test_higher_priority_lane_is_served_first():
+    recorder = Recorder()
+    queue = held_queue(recorder, lanes=[('interactive', 10), ('bulk', 10)], aging_seconds=1000)
+    futures = [queue.submit(payload, lane=lane) for payload, lane in
+               [('b1', 'bulk'), ('b2', 'bulk'), ('i1', 'interactive'), ('i2', 'interactive')]]
+
+    assert drain(recorder, futures) == ['i1', 'i2', 'b1', 'b2']
+
+
+def test_aging_lets_a_waiting_lower_lane_go_first():
+    recorder = Recorder()
+    queue = held_queue(recorder, lanes=[('interactive', 10), ('bulk', 10)], aging_seconds=0.05)
+    futures = [queue.submit('b1', lane='bulk')]
+    time.sleep(0.2)
+    futures.append(queue.submit('i1', lane='interactive'))
+
+    assert drain(recorder, futures) == ['b1', 'i1']
+
+
+def test_full_lane_raises_with_retry_after():
+    recorder = Recorder()
+    queue = held_queue(recorder, lanes=[('interactive', 1), ('bulk', 1)])
+    futures = [queue.submit('b1', lane='bulk')]
+
+    with pytest.raises(QueueFullError) as raised:
+        queue.submit('b2', lane='bulk')
+    assert raised.value.lane == 'bulk'
+    assert raised.value.tenant is None
+    assert 1 <= raised.value.retry_after <= 60
+    # Other lanes keep their own capacity
+    futures.append(queue.submit('i1', lane='interactive'))
+
+    drain(recorder, futures)
+    assert queue.stats()['rejected'] == 1
+
+
+def test_unknown_lane_is_rejected():
+    queue = InferenceQueue(lambda payload: payload, lanes=[('interactive', 1)])
+
+    with pytest.raises(ValueError, match='Unknown lane'):
+        queue.submit('x', lane='missing')
+
+
+def test_handler_errors_reach_the_caller():
+    def handler(payload):
+        raise RuntimeError(f'failed {payload}')
+
+    queue = InferenceQueue(handler, workers=1)
+
+    with pytest.raises(RuntimeError, match='failed x'):
+        queue.submit('x').result(timeout=5)
+
+
+def test_tenants_are_served_in_proportion_to_their_weights():
+    recorder = Recorder()
+    queue = held_queue(recorder, tenant_weights={'heavy': 2})
+    futures = [queue.submit(f'heavy{index}', tenant='heavy') for index in range(6)]
+    futures += [queue.submit(f'light{index}', tenant='light') for index in range(3)]
+
+    order = drain(recorder, futures)
+
+    # Deficit round-robin: two heavy items per light one, each tenant in FIFO order
+    assert order == ['heavy0', 'heavy1', 'light0', 'heavy2', 'heavy3', 'light1', 'heavy4', 'heavy5', 'light2']
+
+
+def test_a_backlogged_tenant_does_not_delay_a_new_one():
+    recorder = Recorder()
+    queue = held_queue(recorder)
+    futures = [queue.submit(f'bulk{index}', tenant='bulk_uploader') for index in range(20)]
+    futures.append(queue.submit('single', tenant='other_model'))
+
+    order = drain(recorder, futures)
+
+    assert order.index('single') <= 2
+
+
+def test_tenant_share_caps_one_tenant_within_a_lane():
+    recorder = Recorder()
+    queue = held_queue(recorder, max_depth=4, tenant_share=0.5)
+    futures = [queue.submit(index, tenant=1) for index in range(2)]
+
+    with pytest.raises(QueueFullError) as raised:
+        queue.submit(2, tenant=1)
+    assert raised.value.tenant == '1'
+    # Tenant ids (model_id) are keyed as strings; other tenants still get in
+    futures.append(queue.submit('other', tenant=2))
+
+    drain(recorder, futures)
+    assert queue.stats()['tenants']['1']['rejected'] == 1
+
+
+def test_idle_tenant_counters_are_folded_into_other():
+    queue = InferenceQueue(lambda payload: payload, workers=1, max_tenants=3)
+    for model_id in range(10):
+        assert queue.submit(model_id, tenant=model_id).result(timeout=5) == model_id
+
+    tenants = queue.stats()['tenants']
+    assert len(tenants) <= 3
+    assert '9' in tenants and 'other' in tenants
+    assert sum(counter['submitted'] for counter in tenants.values()) == 10
+
+
+def test_tenants_with_queued_work_keep_their_counters():
+    recorder = Recorder()
+    queue = held_queue(recorder, max_depth=20, max_tenants=2)
+    futures = [queue.submit(model_id, tenant=model_id) for model_id in range(4)]
+
+    assert {'0', '1', '2', '3'} <= set(queue.stats()['tenants'])
+    drain(recorder, futures)
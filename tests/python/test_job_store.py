@@ -0,0 +1,255 @@
+"""JobStore claiming, requeueing and callback claiming; callback URL validation"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from job_store import COMPLETED, FAILED, QUEUED, RUNNING, JobRunner, JobStore, validate_callback_url
+
+CALLBACK_URL = 'https://hooks.example.com/moderation'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.db'))
+
+
+def finished_job(store, callback_url=CALLBACK_URL, status=200):
+    job_id = store.submit(b'image', {'context_type': 'public_gallery'}, callback_url)
+    store.claim('worker')
+    store.complete(job_id, {'success': status < 400}, status)
+    return job_id
+
+
+def test_claim_takes_oldest_queued_job_once(store):
+    first = store.submit(b'one', {'model_id': '1'})
+    second = store.submit(b'two', {'model_id': '2'})
+
+    assert store.claim('worker-a') == (first, b'one', {'model_id': '1'})
+    assert store.claim('worker-b')[0] == second
+    assert store.claim('worker-c') is None
+    assert store.get(first)['status'] == RUNNING
+    assert store.get(first)['attempts'] == 1
+
+
+def test_concurrent_claims_never_share_a_job(store):
+    job_ids = {store.submit(b'image', {}) for _ in range(40)}
+    claimed, lock = [], threading.Lock()
+
+    def claim_all(worker):
+        while True:
+            job = store.claim(worker)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job[0])
+
+    threads = [threading.Thread(target=claim_all, args=(f'worker-{index}',)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_complete_records_result_and_drops_image(store):
+    job_id = store.submit(b'image', {})
+    store.claim('worker')
+    store.complete(job_id, {'success': True, 'moderation_decision': {'status': 'auto_approved'}}, 200)
+
+    job = store.get(job_id)
+    assert job['status'] == COMPLETED
+    assert job['result']['moderation_decision']['status'] == 'auto_approved'
+    image = store._connection().execute('SELECT image FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+    assert image is None
+
+
+def test_error_response_completes_as_failed(store):
+    job_id = store.submit(b'image', {})
+    store.claim('worker')
+    store.complete(job_id, {'success': False, 'error': 'bad image'}, 400)
+
+    assert store.get(job_id)['status'] == FAILED
+
+
+def test_fail_requeues_until_attempts_run_out(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), max_attempts=2)
+    job_id = store.submit(b'image', {})
+
+    store.claim('worker')
+    store.fail(job_id, 'model crashed')
+    assert store.get(job_id)['status'] == QUEUED
+
+    store.claim('worker')
+    store.fail(job_id, 'model crashed again')
+    job = store.get(job_id)
+    assert job['status'] == FAILED
+    assert job['attempts'] == 2
+    assert job['error'] == 'model crashed again'
+
+
+def test_expired_lease_is_requeued(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), lease_seconds=-1)
+    job_id = store.submit(b'image', {})
+    store.claim('other-host:1')
+
+    assert store.requeue_stale() == 1
+    assert store.get(job_id)['status'] == QUEUED
+
+
+def test_job_that_keeps_killing_its_worker_fails(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), lease_seconds=-1, max_attempts=2)
+    job_id = store.submit(b'image', {}, CALLBACK_URL)
+
+    store.claim('other-host:1')
+    store.requeue_stale()
+    assert store.get(job_id)['status'] == QUEUED
+
+    store.claim('other-host:1')
+    store.requeue_stale()
+    job = store.get(job_id)
+    assert job['status'] == FAILED
+    assert job['attempts'] == 2
+    assert job['error'].startswith('worker died')
+    assert store.claim('worker') is None
+    # The caller is still told about the failure
+    assert [job['job_id'] for job in store.claim_callbacks()[CALLBACK_URL]] == [job_id]
+
+
+def test_job_of_dead_local_worker_is_requeued(store):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    job_id = store.submit(b'image', {})
+    store.claim(f'{socket.gethostname()}:{exited.pid}')
+
+    assert store.requeue_stale() == 1
+    assert store.get(job_id)['status'] == QUEUED
+
+
+def test_live_worker_keeps_its_job(store):
+    store.submit(b'image', {})
+    store.claim(f'{socket.gethostname()}:{os.getpid()}')
+
+    assert store.requeue_stale() == 0
+
+
+def test_claim_callbacks_groups_by_url_and_claims_once(store):
+    first = finished_job(store)
+    second = finished_job(store)
+    other = finished_job(store, callback_url='https://other.example.com/hook', status=500)
+    store.submit(b'image', {}, CALLBACK_URL)  # still queued: nothing to deliver yet
+
+    batches = store.claim_callbacks()
+
+    assert {job['job_id'] for job in batches[CALLBACK_URL]} == {first, second}
+    assert [job['job_id'] for job in batches['https://other.example.com/hook']] == [other]
+    assert store.get(first)['callback_state'] == 'sending'
+    # A second scanner (another pre-forked worker) finds nothing while the lease holds
+    assert store.claim_callbacks() == {}
+
+
+def test_expired_callback_lease_is_claimed_again(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), callback_lease_seconds=0)
+    job_id = finished_job(store)
+    store.claim_callbacks()
+    time.sleep(0.01)
+
+    assert [job['job_id'] for job in store.claim_callbacks()[CALLBACK_URL]] == [job_id]
+
+
+def test_failed_delivery_backs_off_then_gives_up(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), max_callback_attempts=2)
+    job_id = finished_job(store)
+
+    store.claim_callbacks()
+    store.mark_callbacks([job_id], delivered=False)
+    assert store.get(job_id)['callback_state'] == 'pending'
+    assert store.claim_callbacks() == {}  # backing off
+
+    store._connection().execute('UPDATE jobs SET next_callback_at = 0 WHERE id = ?', (job_id,))
+    store.claim_callbacks()
+    store.mark_callbacks([job_id], delivered=False)
+    assert store.get(job_id)['callback_state'] == 'failed'
+
+
+def test_mark_ignores_rows_not_claimed_for_sending(store):
+    job_id = finished_job(store)
+
+    store.mark_callbacks([job_id], delivered=True)
+
+    assert store.get(job_id)['callback_state'] == 'pending'
+    store.claim_callbacks()
+    store.mark_callbacks([job_id], delivered=True)
+    assert store.get(job_id)['callback_state'] == 'sent'
+    assert store.stats()['pending_callbacks'] == 0
+
+
+@pytest.mark.parametrize('url', [
+    'file:///etc/passwd',
+    'ftp://hooks.example.com/x',
+    'gopher://hooks.example.com/',
+    'http://',
+    'not a url',
+])
+def test_non_http_callback_urls_are_rejected(store, url):
+    with pytest.raises(ValueError):
+        store.submit(b'image', {}, url)
+
+
+def test_callback_allow_list():
+    allowed = ['hooks.example.com', '.internal.example.net']
+
+    assert validate_callback_url(CALLBACK_URL, allowed) == CALLBACK_URL
+    assert validate_callback_url('http://api.internal.example.net/hook', allowed)
+    with pytest.raises(ValueError, match='not allowed'):
+        validate_callback_url('http://169.254.169.254/latest/meta-data', allowed)
+    with pytest.raises(ValueError, match='not allowed'):
+        validate_callback_url('https://evilhooks.example.com/', allowed)
+
+
+@pytest.mark.parametrize('url', [
+    'http://169.254.169.254/latest/meta-data',
+    'http://127.0.0.1:8080/admin',
+    'http://localhost/',
+    'http://10.0.0.5/hook',
+    'http://192.168.1.1/',
+    'http://[::1]/',
+    'http://[::ffff:172.16.0.1]/',
+])
+def test_without_allow_list_internal_hosts_are_rejected(store, url, monkeypatch):
+    monkeypatch.setattr('job_store.CALLBACK_ALLOWED_HOSTS', [])
+
+    with pytest.raises(ValueError):
+        store.submit(b'image', {}, url)
+
+
+def test_without_allow_list_names_are_resolved_at_delivery(monkeypatch):
+    resolved = {'hooks.example.com': '93.184.216.34', 'rebound.example.com': '10.0.0.5'}
+    monkeypatch.setattr('socket.getaddrinfo',
+                        lambda host, port, **kwargs: [(None, None, None, '', (resolved[host], port or 80))])
+
+    assert validate_callback_url(CALLBACK_URL, [], resolve=True) == CALLBACK_URL
+    # Accepted when queued, refused when the name points inside the network
+    assert validate_callback_url('http://rebound.example.com/hook', [])
+    with pytest.raises(ValueError, match='non-public address 10.0.0.5'):
+        validate_callback_url('http://rebound.example.com/hook', [], resolve=True)
+
+
+def test_runner_processes_submitted_jobs(store):
+    runner = JobRunner(store, handler=lambda image, form: ({'success': True, 'size': len(image)}, 200),
+                       workers=1, poll_interval=0.05)
+    assert not runner.started
+
+    job_id = runner.submit(b'12345', {})
+    assert runner.started
+    deadline = time.monotonic() + 5
+    while store.get(job_id)['status'] != COMPLETED and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert store.get(job_id)['result'] == {'success': True, 'size': 5}
@@ -0,0 +1,100 @@
+"""pHash, BK-tree search and PerceptualIndex reuse rules"""
+
+import cv2
+import numpy as np
+
+from perceptual_index import BKTree, PerceptualIndex, hamming_distance, phash
+
+
+def textured_image(seed=0, size=256):
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 255, size=(8, 8, 3)).astype(np.uint8)
+    return cv2.resize(blocks, (size, size), interpolation=cv2.INTER_LINEAR)
+
+
+def decision(status):
+    return {'success': True, 'moderation_decision': {'status': status}, 'metadata': {}}
+
+
+def test_phash_is_stable_under_resize_and_recompression():
+    image = textured_image()
+    resized = cv2.resize(image, (180, 180), interpolation=cv2.INTER_AREA)
+    _, encoded = cv2.imencode('.jpg', cv2.cvtColor(image, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 40])
+    recompressed = cv2.cvtColor(cv2.imdecode(encoded, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+
+    assert hamming_distance(phash(image), phash(resized)) <= 6
+    assert hamming_distance(phash(image), phash(recompressed)) <= 6
+
+
+def test_phash_separates_different_images():
+    assert hamming_distance(phash(textured_image(0)), phash(textured_image(1))) > 10
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = np.random.default_rng(3)
+    hashes = [int(value) for value in rng.integers(0, 2 ** 63, size=300, dtype=np.int64)]
+    tree = BKTree()
+    for index, hash_value in enumerate(hashes):
+        tree.add(hash_value, index)
+    query = hashes[17] ^ 0b1011  # three bits away from a stored hash
+
+    found = tree.search(query, radius=8)
+
+    expected = sorted((hamming_distance(query, h), h) for h in set(hashes) if hamming_distance(query, h) <= 8)
+    assert [(distance, hash_value) for distance, hash_value, _ in found] == expected
+    assert found[0][:2] == (3, hashes[17])
+
+
+def test_bk_tree_replaces_identical_hash():
+    tree = BKTree()
+    tree.add(42, 'first')
+    tree.add(42, 'second')
+
+    assert tree.size == 1
+    assert tree.search(42, 0) == [(0, 42, 'second')]
+
+
+def test_near_duplicate_reuses_prior_result_within_scope():
+    index = PerceptualIndex(max_distance=6, blocklist_distance=10)
+    index.add('scope', 0b0, decision('auto_approved'))
+
+    prior, match = index.lookup('scope', 0b111)
+
+    assert prior == decision('auto_approved')
+    assert match['match_type'] == 'near_duplicate'
+    assert match['distance'] == 3
+    assert index.lookup('other scope', 0b111) is None
+
+
+def test_only_rejected_results_match_at_blocklist_distance():
+    index = PerceptualIndex(max_distance=2, blocklist_distance=10)
+    index.add('scope', 0, decision('auto_approved'))
+    index.add('scope', 0xffffffff00000000, decision('auto_rejected'))
+
+    # Eight bits from one entry and 40 from the other: too far for reuse, close
+    # enough to block a re-post of rejected content
+    assert index.lookup('scope', 0xff) is None
+    prior, match = index.lookup('scope', 0xffffffff000000ff)
+    assert match['match_type'] == 'blocklist'
+    assert prior['moderation_decision']['status'] == 'auto_rejected'
+    assert index.stats()['blocklist_hits'] == 1
+
+
+def test_lookup_returns_independent_copies():
+    index = PerceptualIndex()
+    index.add('scope', 1, decision('auto_approved'))
+
+    prior, _ = index.lookup('scope', 1)
+    prior['metadata']['model_id'] = 9
+
+    assert index.lookup('scope', 1)[0] == decision('auto_approved')
+
+
+def test_compaction_drops_oldest_entries():
+    index = PerceptualIndex(max_distance=0, blocklist_distance=0, max_entries=8)
+    for hash_value in range(9):
+        index.add('scope', 1 << hash_value, decision('auto_approved'))
+
+    assert index.stats()['entries'] == 7
+    assert index.lookup('scope', 1 << 0) is None
+    assert index.lookup('scope', 1 << 8) is not None
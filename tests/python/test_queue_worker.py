@@ -0,0 +1,134 @@
+"""ai-moderation ModerationQueue and QueueWorker on the SQLite stand-in"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# ai-moderation/ is its own build context and imports its siblings by name
+AI_MODERATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ai-moderation')
+if AI_MODERATION_DIR not in sys.path:
+    sys.path.insert(0, AI_MODERATION_DIR)
+
+import queue_worker  # noqa: E402
+from moderation_result import ModerationResult  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'moderation.db')
+
+
+@pytest.fixture
+def queue(db_path):
+    queue = queue_worker.ModerationQueue.sqlite(db_path, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def rows(db_path, query):
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute(query).fetchall()
+    finally:
+        connection.close()
+
+
+def moderation_result(image_path, status='approved'):
+    return ModerationResult(
+        image_path=image_path, context_type='public_gallery', model_id=1,
+        nudity_score=12.5, detected_parts={'FACE_FEMALE': 80.0},
+        pose_classification='neutral', explicit_pose_score=0.0, pose_keypoints=None,
+        generated_caption='a person outdoors', policy_violations=[],
+        moderation_status=status, human_review_required=False, confidence_score=0.9)
+
+
+def test_claim_marks_a_batch_processing_in_id_order(queue, db_path):
+    queue.enqueue([(f'/uploads/{index}.jpg', 1, 'public_gallery') for index in range(5)])
+
+    first = queue.claim(3, 'worker-a')
+    second = queue.claim(3, 'worker-b')
+
+    assert [row[1] for row in first] == ['/uploads/0.jpg', '/uploads/1.jpg', '/uploads/2.jpg']
+    assert [row[1] for row in second] == ['/uploads/3.jpg', '/uploads/4.jpg']
+    assert queue.claim(3, 'worker-c') == []
+    assert rows(db_path, "SELECT DISTINCT status, attempts FROM moderation_requests") == [('processing', 1)]
+    assert rows(db_path, "SELECT claimed_by FROM moderation_requests WHERE id = 1") == [('worker-a',)]
+
+
+def test_complete_writes_results_and_requeues_failures(queue, db_path):
+    queue.enqueue([('/uploads/ok.jpg', 1, 'public_gallery'), ('/uploads/bad.jpg', 1, 'public_gallery')])
+    (ok_id, ok_path, _, _), (bad_id, _, _, _) = queue.claim(10, 'worker')
+
+    queue.complete([(ok_id, moderation_result(ok_path))], [(bad_id, 'decode failed')])
+
+    assert rows(db_path, "SELECT id, status, moderation_status, error FROM moderation_requests ORDER BY id") == [
+        (ok_id, 'completed', 'approved', None),
+        (bad_id, 'pending', None, 'decode failed')
+    ]
+    assert rows(db_path, "SELECT image_path, nudity_score, detected_parts FROM content_moderation") == [
+        ('/uploads/ok.jpg', 12.5, '{"FACE_FEMALE": 80.0}')
+    ]
+
+
+def test_failure_after_max_attempts_is_final(queue, db_path):
+    queue.enqueue([('/uploads/bad.jpg', 1, 'public_gallery')])
+    for _ in range(2):
+        (request_id, _, _, _), = queue.claim(1, 'worker')
+        queue.complete([], [(request_id, 'decode failed')])
+
+    assert rows(db_path, "SELECT status, attempts FROM moderation_requests") == [('failed', 2)]
+    assert queue.claim(1, 'worker') == []
+
+
+def test_stale_claims_are_released(queue, db_path):
+    queue.enqueue([('/uploads/a.jpg', 1, 'public_gallery'), ('/uploads/b.jpg', 1, 'public_gallery')])
+    queue.claim(2, 'dead-worker')
+    connection = sqlite3.connect(db_path)
+    connection.execute("UPDATE moderation_requests SET claimed_at = datetime('now', '-2 hours') WHERE id = 1")
+    connection.commit()
+    connection.close()
+
+    assert queue.requeue_stale() == 1
+    assert rows(db_path, "SELECT id, status, claimed_by FROM moderation_requests ORDER BY id") == [
+        (1, 'pending', None),
+        (2, 'processing', 'dead-worker')
+    ]
+
+
+def test_failed_transaction_rolls_back_and_reconnects(queue, db_path):
+    queue.enqueue([('/uploads/a.jpg', 1, 'public_gallery')])
+
+    with pytest.raises(sqlite3.Error):
+        queue._transaction(lambda cursor: cursor.execute('SELECT * FROM missing_table'))
+    assert queue.connection is None
+
+    assert len(queue.claim(1, 'worker')) == 1
+
+
+class FakeModerator:
+    def __init__(self):
+        self.batches = []
+
+    def moderate_batch(self, items):
+        self.batches.append(items)
+        return [moderation_result(image_path) for image_path, _, _ in items]
+
+
+def test_worker_moderates_a_batch_and_fails_missing_files(queue, db_path, tmp_path):
+    image_path = tmp_path / 'present.jpg'
+    image_path.write_bytes(b'not decoded by the fake moderator')
+    queue.enqueue([(str(image_path), 7, 'profile_pic'), (str(tmp_path / 'missing.jpg'), 7, 'profile_pic')])
+    moderator = FakeModerator()
+    worker = queue_worker.QueueWorker(moderator, queue, batch_size=8)
+
+    worker.run(once=True)
+
+    assert moderator.batches == [[(str(image_path), 'profile_pic', 7)]]
+    # The missing file is retried until it runs out of attempts
+    assert (worker.processed, worker.failed) == (1, 2)
+    statuses = rows(db_path, "SELECT status, error FROM moderation_requests ORDER BY id")
+    assert statuses[0] == ('completed', None)
+    assert statuses[1][0] == 'failed'
+    assert statuses[1][1].startswith('image not found')
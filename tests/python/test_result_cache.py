@@ -0,0 +1,84 @@
+"""ResultCache keys, LRU bounds and the SQLite tier"""
+
+from result_cache import ResultCache, canonical_hash
+
+CONFIG = {'nudenet_components': {'breast_detection': True}, 'cascade': {'enabled': True}}
+MODELS = {'analysis': '4.0_configurable', 'nudenet': 'onnx-320n'}
+
+
+def result(status='auto_approved'):
+    return {'success': True, 'moderation_decision': {'status': status}, 'metadata': {}}
+
+
+def test_canonical_hash_ignores_key_order():
+    assert canonical_hash({'a': 1, 'b': {'c': 2, 'd': 3}}) == canonical_hash({'b': {'d': 3, 'c': 2}, 'a': 1})
+    assert canonical_hash({'a': 1}) != canonical_hash({'a': 2})
+
+
+def test_key_changes_with_image_config_models_and_scope():
+    key = ResultCache.make_key(b'image', CONFIG, MODELS, context_type='public_gallery')
+
+    assert key == ResultCache.make_key(b'image', dict(reversed(list(CONFIG.items()))), MODELS,
+                                       context_type='public_gallery')
+    assert key != ResultCache.make_key(b'other image', CONFIG, MODELS, context_type='public_gallery')
+    assert key != ResultCache.make_key(b'image', dict(CONFIG, cascade={'enabled': False}), MODELS,
+                                       context_type='public_gallery')
+    assert key != ResultCache.make_key(b'image', CONFIG, dict(MODELS, nudenet='onnx-640m'),
+                                       context_type='public_gallery')
+    assert key != ResultCache.make_key(b'image', CONFIG, MODELS, context_type='profile_pic')
+
+
+def test_get_returns_independent_copies():
+    cache = ResultCache()
+    cache.put('key', result())
+
+    first = cache.get('key')
+    first['metadata']['model_id'] = 7
+
+    assert cache.get('key') == result()
+    assert cache.stats()['hits']['memory'] == 2
+
+
+def test_miss_is_counted():
+    cache = ResultCache()
+
+    assert cache.get('absent') is None
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hit_rate'] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', result())
+    cache.put('b', result())
+    cache.get('a')
+    cache.put('c', result())
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_byte_budget_bounds_memory_tier():
+    entry_size = len('{"success":true,"moderation_decision":{"status":"auto_approved"},"metadata":{}}')
+    cache = ResultCache(max_entries=100, max_bytes=entry_size * 2)
+    for key in 'abc':
+        cache.put(key, result())
+
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['bytes'] <= entry_size * 2
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResultCache(sqlite_path=path).put('key', result('flagged_for_review'))
+
+    restarted = ResultCache(sqlite_path=path)
+
+    assert restarted.get('key') == result('flagged_for_review')
+    assert restarted.stats()['hits'] == {'memory': 0, 'disk': 1}
+    # Promoted into memory on the first disk hit
+    restarted.get('key')
+    assert restarted.stats()['hits'] == {'memory': 1, 'disk': 1}
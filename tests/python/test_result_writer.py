@@ -0,0 +1,182 @@
+"""ai-moderation ResultWriter journaling, replay, dead-lettering and shutdown flush"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+# ai-moderation/ is its own build context and imports its siblings by name
+AI_MODERATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ai-moderation')
+if AI_MODERATION_DIR not in sys.path:
+    sys.path.insert(0, AI_MODERATION_DIR)
+
+from result_writer import ResultWriter  # noqa: E402
+
+
+class FakeConnections:
+    """ConnectionManager stand-in recording committed rows
+
+    While down, every insert fails with a transient error; rows whose first
+    value is in rejected fail with an IntegrityError, like a foreign key miss.
+    """
+
+    def __init__(self, rejected=()):
+        self.rows = []
+        self.down = False
+        self.rejected = set(rejected)
+        self.fail_after = None  # transient failure once this many inserts succeeded
+        self.hold = None  # event the next insert waits on
+        self.inserts = 0
+
+    def get_connection(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, manager):
+        self.manager = manager
+
+    def cursor(self):
+        return self
+
+    def executemany(self, query, rows):
+        manager = self.manager
+        if manager.hold is not None:
+            hold, manager.hold = manager.hold, None
+            hold.wait(5)
+        if manager.down or (manager.fail_after is not None and manager.inserts >= manager.fail_after):
+            raise sqlite3.OperationalError('server has gone away')
+        if any(row[0] in manager.rejected for row in rows):
+            raise sqlite3.IntegrityError('foreign key constraint fails')
+        manager.inserts += 1
+        manager.rows.extend(list(row) for row in rows)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def rows(*names):
+    return [[name, 1] for name in names]
+
+
+@pytest.fixture
+def connections():
+    return FakeConnections(rejected={'bad'})
+
+
+@pytest.fixture
+def writer(connections, tmp_path):
+    return ResultWriter(connections, 'INSERT', batch_size=2, flush_interval=0.05,
+                        journal_path=str(tmp_path / 'journal.jsonl'), replay_interval=3600)
+
+
+def read_lines(path):
+    with open(path) as source:
+        return [json.loads(line) for line in source if line.strip()]
+
+
+def wait_for_in_flight(writer):
+    deadline = time.monotonic() + 5
+    while writer._in_flight is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer._in_flight is not None
+
+
+def submit_and_flush(writer, submitted):
+    for row in submitted:
+        writer.submit(row)
+    writer.flush()
+
+
+def test_rows_are_written_in_batches(writer, connections):
+    submit_and_flush(writer, rows('a', 'b', 'c'))
+
+    assert connections.rows == rows('a', 'b', 'c')
+    assert writer.stats()['written'] == 3
+    assert not os.path.exists(writer.journal_path)
+
+
+def test_outage_journals_rows_and_replay_inserts_them(writer, connections):
+    connections.down = True
+    submit_and_flush(writer, rows('a', 'b', 'c'))
+
+    assert connections.rows == []
+    assert read_lines(writer.journal_path) == rows('a', 'b', 'c')
+    assert writer.replay() == 0  # still down
+
+    connections.down = False
+    assert writer.replay() == 3
+    assert connections.rows == rows('a', 'b', 'c')
+    assert writer.stats()['journal_bytes'] == 0
+
+
+def test_replay_pauses_and_resumes_without_loss_or_reordering(writer, connections):
+    connections.down = True
+    submit_and_flush(writer, rows('a', 'b', 'c', 'd', 'e'))
+    connections.down = False
+    connections.fail_after = 1  # the first batch of 2 lands, then the database drops again
+
+    assert writer.replay() == 2
+    assert read_lines(f'{writer.journal_path}.replaying') == rows('c', 'd', 'e')
+
+    # Rows journaled while paused queue up behind the interrupted replay
+    connections.down = True
+    submit_and_flush(writer, rows('f'))
+    connections.down = False
+    connections.fail_after = None
+
+    assert writer.replay() == 4
+    assert connections.rows == rows('a', 'b', 'c', 'd', 'e', 'f')
+    assert not os.path.exists(f'{writer.journal_path}.replaying')
+
+
+def test_rejected_row_is_dead_lettered_and_the_rest_written(writer, connections):
+    submit_and_flush(writer, rows('a', 'bad', 'c'))
+
+    assert connections.rows == rows('a', 'c')
+    dead = read_lines(writer.dead_letter_path)
+    assert [entry['row'] for entry in dead] == rows('bad')
+    assert 'foreign key' in dead[0]['error']
+    assert not os.path.exists(writer.journal_path)
+
+
+def test_rejected_row_does_not_block_replay(writer, connections):
+    connections.down = True
+    submit_and_flush(writer, rows('a', 'bad', 'c'))
+    connections.down = False
+
+    assert writer.replay() == 2
+    assert connections.rows == rows('a', 'c')
+    assert writer.stats()['dead_lettered'] == 1
+    assert writer.stats()['journal_bytes'] == 0
+
+
+def test_flush_waits_for_the_batch_the_writer_holds(writer, connections):
+    hold = connections.hold = threading.Event()
+    writer.submit(rows('a')[0])
+    wait_for_in_flight(writer)
+    writer.submit(rows('b')[0])
+    threading.Timer(0.1, hold.set).start()
+
+    writer.flush()
+
+    assert connections.rows == rows('a', 'b')
+
+
+def test_flush_journals_a_hung_batch(writer, connections):
+    hold = connections.hold = threading.Event()
+    writer.submit(rows('a')[0])
+    wait_for_in_flight(writer)
+    writer.submit(rows('b')[0])
+
+    writer.flush(timeout=0.1)
+
+    assert read_lines(writer.journal_path) == rows('a', 'b')
+    hold.set()
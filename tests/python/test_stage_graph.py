@@ -0,0 +1,118 @@
+"""StageGraph ordering, gating and error propagation"""
+
+import threading
+
+import pytest
+
+from stage_graph import SKIPPED_STAGES, STAGE_TIMINGS, StageGraph
+
+
+def test_dependencies_receive_upstream_results():
+    graph = StageGraph('test')
+    graph.add('double', lambda x: x * 2, deps=['x'])
+    graph.add('plus_one', lambda double: double + 1, deps=['double'])
+
+    results = graph.run(x=5)
+
+    assert results['double'] == 10
+    assert results['plus_one'] == 11
+    assert results[SKIPPED_STAGES] == {}
+    assert set(results[STAGE_TIMINGS]) == {'double', 'plus_one'}
+
+
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    graph = StageGraph('test', max_workers=2)
+    # Each stage waits for the other; run() only returns if both are in flight at once
+    graph.add('left', lambda: barrier.wait() is not None)
+    graph.add('right', lambda: barrier.wait() is not None)
+
+    results = graph.run()
+
+    assert results['left'] and results['right']
+
+
+def test_gate_skips_stage_with_reason_and_on_skip_result():
+    calls = []
+    graph = StageGraph('test')
+    graph.add('score', lambda x: x, deps=['x'])
+    graph.add('expensive', lambda x: calls.append(x) or 'ran', deps=['x'],
+              gate=lambda score: 'score_too_high' if score > 50 else None, gate_deps=['score'],
+              on_skip=lambda reason: {'skipped': reason})
+    graph.add('final', lambda expensive: expensive, deps=['expensive'])
+
+    results = graph.run(x=90)
+
+    assert calls == []
+    assert results[SKIPPED_STAGES] == {'expensive': 'score_too_high'}
+    assert results['expensive'] == {'skipped': 'score_too_high'}
+    # Dependents of a skipped stage still run, on the on_skip result
+    assert results['final'] == {'skipped': 'score_too_high'}
+    assert 'expensive' not in results[STAGE_TIMINGS]
+
+
+def test_gate_returning_none_runs_stage():
+    graph = StageGraph('test')
+    graph.add('score', lambda x: x, deps=['x'])
+    graph.add('expensive', lambda x: 'ran', deps=['x'],
+              gate=lambda score: 'score_too_high' if score > 50 else None, gate_deps=['score'])
+
+    results = graph.run(x=10)
+
+    assert results['expensive'] == 'ran'
+    assert results[SKIPPED_STAGES] == {}
+
+
+def test_skipped_stage_without_on_skip_resolves_to_none():
+    graph = StageGraph('test')
+    graph.add('optional', lambda: 'ran', gate=lambda: 'disabled')
+
+    results = graph.run()
+
+    assert results['optional'] is None
+    assert results[SKIPPED_STAGES] == {'optional': 'disabled'}
+
+
+def test_missing_input_is_rejected_before_running():
+    graph = StageGraph('test')
+    graph.add('needs_x', lambda x: x, deps=['x'])
+
+    with pytest.raises(ValueError, match='missing inputs'):
+        graph.run()
+
+
+def test_duplicate_stage_name_is_rejected():
+    graph = StageGraph('test')
+    graph.add('stage', lambda: None)
+
+    with pytest.raises(ValueError, match='already registered'):
+        graph.add('stage', lambda: None)
+
+
+def test_dependency_cycle_is_reported():
+    graph = StageGraph('test')
+    graph.add('a', lambda b: b, deps=['b'])
+    graph.add('b', lambda a: a, deps=['a'])
+
+    with pytest.raises(ValueError, match='dependency cycle'):
+        graph.run()
+
+
+def test_stage_exception_is_reraised_after_siblings_finish():
+    sibling_done = threading.Event()
+
+    def slow_sibling():
+        sibling_done.wait(0.2)
+        sibling_done.set()
+        return 'done'
+
+    def failing():
+        raise RuntimeError('boom')
+
+    graph = StageGraph('test', max_workers=2)
+    graph.add('failing', failing)
+    graph.add('sibling', slow_sibling)
+
+    with pytest.raises(RuntimeError, match='boom'):
+        graph.run()
+    assert sibling_done.is_set()
@@ -0,0 +1,112 @@
+"""Shared upload path confinement and request parsing"""
+
+import io
+import os
+
+import pytest
+from flask import Flask, request
+
+import upload_buffer
+from upload_buffer import request_image, request_params, resolve_shared_path
+
+app = Flask(__name__)
+
+
+@pytest.fixture
+def upload_root(tmp_path, monkeypatch):
+    root = tmp_path / 'uploads'
+    (root / 'model-1' / 'originals').mkdir(parents=True)
+    (root / 'model-1' / 'originals' / 'photo.jpg').write_bytes(b'image bytes')
+    (tmp_path / 'secret.txt').write_text('outside the root')
+    monkeypatch.setattr(upload_buffer, 'SHARED_UPLOAD_ROOT', str(root))
+    return root
+
+
+def test_relative_and_absolute_paths_inside_root_resolve(upload_root):
+    expected = os.path.realpath(upload_root / 'model-1' / 'originals' / 'photo.jpg')
+
+    assert resolve_shared_path('model-1/originals/photo.jpg') == expected
+    assert resolve_shared_path(str(upload_root / 'model-1' / 'originals' / 'photo.jpg')) == expected
+
+
+@pytest.mark.parametrize('image_path', [
+    '../secret.txt',
+    'model-1/../../secret.txt',
+    '/etc/passwd',
+])
+def test_paths_outside_root_are_refused(upload_root, image_path):
+    with pytest.raises(PermissionError, match='outside the shared upload root'):
+        resolve_shared_path(image_path)
+
+
+def test_sibling_directory_sharing_the_root_prefix_is_refused(upload_root):
+    sibling = upload_root.parent / 'uploads-other'
+    sibling.mkdir()
+    (sibling / 'photo.jpg').write_bytes(b'image bytes')
+
+    with pytest.raises(PermissionError):
+        resolve_shared_path(str(sibling / 'photo.jpg'))
+
+
+def test_symlink_escaping_the_root_is_refused(upload_root):
+    (upload_root / 'link.txt').symlink_to(upload_root.parent / 'secret.txt')
+
+    with pytest.raises(PermissionError):
+        resolve_shared_path('link.txt')
+
+
+def test_missing_file_inside_root(upload_root):
+    with pytest.raises(FileNotFoundError):
+        resolve_shared_path('model-1/originals/missing.jpg')
+
+
+def test_image_path_needs_a_configured_root(monkeypatch):
+    monkeypatch.setattr(upload_buffer, 'SHARED_UPLOAD_ROOT', None)
+
+    with pytest.raises(PermissionError, match='SHARED_UPLOAD_ROOT'):
+        resolve_shared_path('/etc/passwd')
+
+
+def test_request_image_reads_shared_path_from_json_body(upload_root):
+    body = {'image_path': 'model-1/originals/photo.jpg', 'model_id': 3, 'context_type': 'profile_pic'}
+    with app.test_request_context('/analyze', method='POST', json=body):
+        image_bytes, params = request_image(request)
+
+    assert image_bytes == b'image bytes'
+    assert params['model_id'] == '3'
+    assert params['context_type'] == 'profile_pic'
+
+
+def test_request_image_refuses_escaping_json_path(upload_root):
+    with app.test_request_context('/analyze', method='POST', json={'image_path': '../secret.txt'}):
+        with pytest.raises(PermissionError):
+            request_image(request)
+
+
+def test_raw_body_takes_parameters_from_headers_and_query():
+    with app.test_request_context('/analyze?model_id=5', method='POST', data=b'raw image',
+                                  content_type='application/octet-stream',
+                                  headers={'X-Moderation-Context-Type': 'private_content'}):
+        image_bytes, params = request_image(request)
+
+    assert image_bytes == b'raw image'
+    assert params == {'context_type': 'private_content', 'model_id': '5'}
+
+
+def test_multipart_file_is_read_from_memory():
+    with app.test_request_context('/analyze', method='POST', content_type='multipart/form-data',
+                                  data={'image': (io.BytesIO(b'uploaded'), 'photo.jpg'), 'model_id': '2'}):
+        image_bytes, params = request_image(request)
+
+    assert image_bytes == b'uploaded'
+    assert params['model_id'] == '2'
+
+
+@pytest.mark.parametrize('body, error', [
+    ('[{"image_path": "x"}]', 'must be an object'),
+    ('{"image_path": ', 'Invalid JSON'),
+])
+def test_bad_json_bodies_raise_value_error(body, error):
+    with app.test_request_context('/analyze', method='POST', data=body, content_type='application/json'):
+        with pytest.raises(ValueError, match=error):
+            request_params(request)
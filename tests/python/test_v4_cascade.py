@@ -0,0 +1,119 @@
+"""v4 cascade: child analysis is never skipped while child detection is enabled"""
+
+import copy
+from functools import partial
+
+import pytest
+
+from stage_graph import SKIPPED_STAGES, StageGraph
+
+CONTEXT_TYPES = ['profile_pic', 'public_gallery', 'premium_gallery', 'private_content', 'unknown_context']
+EXPLICIT = {'nudity_score': 99.0, 'explicit_nudity_score': 99.0}
+
+
+@pytest.fixture(scope='module')
+def api(tmp_path_factory):
+    # Importing the server builds its global API (NudeNet engine, job store)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('JOB_DB', str(tmp_path_factory.mktemp('jobs') / 'jobs.db'))
+        patch.setenv('PHASH_INDEX_ENABLED', 'false')
+        module = pytest.importorskip('enhanced_minimal_v4_configurable')
+    return module.api
+
+
+@pytest.fixture
+def config(api):
+    return copy.deepcopy(api.config_manager.default_config)
+
+
+def cascade_graph(api, child_calls):
+    """The v4 cascade gates around stand-in stages"""
+    graph = StageGraph('test_cascade')
+    graph.add('nudity_detection', lambda: EXPLICIT)
+    graph.add('image_description', lambda: {'description': 'a photo'},
+              gate=partial(api._cascade_skip_reason, 'image_description'),
+              gate_deps=['nudity_detection', 'config', 'context_type'], on_skip=api._skipped_description)
+    graph.add('child_analysis', lambda image_description: child_calls.append(image_description) or {},
+              deps=['image_description'],
+              gate=partial(api._cascade_skip_reason, 'child_analysis'),
+              gate_deps=['nudity_detection', 'config', 'context_type'], on_skip=api._skipped_child_analysis)
+    return graph
+
+
+@pytest.mark.parametrize('context_type', CONTEXT_TYPES)
+def test_child_analysis_and_prerequisites_are_mandatory(api, config, context_type):
+    mandatory = api.config_manager.context_policy(config, context_type)['mandatory_stages']
+
+    assert 'child_analysis' in mandatory
+    assert 'image_description' in mandatory
+
+
+@pytest.mark.parametrize('context_type', CONTEXT_TYPES)
+def test_policy_edit_cannot_drop_child_analysis(api, config, context_type):
+    for policy in config['context_policies'].values():
+        policy['mandatory_stages'] = []
+
+    mandatory = api.config_manager.context_policy(config, context_type)['mandatory_stages']
+
+    assert 'child_analysis' in mandatory
+
+
+@pytest.mark.parametrize('context_type', CONTEXT_TYPES)
+@pytest.mark.parametrize('enforce_limit', [False, True])
+def test_cascade_runs_child_analysis_at_any_nudity(api, config, context_type, enforce_limit):
+    config['enforce_context_nudity_limit'] = enforce_limit
+    child_calls = []
+
+    results = cascade_graph(api, child_calls).run(config=config, context_type=context_type)
+
+    assert results[SKIPPED_STAGES] == {}
+    assert child_calls == [{'description': 'a photo'}]
+
+
+def test_cascade_skips_when_child_detection_is_disabled(api, config):
+    config['blip_components']['child_content_detection'] = False
+    for policy in config['context_policies'].values():
+        policy['mandatory_stages'] = []
+    child_calls = []
+
+    results = cascade_graph(api, child_calls).run(config=config, context_type='public_gallery')
+
+    assert set(results[SKIPPED_STAGES]) == {'image_description', 'child_analysis'}
+    assert child_calls == []
+    assert results['child_analysis']['contains_children'] is False
+
+
+def test_context_nudity_limit_is_off_by_default(api, config):
+    config['blip_components']['child_content_detection'] = False
+    for policy in config['context_policies'].values():
+        policy['mandatory_stages'] = []
+    below_auto_reject = {'nudity_score': 50.0, 'explicit_nudity_score': 50.0}
+
+    assert api._cascade_skip_reason('image_description', below_auto_reject, config, 'profile_pic') is None
+
+    config['enforce_context_nudity_limit'] = True
+    assert api._cascade_skip_reason('image_description', below_auto_reject, config, 'profile_pic') is not None
+
+
+@pytest.mark.parametrize('enforce_limit, expected', [(False, 'auto_approved'), (True, 'auto_rejected')])
+def test_decision_applies_context_limit_only_when_enforced(api, config, enforce_limit, expected):
+    config['enforce_context_nudity_limit'] = enforce_limit
+    analysis = {
+        'combined_assessment': {'final_risk_score': 10},
+        'child_analysis': {'contains_children': False},
+        'nudity_detection': {'explicit_nudity_score': 50.0},
+        'metadata': {'context_type': 'profile_pic'}
+    }
+
+    assert api.make_moderation_decision(analysis, config)['status'] == expected
+
+
+def test_child_content_overrides_any_verdict(api, config):
+    analysis = {
+        'combined_assessment': {'final_risk_score': 99},
+        'child_analysis': {'contains_children': True},
+        'nudity_detection': EXPLICIT,
+        'metadata': {'context_type': 'private_content'}
+    }
+
+    assert api.make_moderation_decision(analysis, config)['status'] == 'flagged_for_review'
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+In-memory upload handling for the moderation servers
+Multipart file parts stay in memory up to UPLOAD_SPILL_THRESHOLD bytes and only
+spill to tmpfs (/dev/shm) above it, so analysis decodes straight from the
+request buffer instead of a temp file on disk.
+
+Same-host callers can skip multipart entirely: POST the encoded image as an
+application/octet-stream body with parameters in the query string or
+X-Moderation-* headers, or send image_path under SHARED_UPLOAD_ROOT and let
+the server read Node's upload directory itself. UNIX_SOCKET makes the servers
+listen on a Unix domain socket instead of TCP.
+"""
+
+import os
+import tempfile
+from typing import IO, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from flask import Request
+from werkzeug.datastructures import FileStorage
+
+# Default covers every upload the Node tier sends (MAX_CONTENT_LENGTH is 16MB)
+UPLOAD_SPILL_THRESHOLD = int(os.getenv('UPLOAD_SPILL_THRESHOLD', str(16 * 1024 * 1024)))
+UPLOAD_SPILL_DIR = os.getenv('UPLOAD_SPILL_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+# Raw-body requests carry their parameters as e.g. X-Moderation-Context-Type: profile_pic
+PARAM_HEADER_PREFIX = 'X-Moderation-'
+RAW_IMAGE_MIMETYPE = 'application/octet-stream'
+# Node's upload directory when it shares a filesystem with this server (unset disables image_path)
+SHARED_UPLOAD_ROOT = os.getenv('SHARED_UPLOAD_ROOT')
+UNIX_SOCKET = os.getenv('UNIX_SOCKET')
+
+
+class BufferedUploadRequest(Request):
+    """Flask request class that buffers file uploads in memory (set as app.request_class)"""
+
+    def _get_file_stream(self, total_content_length: Optional[int], content_type: Optional[str],
+                         filename: Optional[str] = None, content_length: Optional[int] = None) -> IO[bytes]:
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPILL_THRESHOLD, mode='rb+', dir=UPLOAD_SPILL_DIR)
+
+
+def read_upload(file_storage: FileStorage) -> bytes:
+    """Bytes of an uploaded file, read from the request buffer"""
+    stream = file_storage.stream
+    stream.seek(0)
+    return stream.read()
+
+
+def decode_upload_bgr(image_bytes: bytes) -> np.ndarray:
+    """Decode encoded image bytes to a BGR array, exactly as cv2.imread would from a file"""
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError('Could not decode image data')
+    return image
+
+
+def request_params(req: Request) -> Dict[str, str]:
+    """Request parameters from X-Moderation-* headers, the query string and the form (later wins)"""
+    params = {}
+    for name, value in req.headers.items():
+        if name.lower().startswith(PARAM_HEADER_PREFIX.lower()):
+            params[name[len(PARAM_HEADER_PREFIX):].lower().replace('-', '_')] = value
+    params.update(req.args.to_dict())
+    params.update(req.form.to_dict())
+    if req.is_json:
+        # Node posts {image_path, model_id, context_type}; keep values as form-style strings
+        body = req.get_json(silent=True)
+        if body is None and req.get_data(cache=True):
+            raise ValueError('Invalid JSON body')
+        if body is not None and not isinstance(body, dict):
+            raise ValueError('JSON body must be an object')
+        params.update({key: str(value).lower() if isinstance(value, bool) else str(value)
+                       for key, value in (body or {}).items() if value is not None and not isinstance(value, (dict, list))})
+    return params
+
+
+def is_raw_image(req: Request) -> bool:
+    return req.mimetype == RAW_IMAGE_MIMETYPE
+
+
+def read_raw_image(req: Request) -> bytes:
+    """Encoded image sent as the whole request body"""
+    image_bytes = req.get_data(cache=False)
+    if not image_bytes:
+        raise ValueError('Empty request body')
+    return image_bytes
+
+
+def resolve_shared_path(image_path: str, root: Optional[str] = None) -> str:
+    """Real path of image_path inside the shared upload root; refuses anything outside it"""
+    root = root or SHARED_UPLOAD_ROOT
+    if not root:
+        raise PermissionError('image_path requires SHARED_UPLOAD_ROOT to be configured')
+    root = os.path.realpath(root)
+    # Absolute paths (what Node sends) must already point inside the root; relative ones are joined to it
+    full_path = os.path.realpath(os.path.join(root, image_path))
+    if os.path.commonpath([root, full_path]) != root:
+        raise PermissionError(f'image_path is outside the shared upload root: {image_path}')
+    if not os.path.isfile(full_path):
+        raise FileNotFoundError(f'Image not found: {image_path}')
+    return full_path
+
+
+def read_shared_upload(image_path: str, root: Optional[str] = None) -> bytes:
+    """Bytes of a file Node already wrote to the shared upload directory"""
+    with open(resolve_shared_path(image_path, root), 'rb') as f:
+        return f.read()
+
+
+def request_image(req: Request, field: str = 'image') -> Tuple[Optional[bytes], Dict[str, str]]:
+    """Image bytes and parameters from a raw body, a multipart field or a shared image_path
+
+    Returns (None, params) when the request carries no image at all.
+    """
+    params = request_params(req)
+    if is_raw_image(req):
+        return read_raw_image(req), params
+    if field in req.files:
+        file_storage = req.files[field]
+        if file_storage.filename == '':
+            raise ValueError('Empty filename')
+        return read_upload(file_storage), params
+    if params.get('image_path'):
+        return read_shared_upload(params['image_path']), params
+    return None, params
+
+
+def listen_address(host: str, port: int) -> Tuple[str, int]:
+    """(host, port) for app.run(): a unix:// address when UNIX_SOCKET is set"""
+    if UNIX_SOCKET:
+        if os.path.exists(UNIX_SOCKET):
+            os.unlink(UNIX_SOCKET)
+        return f'unix://{UNIX_SOCKET}', 0
+    return host, port